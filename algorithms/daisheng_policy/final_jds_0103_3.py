@@ -1062,7 +1062,7 @@ class MyPolicy:
         previous_obs = self.previous_obs if current_obs.step > 0 else None
         my_obs, my_viewed = cal_obs(current_obs, previous_obs)
         global contaminated
-        new_obs = copy.deepcopy(current_obs)
+        new_obs = current_obs.fork()
         for cell_id in current_obs.cells:
             if cell_id in my_viewed:
                 new_obs.cells[cell_id]._carbon = my_obs[cell_id].carbon
@@ -1076,7 +1076,7 @@ class MyPolicy:
         # overall_action = self.to_env_commands(overall_action)
 
         # agent_obs_dict, dones, available_actions_dict = self.obs_parser.obs_transform(current_obs, previous_obs)
-        self.previous_obs = copy.deepcopy(current_obs)
+        self.previous_obs = current_obs.fork()
 
         return overall_action
 
@@ -23,7 +23,7 @@ class EvalPolicy(BasePolicy):
     """
     def __init__(self):
         super().__init__()
-        self.obs_parser = ObservationParser()
+        self.obs_parser = ObservationParser(cached=True)  # 特征在take_action内即被使用, 可以复用缓冲区
         self.previous_obs = None
 
         self.tensor_kwargs = {"dtype": torch.float32, "device": torch.device("cpu")}
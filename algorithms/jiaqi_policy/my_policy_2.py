@@ -4,6 +4,7 @@ import random
 from abc import abstractmethod
 
 # from envs.obs_parser import ObservationParser
+from zerosum_env.envs.carbon.geometry import get_geometry
 from zerosum_env.envs.carbon.helpers import (Board, Cell, Collector, Planter,
                                              Point, RecrtCenter,
                                              RecrtCenterAction, WorkerAction)
@@ -28,6 +29,7 @@ CARBON_SATISFY_PLANTER = 100   # 要小一些，在敌方基地附近种树
 COLLECTOR_CARBON_CARRY_LIMIT = 150    # 捕碳员携带碳上限
 CELL_CARBON_REMAIN = 50  # 单元当前含碳量小于该值，捕碳员会去其他位置补碳
 GO_HOME_STEPS = 290  # 这个步数之后智能体开始返回基地
+BOARD_GEOMETRY = get_geometry(15)  # 棋盘大小是 15 * 15, 邻居与距离均查表得到
 
 
 class BasePolicy:
@@ -140,18 +142,10 @@ class AgentBase:
 
         return max_carbon_map
 
-    @ staticmethod
-    def _minimum_distance(point_1, point_2):
-        abs_distance = abs(point_1 - point_2)
-        cross_distance = min(point_1, point_2) + (15 - max(point_1, point_2))
-        return min(abs_distance, cross_distance)
-
     def _calculate_distance(self, current_position, target_position):
         """计算真实距离，计算跨图距离，取两者最小值"""
-        x_distance = self._minimum_distance(current_position[0], target_position[0])
-        y_distance = self._minimum_distance(current_position[1], target_position[1])
-
-        return x_distance + y_distance
+        return BOARD_GEOMETRY.distance_xy(current_position[0], current_position[1],
+                                          target_position[0], target_position[1])
 
     # def _check_surround_validity(self, random_move, worker) -> bool:
     #     raise NotImplementedError
@@ -162,10 +156,7 @@ class AgentBase:
 
 
 def old_to_new_position(old_position, move_point: Point):
-    new_position = old_position + move_point
-    new_position = str(new_position).replace("15", "0")
-    new_position = Point(*eval(new_position.replace("-1", "14")))
-    return new_position
+    return BOARD_GEOMETRY.translate(old_position, move_point)
 
 # ---------------------------------------------------------------------------------------------------------------------
 
@@ -177,13 +168,7 @@ def calculate_carbon_contain(map_carbon_cell: Dict) -> Dict:
     carbon_contain_dict = dict()  # 用来存储地图上每一个位置周围4个位置当前的碳含量, {(0, 0): 32}
     for _loc, cell in map_carbon_cell.items():
 
-        valid_loc = [(_loc[0], _loc[1] - 1),
-                     (_loc[0] - 1, _loc[1]),
-                     (_loc[0] + 1, _loc[1]),
-                     (_loc[0], _loc[1] + 1)]  # 四个位置，按行遍历时从小到大
-
-        forced_pos_valid_loc = str(valid_loc).replace('-1', '14')  # 因为棋盘大小是 15 * 15
-        forced_pos_valid_loc = [Point(*_i) for _i in eval(forced_pos_valid_loc.replace('15', '0'))]
+        forced_pos_valid_loc = BOARD_GEOMETRY.quad_points[_loc]  # 上下左右四个位置 (已处理越界)
 
         filter_cell = \
             [_c for _, _c in map_carbon_cell.items() if getattr(_c, "position", Point(-100, -100)) in forced_pos_valid_loc]
@@ -153,8 +153,8 @@ class LearnerPolicy(BasePolicy):
         train_logs = []
         for _ in range(self.training_times):
             batch_size = self.batch_size
-            for indices in buffer.get_batches_starting_indexes(batch_size):
-                train_log = self._train(buffer.sample_batch_by_indices(indices))
+            for batch in buffer.iter_batches(batch_size):
+                train_log = self._train(batch)
                 if not train_log:
                     continue
                 train_logs.append(train_log)
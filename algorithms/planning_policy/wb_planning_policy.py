@@ -4,12 +4,14 @@ from abc import ABC, abstractmethod
 from typing import Dict, Tuple, List, Optional
 import numpy as np
 
+from zerosum_env.envs.carbon.geometry import get_geometry
 from zerosum_env.envs.carbon.helpers import \
     (Board, Player, Cell, Collector, Planter, Point,
         RecrtCenter, Tree, Worker, RecrtCenterAction, WorkerAction)
 from random import randint, shuffle, choice, choices
 
 AREA_SIZE = 15
+AREA_GEOMETRY = get_geometry(AREA_SIZE)
 MAX_TREE_AGE = 50  # 树最大50岁
 TOP_CARBON_CONTAIN = 100  # 选择 top n 的碳含量单元格
 PREEMPT_BONUS = 50000  # 抢树偏好
@@ -27,13 +29,7 @@ danger_zone: Dict[Point, int] = {}  # 保存种树员的危险区域，不能走
 our_agent_next_posistions: Dict[Point, int] = {}
 
 def get_distance(p1: Point, p2: Point) -> int:
-    x1, y1 = p1[0], p1[1]
-    x2, y2 = p2[0], p2[1]
-    x_1_to_2 = (x1 - x2 + AREA_SIZE) % AREA_SIZE
-    y_1_to_2 = (y1 - y2 + AREA_SIZE) % AREA_SIZE
-    dis_x = min(AREA_SIZE - x_1_to_2, x_1_to_2)
-    dis_y = min(AREA_SIZE - y_1_to_2, y_1_to_2)
-    return dis_x + dis_y
+    return AREA_GEOMETRY.distance_xy(p1[0], p1[1], p2[0], p2[1])
 
 
 class AgentBase:
@@ -0,0 +1,201 @@
+import time
+from typing import Dict, List
+
+from easydict import EasyDict
+import numpy as np
+
+from algorithms.base_policy import BasePolicy
+from zerosum_env.envs.carbon.array_board import ArrayBoard
+from zerosum_env.envs.carbon.geometry import Directions, get_geometry
+from zerosum_env.envs.carbon.helpers import Configuration
+
+
+class SearchPolicy(BasePolicy):
+    """
+    Lookahead search policy: candidate joint moves of my workers are evaluated by rollouts through the carbon
+    transition rules, all rollouts of a round run together as the games of one ArrayBoard.
+
+    Every round samples n_candidates joint moves, plays each of them n_rollouts times for depth steps
+    (first step: the candidate moves; then both players follow the cheap default policy, the opponent follows it
+    from the first step), and scores a candidate by the mean gain of my cash plus carried carbon.
+    Rounds are repeated until time_fraction of configuration.actTimeout is spent, the best candidate is played.
+    Collectors are recruited by a simple rule, planters are never recruited.
+    """
+    def __init__(self, n_candidates=64, n_rollouts=4, depth=4, time_fraction=0.5, move_probability=0.6,
+                 return_carbon=60, carried_weight=0.5, max_workers=8, seed=None):
+        """
+        :param n_candidates: (int) joint moves evaluated per round
+        :param n_rollouts: (int) rollouts per candidate, the opponent's random moves are shared between candidates
+        :param depth: (int) simulated steps per rollout
+        :param time_fraction: (float) fraction of configuration.actTimeout the search may use
+        :param move_probability: (float) probability of a random move of an idle worker in the default policy
+        :param return_carbon: (float) collectors carrying at least this carbon go back to a base in the default policy
+        :param carried_weight: (float) value of the carbon carried by my collectors relative to cash
+        :param max_workers: (int) collectors are recruited while the player has fewer workers
+        :param seed: (int optional) seed of the candidate and rollout sampling
+        """
+        super().__init__()
+        self.n_candidates = n_candidates
+        self.n_rollouts = n_rollouts
+        self.depth = depth
+        self.time_fraction = time_fraction
+        self.move_probability = move_probability
+        self.return_carbon = return_carbon
+        self.carried_weight = carried_weight
+        self.max_workers = max_workers
+        self.rng = np.random.default_rng(seed)
+        self.stats = EasyDict(rounds=0, rollouts=0, rollout_steps=0, seconds=0.0)
+
+        self._carbon_belief = None  # 上次看到的各格子碳含量, 未看到的格子按再生率估计
+        self._last_step = -1
+
+    def policy_reset(self, episode: int, n_episodes: int):
+        self._carbon_belief = None
+        self._last_step = -1
+
+    @property
+    def rollout_steps_per_second(self) -> float:
+        """Simulated game steps per second of search (all candidates and rollouts), over the whole game."""
+        return self.stats.rollout_steps / self.stats.seconds if self.stats.seconds > 0 else 0.0
+
+    def _believed_carbon(self, observation, configuration: Configuration) -> List[float]:
+        """
+        Unseen cells are reported as 0 in the observation: keep the last seen value of each cell and let it
+        regenerate while it is out of sight.
+        """
+        size = configuration.size
+        geometry = get_geometry(size)
+        if self._carbon_belief is None or observation.step <= self._last_step:
+            prior = configuration.starting_carbon / (size * size)
+            self._carbon_belief = np.full(size * size, prior, dtype=np.float64)
+        else:
+            self._carbon_belief = np.minimum(self._carbon_belief * (1 + configuration.regen_rate),
+                                             configuration.max_cell_carbon)
+        self._last_step = observation.step
+
+        visible = []
+        for worker_index, _, worker_type in observation.players[observation.player][2].values():
+            if worker_type == "PLANTER":
+                visible.extend(geometry.quad[worker_index].tolist())
+            else:
+                visible.append(worker_index)
+        carbon = np.asarray(observation.carbon, dtype=np.float64)
+        self._carbon_belief[visible] = carbon[visible]
+        for _, player_bases, _, _ in observation.players:
+            self._carbon_belief[list(player_bases.values())] = 0
+        return self._carbon_belief.tolist()
+
+    def _default_actions(self, board: ArrayBoard, workers: np.ndarray, uniform: np.ndarray,
+                         directions: np.ndarray) -> np.ndarray:
+        """
+        Cheap default policy over all games: loaded collectors move towards their nearest base, the other workers
+        move in a random direction with move_probability. uniform / directions hold the random draws per worker slot.
+        """
+        geometry = get_geometry(board.size)
+        actions = np.where(uniform < self.move_probability, directions, 0)
+
+        loaded = workers & ~board.w_planter & (board.w_carbon >= self.return_carbon)
+        if loaded.any():
+            games, slots = loaded.nonzero()
+            players = board.w_player[games, slots]
+            bases = board.base_pos[games, players]  # dim: loaded x n_bases
+            bases_alive = board.base_alive[games, players]
+            reachable = geometry.move[board.w_pos[games, slots]]  # dim: loaded x 5
+            distances = geometry.distances[reachable[:, :, None], bases[:, None, :]]
+            distances = np.where(bases_alive[:, None, :], distances, np.iinfo(np.int64).max).min(axis=2)
+            has_base = bases_alive.any(axis=1)
+            actions[games[has_base], slots[has_base]] = distances[has_base].argmin(axis=1)
+        return np.where(workers, actions, 0)
+
+    def _random_draws(self, n_games: int, n_slots: int):
+        return self.rng.random((n_games, n_slots)), self.rng.integers(1, 5, size=(n_games, n_slots))
+
+    def _sample_candidates(self, root: ArrayBoard, my_slots: np.ndarray, first_round: bool) -> np.ndarray:
+        """
+        Joint moves of my workers, dim: n_candidates x len(my_slots). The first round always contains
+        "all stay" and the default policy's moves.
+        """
+        candidates = self.rng.integers(0, 5, size=(self.n_candidates, len(my_slots)))
+        if first_round:
+            candidates[0] = 0
+            uniform, directions = self._random_draws(1, root.w_alive.shape[1])
+            candidates[1] = self._default_actions(root, root.w_alive, np.ones_like(uniform), directions)[0, my_slots]
+        return candidates
+
+    def _evaluate(self, root: ArrayBoard, me: int, my_slots: np.ndarray, candidates: np.ndarray,
+                  base_actions: np.ndarray) -> np.ndarray:
+        """Mean score of each candidate over n_rollouts rollouts, all rollouts are stepped together."""
+        n_candidates, n_rollouts = len(candidates), self.n_rollouts
+        board = root.select(np.zeros(n_candidates * n_rollouts, dtype=np.int64))  # game: candidate * n_rollouts + r
+        initial_value = self._value(root, me)[0]
+
+        for depth in range(self.depth):
+            n_slots = board.w_alive.shape[1]
+            uniform, directions = self._random_draws(n_rollouts, n_slots)
+            uniform, directions = np.tile(uniform, (n_candidates, 1)), np.tile(directions, (n_candidates, 1))
+            actions = self._default_actions(board, board.w_alive, uniform, directions)
+            if depth == 0:
+                actions[:, my_slots] = np.repeat(candidates, n_rollouts, axis=0)
+                board.base_action[:, me] = base_actions
+            board.w_action[:] = actions
+            board.advance()
+
+        self.stats.rollouts += board.n_games
+        self.stats.rollout_steps += board.n_games * self.depth
+        gains = self._value(board, me) - initial_value
+        return gains.reshape(n_candidates, n_rollouts).mean(axis=1)
+
+    def _value(self, board: ArrayBoard, me: int) -> np.ndarray:
+        carried = np.where(board.w_alive & (board.w_player == me) & ~board.w_planter, board.w_carbon, 0).sum(axis=1)
+        return board.cash[:, me] + self.carried_weight * carried
+
+    def _recruit_actions(self, root: ArrayBoard, me: int, configuration: Configuration) -> np.ndarray:
+        """RECCOLLECTOR (code 1) on my first base while I have fewer than max_workers workers and enough cash."""
+        base_actions = np.zeros(root.n_bases, dtype=np.int8)
+        n_workers = (root.w_alive[0] & (root.w_player[0] == me)).sum()
+        n_collectors = (root.w_alive[0] & ~root.w_planter[0]).sum()
+        cost = configuration.rec_collector_cost + n_collectors * configuration.rec_collector_increase_cost
+        alive_bases = root.base_alive[0, me].nonzero()[0]
+        if len(alive_bases) and n_workers < min(self.max_workers, configuration.worker_limit) and \
+                root.cash[0, me] >= cost:
+            base_actions[alive_bases[0]] = 1
+        return base_actions
+
+    def take_action(self, observation, configuration) -> Dict[str, str]:
+        start = time.time()
+        configuration = Configuration(configuration)
+        me = observation.player
+        raw_observation = {
+            "carbon": self._believed_carbon(observation, configuration),
+            "players": observation.players,
+            "player": me,
+            "step": observation.step,
+            "trees": observation.trees,
+            "remainingOverageTime": observation.remainingOverageTime,
+        }
+        root = ArrayBoard([raw_observation], configuration)
+        my_slots = (root.w_alive[0] & (root.w_player[0] == me)).nonzero()[0]
+        base_actions = self._recruit_actions(root, me, configuration)
+
+        best_moves, best_score = np.zeros(len(my_slots), dtype=np.int64), -np.inf
+        budget = configuration.act_timeout * self.time_fraction
+        n_rounds, round_time = 0, 0.0
+        # 至少搜索一轮, 之后仅在预计下一轮能在时限内完成时继续
+        while len(my_slots) and (n_rounds == 0 or time.time() - start + round_time < budget):
+            round_start = time.time()
+            candidates = self._sample_candidates(root, my_slots, first_round=n_rounds == 0)
+            scores = self._evaluate(root, me, my_slots, candidates, base_actions)
+            if scores.max() > best_score:
+                best_score, best_moves = scores.max(), candidates[scores.argmax()]
+            round_time = time.time() - round_start
+            n_rounds += 1
+        self.stats.rounds += n_rounds
+        self.stats.seconds += time.time() - start
+
+        commands = {}
+        for slot, code in zip(my_slots.tolist(), best_moves.tolist()):
+            if code > 0:
+                commands[root.w_ids[0, slot]] = Directions[code - 1]
+        for base in base_actions.nonzero()[0].tolist():
+            commands[root.base_ids[0, me, base]] = "RECCOLLECTOR"
+        return commands
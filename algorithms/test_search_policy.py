@@ -0,0 +1,53 @@
+import copy
+import random
+
+import numpy as np
+
+from algorithms.search_policy.search_policy import SearchPolicy
+from zerosum_env import make
+
+
+class TestSearchPolicy:
+    def test_take_action(self):
+        random.seed(0)
+        np.random.seed(0)
+        configuration = {"randomSeed": 0, "actTimeout": 0.2}
+        policy = SearchPolicy(n_candidates=16, seed=0)
+        env = make("carbon", configuration=configuration, trusted=True, history="none")
+        env.reset(2)
+
+        for _ in range(30):
+            observation = env.steps[-1][0].observation
+            commands = policy.take_action(observation, env.configuration)
+
+            _, recrtCenters, workers, _ = observation.players[observation.player]
+            for agent_id, command in commands.items():
+                if agent_id in workers:
+                    assert command in ("UP", "RIGHT", "DOWN", "LEFT")
+                else:
+                    assert agent_id in recrtCenters and command == "RECCOLLECTOR"
+            env.step([commands, {}])
+        assert policy.stats.rounds >= 30 and policy.rollout_steps_per_second > 0
+        # 搜索只使用time_fraction的时限, 按整局的平均耗时检查 (单步耗时受机器负载影响)
+        assert policy.stats.seconds / 30 < env.configuration.actTimeout
+
+    def test_collects_carbon(self):
+        # actTimeout为0时只搜索一轮, 结果只由seed决定
+        env = make("carbon", configuration={"randomSeed": 0, "actTimeout": 0}, trusted=True)
+        observation = env.steps[-1][0].observation
+        size = env.configuration.size
+        position = (list(observation.players[0][1].values())[0] + 5 * size + 5) % (size * size)
+
+        def best_move(cell_carbon, seed):
+            position_observation = copy.deepcopy(observation)
+            position_observation.players[0][2] = {"player-0-worker-0": [position, 0, "COLLECTOR"]}
+            position_observation.carbon = [0] * (size * size)
+            position_observation.carbon[position] = cell_carbon  # 捕碳员只能看到所在的格子
+            policy = SearchPolicy(n_rollouts=16, seed=seed)
+            commands = policy.take_action(position_observation, env.configuration)
+            assert policy.stats.rounds == 1
+            return commands.get("player-0-worker-0")
+
+        for seed in range(5):
+            assert best_move(100, seed) is None  # 所在格子碳多: 原地收集
+            assert best_move(0, seed) in ("UP", "RIGHT", "DOWN", "LEFT")  # 所在格子没有碳: 移动到其他格子收集
@@ -1,12 +1,10 @@
+import argparse
+import os
 import sys
-import easydict
 sys.path.append("game")
-import torch
 import time
 import random
 from easydict import EasyDict 
-from zerosum_env import make, evaluate
-from zerosum_env.envs.carbon.helpers import *
 
 
 
@@ -15,73 +13,70 @@ from algorithms.planning_policy.planning_policy import PlanningPolicy
 from algorithms.planning_policy.wb_planning_policy import PlanningPolicy as WbPolicy
 from algorithms.jiaqi_policy.my_policy_2 import MyPolicy as JiaqiPolicy
 from algorithms.planning_policy.planning_policy_jds import PlanningPolicyJDS as JdsPolicy
+from algorithms.search_policy.search_policy import SearchPolicy
+from utils.tournament import play_match, run_tournament, summarize, format_summary
 
 
 
-def run_experiment(policy_class_A,policy_class_B):
-    policy_A = policy_class_A()
-    policy_B = policy_class_B()
+def run_experiment(policy_class_A, policy_class_B, render=False, seed=None):
+    """
+    Play one game of policy A (first player) against policy B with utils.tournament.play_match.
+    """
+    seed = random.randint(1, 100) if seed is None else seed
+    match = play_match("A", "B", seed, render=render, policy_factories={"A": policy_class_A, "B": policy_class_B})
 
-    logs=[]
-    env = make(
-            "carbon",
-            configuration={"randomSeed": random.randint(1, 100)},
-            logs=logs)
-    env.reset()
-    info = env.run([policy_A.take_action, policy_B.take_action])
-    env.render(mode="ipython", width=1000, height=700)
-
-    result=EasyDict()
-
-    result.dual=result.B_normal_win=result.A_normal_win=result.A_win_B_error=result.B_win_A_error=0
-
-    player_a, player_b = info[-1]
-    if player_a['reward'] == player_b['reward']:
+    result = EasyDict(dual=0, B_normal_win=0, A_normal_win=0, A_win_B_error=0, B_win_A_error=0)
+    if match["winner"] == "draw":
         print("平局!")
         result.dual = 1
-    elif player_a['reward'] is None:
-        print(f"队伍B获胜 ({player_b['reward']})!")
-        result.B_win_A_error = 1
-    elif player_b['reward'] is None:
-        print(f"队伍A获胜 ({player_a['reward']})!")
-        result.A_win_B_error = 1
-    elif player_a['reward'] > player_b['reward']:
-        print(f"队伍A获胜 ({player_a['reward']})!")
-        result.A_normal_win = 1
+    elif match["winner"] == "A":
+        print(f"队伍A获胜 ({match['reward_a']})!")
+        if match["reward_b"] is None:
+            result.A_win_B_error = 1
+        else:
+            result.A_normal_win = 1
     else:
-        print(f"队伍B获胜 ({player_b['reward']})!")
-        result.B_normal_win = 1
-    
-    result.A_relative_win=result.A_win_B_error+result.A_normal_win -result.B_win_A_error-result.B_normal_win
-    result.experiment_count=1
+        print(f"队伍B获胜 ({match['reward_b']})!")
+        if match["reward_a"] is None:
+            result.B_win_A_error = 1
+        else:
+            result.B_normal_win = 1
+
+    result.A_relative_win = result.A_win_B_error + result.A_normal_win - result.B_win_A_error - result.B_normal_win
+    result.experiment_count = 1
     return result
-    
 
-def run_experiments(policy_class_A,policy_class_B,experiment_count:int):
-    # set random seed by time
-    random.seed(time.time())
-    total_result=None
+
+def run_experiments(policy_class_A, policy_class_B, experiment_count: int):
+    rng = random.Random(time.time())  # play_match会重置random, 种子由独立的生成器抽取
+    total_result = None
     for i in range(experiment_count):
         print(f"running epoch {i+1}/{experiment_count}")
-        single_experiment_result=run_experiment(policy_class_A,policy_class_B)
+        single_experiment_result = run_experiment(policy_class_A, policy_class_B, seed=rng.randint(1, 100))
         if total_result is None:
-            total_result=single_experiment_result
+            total_result = single_experiment_result
         else:
             for key in total_result.keys():
-                total_result[key]+=single_experiment_result[key]
+                total_result[key] += single_experiment_result[key]
     return total_result
 
 
-
 def main():
-    policy_class_list = [PlanningPolicy, JiaqiPolicy,WbPolicy,JdsPolicy]
-    all_policy_class_total_results=[]
-    for policy_class_A in policy_class_list:
-        for policy_class_B in policy_class_list:
-            if policy_class_A is policy_class_B: continue
-            total_result=run_experiments(policy_class_A,policy_class_B,10)
-    all_policy_class_total_results.append((policy_class_A,policy_class_B,total_result))
-    print(all_policy_class_total_results)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--n_games', type=int, default=10, help="每对策略在每个座位上的对局数(种子为0..n_games-1)")
+    parser.add_argument('--output', type=str, default="tournament.jsonl", help=".jsonl 或 .csv, 已有的对局会被跳过")
+    args = parser.parse_args()
+
+    policy_factories = {
+        "PlanningPolicy": PlanningPolicy,
+        "JiaqiPolicy": JiaqiPolicy,
+        "WbPolicy": WbPolicy,
+        "JdsPolicy": JdsPolicy,
+        "SearchPolicy": SearchPolicy,
+    }
+    results = run_tournament(policy_factories, range(args.n_games), args.output, n_workers=args.n_workers)
+    print(format_summary(summarize(results)))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
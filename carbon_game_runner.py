@@ -9,6 +9,7 @@ import torch
 from utils.utils import synthesize
 from utils.trajectory_buffer import TrajectoryBuffer
 from utils.replay_buffer import ReplayBuffer
+from zerosum_env.profiling import StepProfiler
 
 from algorithms.base_policy import BasePolicy
 from algorithms.learner_policy import LearnerPolicy
@@ -38,7 +39,9 @@ class CarbonGameRunner:
 
         self._env_output = None
         self._trajectory_buffer = TrajectoryBuffer()
-        self._replay_buffer = ReplayBuffer(cfg.main_config.runner.buffer_size, cfg.main_config.runner.device)
+        self._replay_buffer = ReplayBuffer(cfg.main_config.runner.buffer_size, cfg.main_config.runner.device,
+                                           obs_dtype=cfg.main_config.runner.get("buffer_obs_dtype", torch.float32),
+                                           pin_memory=cfg.main_config.runner.get("buffer_pin_memory", False))
 
         self.learner_policy = LearnerPolicy(cfg)  # 待训练的策略
 
@@ -49,6 +52,13 @@ class CarbonGameRunner:
         # 收集的训练/统计相关信息
         self._env_returns = defaultdict(float)  # env_id, returns
 
+        # 按阶段统计环境step的耗时, 每个episode写入tensorboard和run_dir/profile.json
+        self.profiler = None
+        if cfg.main_config.runner.get("profile", False):
+            self.profiler = StepProfiler().start()
+            if hasattr(self.env, "collect_profile"):
+                self.env.collect_profile(self.profiler)  # 开始记录子进程
+
     def run(self):
         """
         Collect training data, perform training updates, and evaluate policy.
@@ -104,6 +114,21 @@ class CarbonGameRunner:
                 for field, value in train_logs.items():
                     self.tb_writer.add_scalar(field, value, episode)
 
+            if self.profiler is not None:
+                self.write_profile(episode)
+
+    def write_profile(self, episode: int):
+        """
+        Write the step profile of the episode (main and worker processes) into tensorboard and a json report.
+        :param episode: (int) Indicates the current episode
+        """
+        if hasattr(self.env, "collect_profile"):
+            self.env.collect_profile(self.profiler)
+        if self.tb_writer is not None:
+            self.profiler.write_tensorboard(self.tb_writer, episode)
+        self.profiler.save_json(str(self._cfg.run_dir / "profile.json"))
+        self.profiler.reset()
+
     def collect_full_episode(self) -> Tuple[List[List[Dict[str, Dict]]], Dict[str, float]]:
         """
         collect full transitions and statistical logs during the full episode.
@@ -137,17 +162,17 @@ class CarbonGameRunner:
         policy_outputs = []
         for policy_id, env_output in enumerate(env_outputs):  # 每个选手
             current_policy = self.policies[policy_id]
-            policy_output = self.policy_actions_values(current_policy, env_output)  # 策略输出结果
+            policy_output, (agent_ids, policy_batch) = self.policy_actions_values(current_policy, env_output)
 
-            if current_policy.can_sample_trajectory():  # 添加以作为训练数据
-                self._trajectory_buffer.add_policy_data(policy_id, policy_output)
+            if current_policy.can_sample_trajectory():  # 添加以作为训练数据 (按环境整批写入)
+                self._trajectory_buffer.add_policy_batch(policy_id, agent_ids, policy_batch)
 
             policy_outputs.append(policy_output)
         policy_outputs = {key: [d[key] for d in policy_outputs] for key in policy_outputs[0]}  # env first, then policy
 
         # a(t) -> r(t), S(t+1), done(t+1)
         env_commands = self.to_env_commands(policy_outputs)
-        raw_env_output = self.env.step(env_commands)
+        raw_env_output = self._step_envs(env_commands)
         env_outputs = raw_env_output if self.selfplay else [raw_env_output]
 
         for policy_id, env_output_ in enumerate(env_outputs):
@@ -202,6 +227,27 @@ class CarbonGameRunner:
         self._env_output = raw_env_output
         return return_data, collect_log
 
+    def _step_envs(self, env_commands: List[Union[Dict, List[Dict]]]) -> List[Any]:
+        """
+        Step all environments, the outputs are the same as env.step.
+        With ParallelEnv, only the stacking of each env's agent observations overlaps with the slower envs. The next
+        policy forward pass is still batched over all envs and waits for the slowest one.
+        """
+        if not hasattr(self.env, "iter_step_wait"):  # VectorCarbonEnv: 所有对局在一次调用中完成
+            return self.env.step(env_commands)
+
+        self.env.step_async(env_commands)
+        total_outputs = [None] * self.n_threads
+        for env_id, env_output in self.env.iter_step_wait():  # 按环境完成的顺序
+            for output in (env_output if self.selfplay else [env_output]):
+                if len(output['obs']) > 0:
+                    output['obs'] = np.stack(output['obs'])  # (n_agents, observation_dim)
+            total_outputs[env_id] = env_output
+
+        if self.selfplay:  # 拆分出player1, player2的数据
+            total_outputs = [[v[i] for v in total_outputs] for i, _ in enumerate(total_outputs[0])]
+        return total_outputs
+
     def to_env_commands(self, policy_outputs: Dict[int, List[Dict[str, EasyDict]]]) -> List[Union[Dict, List[Dict]]]:
         """
         Extract policy outputs' action value and turn to environment acceptable action command.
@@ -224,18 +270,22 @@ class CarbonGameRunner:
             env_commands.append(policy_commands)
         return env_commands
 
-    def policy_actions_values(self, policy: BasePolicy,
-                              env_output: List[Dict[str, Any]]) -> Dict[int, Dict[str, EasyDict]]:
+    def policy_actions_values(self, policy: BasePolicy, env_output: List[Dict[str, Any]]) \
+            -> Tuple[Dict[int, Dict[str, EasyDict]], Tuple[List[List[str]], Dict[str, np.ndarray]]]:
         """
         Return actions and values predicted by policy according to environment outputs.
         :param policy: (BasePolicy) current policy instance
         :param env_output: (List[Dict[str, Any]]) environment output related to the current policy
         :return: policy_output: (Dict[int, Dict[str, EasyDict]]) policy output for each environments and agents
+        :return: (agent_ids, policy_batch): agent ids of each environment, and the same policy output as flat arrays
+            (agents of all environments in order), used by TrajectoryBuffer.add_policy_batch
         """
         agent_ids, obs, available_actions = zip(*[(output['agent_id'], output['obs'], output['available_actions'])
                                                   for output in env_output])
-        flatten_obs = [value for env_obs in obs for value in env_obs]
-        flatten_obs_tensor = torch.from_numpy(np.stack(flatten_obs))
+        # 各环境的观测为agent特征的列表, 或已在等待其他环境时拼接好的数组 (_step_envs)
+        flatten_obs = np.concatenate([env_obs if isinstance(env_obs, np.ndarray) else np.stack(env_obs)
+                                      for env_obs in obs if len(env_obs) > 0])
+        flatten_obs_tensor = torch.from_numpy(flatten_obs)
         flatten_available_actions = np.concatenate(available_actions)
 
         flatten_action, flatten_log_prob = policy.get_actions(flatten_obs_tensor, flatten_available_actions)  # a(t)
@@ -253,7 +303,10 @@ class CarbonGameRunner:
                     available_actions=flatten_available_actions[c],
                 ))
                 c += 1
-        return policy_output
+
+        policy_batch = dict(obs=flatten_obs, action=flatten_action, log_prob=flatten_log_prob,
+                            value=flatten_value, available_actions=flatten_available_actions)
+        return policy_output, (agent_ids, policy_batch)
 
     def compute_returns(self, trajectory: Dict[str, List[Any]], next_value=0, use_gae=False):
         """
@@ -11,15 +11,20 @@ config = dict(
     ),
     envs=dict(  # 训练Env
         experient_name='runs',
-        n_threads=8,  # 并行进程数
+        n_threads=8,  # 并行进程数 (vectorized为True时, 为单进程内批量运行的对局数)
+        vectorized=False,  # 使用VectorCarbonEnv, 在单进程内批量运行所有对局
+        shared_memory=True,  # ParallelEnv子进程通过共享内存传递agent特征, 仅通过管道发送元数据
         seed=42,
         training_from_scratch=False,  # False
+        reward_shaping=dict(),  # 覆盖agent奖励的默认参数 (envs.reward.default_reward_shaping)
     ),
     runner=dict(  # 训练配置项
         episodes=2000,
         episode_length=300,
         save_interval=1,  # 多少个epoch保存下模型
         buffer_size=20000,
+        buffer_obs_dtype=torch.float32,  # replay buffer中观测的存储类型, torch.float16可减半内存
+        buffer_pin_memory=False,  # replay buffer存放于锁页内存, 训练时异步拷贝minibatch到GPU (仅cuda)
         device=torch.device("cuda" if torch.cuda.is_available() else "cpu"),
         policy=dict(  # 训练策略参数
             actor_model=Model(),
@@ -38,6 +43,7 @@ config = dict(
         gamma=0.995,
         use_gae=False,
         gae_lambda=0.95,
+        profile=False,  # 按阶段统计环境step的耗时 (zerosum_env.profiling), 写入tensorboard和profile.json
 
         # self-play parameters
         selfplay=False,
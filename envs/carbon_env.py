@@ -18,7 +18,7 @@ class AgentRunner:
         act_args = [
             (
                 agent,
-                self.env._Environment__get_shared_state(i),
+                self.env._Environment__get_shared_state(i) if agent is not None else self.env.states[i],
                 self.env.configuration,
                 none_actions[i] if none_actions is not None else None,
             )
@@ -37,7 +37,9 @@ class CarbonEnv:
     def __init__(self, cfg: dict):
         self.env = make("carbon",
                         configuration=cfg,
-                        debug=True)  # 创建一个env对象
+                        debug=True,
+                        trusted=True,  # 动作由训练代码生成, 跳过每步的schema校验
+                        history="none")  # 创建一个env对象, 仅读取steps[-1], 不保留历史
 
         self._runner = None
 
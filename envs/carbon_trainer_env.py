@@ -1,13 +1,15 @@
 from collections import defaultdict
-from typing import Dict, Union, Tuple, List
+from typing import Dict, Optional, Union, Tuple, List
 
 from easydict import EasyDict
 import gym
 import numpy as np
 
 from envs.carbon_env import CarbonEnv
-from envs.obs_parser import WorkerDirections, WorkerActionsByName, ObservationParser
-from zerosum_env.envs.carbon.helpers import Board, Point
+from envs.obs_parser import ObservationParser
+from envs.reward import RewardCalculator
+from zerosum_env.core import episode_seed
+from zerosum_env.envs.carbon.helpers import Board
 
 
 def one_hot_np(value: int, num_cls: int):
@@ -17,11 +19,19 @@ def one_hot_np(value: int, num_cls: int):
 
 
 class CarbonTrainerEnv:
-    def __init__(self, cfg: dict):
+    def __init__(self, cfg: dict, reward_shaping: Optional[dict] = None):
+        """
+        :param cfg: (dict) carbon game configuration, with a randomSeed each reset uses the next seed derived from it
+            (zerosum_env.core.episode_seed), otherwise a new seed is drawn for every game
+        :param reward_shaping: (dict optional) 奖励参数, 见envs.reward.default_reward_shaping
+        """
         self.previous_obs = self.current_obs = None  # 记录连续两帧 Observation
         self.previous_opponent_obs = self.current_opponent_obs = None  # 记录对手连续两帧 Observation,仅在selfplay时使用
         self.previous_commands = []
         self._env = CarbonEnv(cfg)
+        self._shared_keys = []  # 仅在第一个玩家观测中的公共属性 (players, trees, step...)
+        self._seed = cfg.get("randomSeed")  # 每局的地图种子由此派生
+        self._n_episodes = 0
 
         self.grid_size = self.configuration.size
         self.max_step = self.configuration.episodeSteps
@@ -31,6 +41,7 @@ class CarbonTrainerEnv:
                                                     max_cell_carbon=self.configuration.maxCellCarbon,
                                                     tree_lifespan=self.configuration.treeLifespan,
                                                     action_space=self.act_space.n)
+        self.reward_calculator = RewardCalculator(self.configuration, self.max_step, reward_shaping)
 
     @property
     def configuration(self):
@@ -51,17 +62,29 @@ class CarbonTrainerEnv:
         Return two player's state information.
         The current player's state is in the first position, the opponent's is in the second position.
         """
+        first_state, second_state = self._env.env.steps[-1]
+        # 第二个玩家的观测由上一步的观测复制而来, 每步都需更新其中的公共属性; 非selfplay时不需要对手的完整观测
+        # (Struct的属性与item分开保存, 需用setattr同时更新)
+        if self._env.selfplay or self._env.my_index != 0:
+            for key in self._shared_keys:  # 复制公共属性
+                setattr(second_state.observation, key, first_state.observation[key])
         if self._env.my_index == 0:  # 当前轮次
-            my_state, opponent_state = self._env.env.steps[-1]
-
-            for key in set(my_state.observation.keys()) - set(opponent_state.observation.keys()):  # 复制公共属性
-                opponent_state.observation[key] = my_state.observation[key]
-        else:
-            opponent_state, my_state = self._env.env.steps[-1]
+            return first_state, second_state
+        return second_state, first_state
 
-            for key in set(opponent_state.observation.keys()) - set(my_state.observation.keys()):  # 复制公共属性
-                my_state.observation[key] = opponent_state.observation[key]
-        return my_state, opponent_state
+    def _get_board(self, state, last_view=True) -> Board:
+        """
+        Return the board seen by the agent of state. The board computed by the interpreter in this step is viewed
+        from the agent's point of view instead of being rebuilt from the observation (e.g. after reset).
+        :param last_view: the interpreter's board is changed in place, it can not be viewed again in this step.
+        """
+        interpreter_state = self._env.env.interpreter_state
+        board = interpreter_state.get("board")
+        if board is None:
+            return Board(state.observation, self.configuration)
+        if last_view:
+            interpreter_state.board = None
+        return board.view(state.observation, fork=not last_view)
 
     def reset(self, players: Union[None, List] = None) -> Union[EasyDict, List[EasyDict]]:
         """
@@ -73,7 +96,12 @@ class CarbonTrainerEnv:
             current player, another is the opponent player).
         """
 
+        if self._seed is not None:  # 每局使用不同的地图
+            self.configuration.randomSeed = episode_seed(self._seed, self._n_episodes)
+        self._n_episodes += 1
         self._env.reset(players)
+        first_state, second_state = self._env.env.steps[-1]
+        self._shared_keys = list(first_state.observation.keys() - second_state.observation.keys())
         my_state, opponent_state = self._get_latest_state()
 
         self.previous_obs = None
@@ -109,7 +137,7 @@ class CarbonTrainerEnv:
         my_state, opponent_state = self._get_latest_state()  # 当前轮次
 
         self.previous_obs = self.current_obs
-        self.current_obs = Board(my_state.observation, self.configuration)
+        self.current_obs = self._get_board(my_state, last_view=not self._env.selfplay)
 
         my_output = self._parse_observation_and_reward(my_state, opponent_state, self.current_obs, self.previous_obs)
         # 包含
@@ -118,7 +146,7 @@ class CarbonTrainerEnv:
 
         if self._env.selfplay:
             self.previous_opponent_obs = self.current_opponent_obs
-            self.current_opponent_obs = Board(opponent_state.observation, self.configuration)
+            self.current_opponent_obs = self._get_board(opponent_state)
 
             opponent_output = self._parse_observation_and_reward(opponent_state, my_state,
                                                                  self.current_opponent_obs, self.previous_opponent_obs)
@@ -168,156 +196,9 @@ class CarbonTrainerEnv:
                           current_obs: Board, previous_obs: Board,
                           normalize=False) -> Tuple[float, Dict[str, float]]:
         """
-        基于当前轮次和前一个轮次,估算玩家reward和玩家各个agent的reward.
+        基于当前轮次和前一个轮次,估算玩家reward和玩家各个agent的reward (见envs.reward.RewardCalculator).
 
         :return env_reward, agent_rewards: my_state的游戏奖励以及my_state中我方各个agent的奖励
         """
-        assert previous_obs is not None  # S(t), a(t) -> r(t), S(t+1)
-
-        # 游戏结束状态
-        game_end_code = None
-        if my_state.status != "ACTIVE":  # 对局结束
-            if my_state.reward == opponent_state.reward:  # 两选手分数相同(float)/或者均出错(None) (平局)
-                game_end_code = 0
-            elif my_state.reward is None:  # 我输,对手赢
-                game_end_code = -1
-            elif opponent_state.reward is None:  # 我赢,对手输
-                game_end_code = 1
-            elif my_state.reward > opponent_state.reward:  # 我赢,对手输
-                game_end_code = 1
-            elif my_state.reward < opponent_state.reward:  # 我输,对手赢
-                game_end_code = -1
-            else:
-                raise Exception("Should not go to here!")
-
-        # 工人信息
-        my_player = current_obs.players[current_obs.current_player_id]  # 本轮次当前玩家的工人信息
-        my_base_position = my_player.recrtCenters[0].position 
-        my_workers = {worker.id: worker for worker in my_player.workers}
-        previous_my_player = previous_obs.players[previous_obs.current_player_id]  # 上一轮次
-        previous_my_workers = {worker.id: worker for worker in previous_my_player.workers}
-
-        # 通树的信息,计算每个agent种树/抢树的花费
-        current_trees = {tree.id: tree for tree in current_obs.current_player.trees}
-        previous_trees = {tree.id: tree for tree in previous_obs.current_player.trees}
-        new_tree_ids = list(set(current_trees.keys()) - set(previous_trees.keys()))
-        worker_plant_cost = defaultdict(float)  # 种/抢树需要额外的花费
-        if new_tree_ids:  # 计算种树/抢树的花费
-            plant_cost = self.configuration.plantCost  # 默认种树价格
-            plant_cost_ratio = self.configuration.plantCostInflationRatio
-            plant_cost_base = self.configuration.plantCostInflationBase
-            alive_tree_count = len(current_obs.trees)
-            plant_market_price = plant_cost + plant_cost_ratio * (plant_cost_base ** alive_tree_count)  # 市场价格
-            is_first_tree = not previous_trees  # 首次种树价格: plant_cost, 其余树价格: plant_market_price
-            seize_cost = self.configuration.seizeCost  # 抢树价格
-            for tree_id in new_tree_ids:
-                tree = current_trees[tree_id]
-                tree_owner, _ = my_state.observation.trees[tree_id]
-                # tree owner 表示是哪个种树员种的树
-                if tree.age == 1:  # 种树
-                    worker_plant_cost[tree_owner] += plant_cost if is_first_tree else plant_market_price
-                else:  # 抢树
-                    worker_plant_cost[tree_owner] += seize_cost
-
-        # 下面计算单个agent的reward
-        max_reward = self.max_step
-        agent_reward_dict = {}  # 单个agent的reward, key: worker_id (含已死亡), value: 智能体reward
-
-        # 游戏结束时，会根据结束时的状态计算reward，如果输了会添加-300的惩罚、赢了会有正300的奖励
-        if game_end_code is not None:  # 游戏结束(注意: 游戏结束时,返回的current_cash不准确;未结束时,才准确!!!)
-            env_reward = game_end_code * max_reward
-        else:  # 游戏未结束
-            env_reward = my_player.cash - previous_my_player.cash  # 选手金额的变化
-
-        agent_accumulate_reward = 0  # 各agent的奖励总和
-
-        # 计算每个agent 种(抢)树和捕碳的每轮收益
-        tree_owner_reward = dict()  # key: worker_id, value: float
-        trees_dict = my_state.observation["trees"]
-        for tree_owner, tree_reward in trees_dict.values():
-            if tree_owner not in tree_owner_reward:
-                tree_owner_reward[tree_owner] = 0
-
-            tree_owner_reward[tree_owner] += tree_reward
-
-            agent_accumulate_reward += tree_reward
-
-        # 当前轮次，所有工人的reward
-        for worker in my_player.workers:
-            is_fresher = worker.id not in previous_my_workers  # 是否为新招募成员
-
-            # 计算种(抢)树收益
-            if worker.is_planter:
-                tree_reward = tree_owner_reward.get(worker.id, 0)  # 树收益
-                tree_reward = -1 if tree_reward == 0 else tree_reward
-            else:  # 捕碳员
-                tree_reward = tree_owner_reward.get(worker.id, 0)
-
-            # 计算捕碳收益
-            carbon_reward = 0
-            if worker.is_collector:
-                # 上一轮携带的CO2量
-                previous_carbon = 0 if is_fresher else previous_my_workers[worker.id].carbon
-                current_carbon = worker.carbon  # 当前轮携带的CO2量
-
-                if not is_fresher and worker.position == my_base_position:  # 非新招募人员,且在转化中心位置处
-                    carbon_reward = previous_carbon  # 运回基地收益 (>= 0)
-                    agent_accumulate_reward += carbon_reward
-                else:
-                    carbon_reward = current_carbon - previous_carbon  # +/-/0, 正值:携带CO2增多,负值:被对方树吸收,0:游走
-                    carbon_reward = carbon_reward / 100. if carbon_reward >= 0 else carbon_reward  # 捕碳增加量 / 100
-                    carbon_reward = min(carbon_reward, 0.5)  # 身上碳减少 (惩罚项); 捕碳,最高奖励 +0.5
-                if carbon_reward == 0:  # 捕碳无收益
-                    carbon_reward = -1
-
-            worker_reward = tree_reward + carbon_reward - worker_plant_cost[worker.id]  # 树净化收益 + 捕碳收益 - 树价格
-            agent_reward_dict[worker.id] = worker_reward
-
-        # 碰撞,被自己树/转化中心直接吸收奖励(碰撞后,agent可能活着,也可能死亡). 记录一下，暂时无法区分
-        env_extra_reward = max(round(env_reward - agent_accumulate_reward, 2), 0)  # 排除各agent自己的奖励
-
-        # 已经死亡的agent
-        death_agent_ids = {id_ for id_ in previous_my_workers.keys() if id_ not in agent_reward_dict}
-        agent_reward_dict.update({id_: -max_reward for id_ in death_agent_ids})
-        # death_agent_reward = max(env_extra_reward, 0)
-        # agent_reward_dict.update({id_: -max_reward if death_agent_reward == 0 else death_agent_reward
-        #                           for id_ in death_agent_ids})
-
-        # 基于上一轮次的位置+动作,计算新位置是否有碰撞,若碰撞,则惩罚
-        is_my_base_recruit = False  # 是否有招募新工人
-        position_agent_dict = defaultdict(set)
-        no_action_agent_ids = set()
-        if my_player.id < len(self.previous_commands):
-            previous_my_command = self.previous_commands[my_player.id]
-            if previous_my_command:
-                is_my_base_recruit = my_player.recrtCenters[0].id in previous_my_command
-                for worker_id, worker in previous_my_workers.items():
-                    if worker_id in previous_my_command:  # 有移动动作
-                        dx, dy = WorkerDirections[WorkerActionsByName[previous_my_command[worker_id]].value].tolist()
-                        new_position = worker.position + Point(dx, dy)
-                        position_agent_dict[new_position].add(worker_id)
-                    else:  # 停留动作
-                        no_action_agent_ids.add(worker_id)
-                        position_agent_dict[worker.position].add(worker_id)
-        # 转化中心的奖励
-        if is_my_base_recruit and my_base_position in position_agent_dict:  # 转化中心招募,导致碰撞
-            for base in my_player.recrtCenters:
-                agent_reward_dict[base.id] = -max_reward
-        else:
-            for base in my_player.recrtCenters:
-                agent_reward_dict[base.id] = env_reward
-
-        for agent_ids in position_agent_dict.values():
-            if len(agent_ids) > 1:  # 人员移动, 发生碰撞
-                for agent_id in agent_ids:
-                    if agent_id not in no_action_agent_ids:  # 仅仅惩罚移动的人员
-                        agent_reward_dict[agent_id] = -max_reward
-
-        if normalize:
-            agent_reward_dict = {k: self._normalize_reward(v)
-                                 for k, v in agent_reward_dict.items()}
-        
-        return env_reward, agent_reward_dict
-
-    def _normalize_reward(self, reward):
-        return np.clip(reward / self.max_step, -1, 1)
+        return self.reward_calculator.calculate(my_state, opponent_state, current_obs, previous_obs,
+                                                self.previous_commands, normalize=normalize)
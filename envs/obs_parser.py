@@ -1,6 +1,7 @@
 from typing import Dict, Tuple
 import numpy as np
 
+from zerosum_env.envs.carbon.geometry import get_geometry
 from zerosum_env.envs.carbon.helpers import RecrtCenterAction, WorkerAction, Board
 
 
@@ -31,6 +32,9 @@ def one_hot_np(value: int, num_cls: int):
     ret[value] = 1
     return ret
 
+
+_distance_maps = {}  # key: grid_size, value: 各点位的距离特征, dim: grid_size x grid_size x grid_size x grid_size
+
 # 核心代码：observation
 class ObservationParser:
     """
@@ -43,12 +47,24 @@ class ObservationParser:
                  max_step=300,
                  max_cell_carbon=100,
                  tree_lifespan=50,
-                 action_space=5):
+                 action_space=5,
+                 cached=False):
+        """
+        :param cached: (bool) 缓存模式: 距离特征按grid_size预先计算, 全局特征与agent特征写入复用的缓冲区.
+            此模式下obs_transform返回的特征是self.observation_buffer的行(视图), 下一次调用时会被覆盖,
+            需要保留时请自行复制.
+        """
         self.grid_size = grid_size
         self.max_step = max_step
         self.max_cell_carbon = max_cell_carbon
         self.tree_lifespan = tree_lifespan
         self.action_space = action_space
+        self.cached = cached
+
+        self.observation_buffer = None
+        if cached:
+            self._global_cnn_buffer = np.zeros((6 + action_space, grid_size, grid_size), dtype=np.float32)
+            self.observation_buffer = np.zeros((16, self.observation_dim), dtype=np.float32)
 
     @property
     def observation_cnn_shape(self) -> Tuple[int, int, int]:
@@ -74,6 +90,26 @@ class ObservationParser:
         """
         return 8 + 13 * 15 * 15
 
+    def _previous_actions(self, previous_obs: Board, current_obs: Board) -> Dict:
+        """
+        各个agent上一轮次执行的动作. current_obs由Board.next()得到时读取其记录的事件(准确), 否则(如由observation重建的
+        Board)由连续两帧Board信息猜测.
+
+        :return:  字典, key为agent_id, value为Command或None (与_guess_previous_actions一致)
+        """
+        events = current_obs.events if current_obs is not None else None
+        if events is None or previous_obs is None:
+            return self._guess_previous_actions(previous_obs, current_obs)
+
+        current_workers = current_obs.workers
+        return_value = {worker_id: cmd for worker_id, cmd in events.worker_actions.items()
+                        if worker_id in current_workers}  # 已消失的agent忽略
+        for player in current_obs.players.values():  # 转换中心指令
+            base_id = player.recrtCenter_ids[0]
+            recruit = events.recruits.get(base_id)
+            return_value[base_id] = recruit[1] if recruit is not None else BaseActions[0]
+        return return_value
+
     def _guess_previous_actions(self, previous_obs: Board, current_obs: Board) -> Dict:
         """
         基于连续两帧Board信息,猜测各个agent采用的动作(已经消失的agent,因无法准确估计,故忽略!)
@@ -85,18 +121,15 @@ class ObservationParser:
         previous_workers = previous_obs.workers if previous_obs is not None else {}
         current_workers = current_obs.workers if current_obs is not None else {}
 
+        geometry = get_geometry(self.grid_size)
         player_base_cmds = {player_id: BaseActions[0]
                             for player_id in current_obs.players.keys()} if current_obs is not None else {}
         total_worker_ids = set(previous_workers.keys()) | set(current_workers.keys())  # worker id列表
         for worker_id in total_worker_ids:
             previous_worker, worker = previous_workers.get(worker_id, None), current_workers.get(worker_id, None)
             if previous_worker is not None and worker is not None:  # (连续两局存活) 移动/停留 动作
-                prev_pos = np.array([previous_worker.position.x, previous_worker.position.y])
-                curr_pos = np.array([worker.position.x, worker.position.y])
-
-                # 计算所有方向的可能位置 (防止越界问题)
-                next_all_positions = ((prev_pos + WorkerDirections) + self.grid_size) % self.grid_size
-                dir_index = (next_all_positions == curr_pos).all(axis=1).nonzero()[0].item()
+                # 查表得到移动方向 (已处理越界问题)
+                dir_index = geometry.move_code(previous_worker.position, worker.position)
                 cmd = WorkerActions[dir_index]
 
                 return_value[worker_id] = cmd
@@ -136,6 +169,16 @@ class ObservationParser:
 
         return distance_map
 
+    @property
+    def distance_maps(self) -> np.ndarray:
+        """
+        各点位归一化后的距离特征, distance_maps[x, y] == _distance_feature(x, y) / (grid_size - 1), 每个grid_size仅计算一次.
+        """
+        if self.grid_size not in _distance_maps:
+            xy_distances = get_geometry(self.grid_size).xy_distances
+            _distance_maps[self.grid_size] = xy_distances.astype(np.float32) / np.float32(self.grid_size - 1)
+        return _distance_maps[self.grid_size]
+
     def obs_transform(self, current_obs: Board, previous_obs: Board = None) -> Tuple[Dict, Dict, Dict]:
         """
         通过前后两帧的原始观测状态值, 计算状态空间特征, agent, dones信息以及agent可用的动作空间.
@@ -166,8 +209,11 @@ class ObservationParser:
         :return available_actions: (Dict[str, np.ndarray]) 标识当前选手每个agent的动作维度是否可用, 1表示该动作可用,
             0表示动作不可用
         """
+        if self.cached:
+            return self._cached_obs_transform(current_obs, previous_obs)
+
         # 加入agent上一轮次的动作
-        agent_cmds = self._guess_previous_actions(previous_obs, current_obs)
+        agent_cmds = self._previous_actions(previous_obs, current_obs)
         previous_action = {k: v.value if v is not None else 0 for k, v in agent_cmds.items()}
 
         available_actions = {}
@@ -188,6 +234,7 @@ class ObservationParser:
 
         my_base_distance_feature = None
         distance_features = {}
+        distance_maps = self.distance_maps
 
         my_cash, opponent_cash = current_obs.current_player.cash, current_obs.opponents[0].cash
         for base_id, base in current_obs.recrtCenters.items():
@@ -196,8 +243,7 @@ class ObservationParser:
             base_x, base_y = base.position.x, base.position.y
 
             base_feature[base_x, base_y] = 1.0 if is_myself else -1.0
-            base_distance_feature = self._distance_feature(base_x, base_y) / (self.grid_size - 1)
-            distance_features[base_id] = base_distance_feature
+            distance_features[base_id] = distance_maps[base_x, base_y]
 
             action_feature[base_x, base_y] = one_hot_np(previous_action.get(base_id, 0), self.action_space)
             if is_myself:
@@ -212,7 +258,7 @@ class ObservationParser:
             available_actions[worker_id] = np.array([1, 1, 1, 1, 1])
 
             worker_x, worker_y = worker.position.x, worker.position.y
-            distance_features[worker_id] = self._distance_feature(worker_x, worker_y) / (self.grid_size - 1)
+            distance_features[worker_id] = distance_maps[worker_x, worker_y]
 
             action_feature[worker_x, worker_y] = one_hot_np(previous_action.get(worker_id, 0), self.action_space)
 
@@ -274,6 +320,106 @@ class ObservationParser:
                 dones[my_agent.id] = False
 
         return local_obs, dones, available_actions
+
+    def _cached_obs_transform(self, current_obs: Board, previous_obs: Board = None) -> Tuple[Dict, Dict, Dict]:
+        """
+        obs_transform的缓存模式, 特征与obs_transform完全一致.
+        全局CNN特征每轮只写入一次self._global_cnn_buffer, 各agent的特征写入self.observation_buffer的对应行.
+        """
+        agent_cmds = self._previous_actions(previous_obs, current_obs)
+        previous_action = {k: v.value if v is not None else 0 for k, v in agent_cmds.items()}
+
+        available_actions = {}
+        my_player_id = current_obs.current_player_id
+        distance_maps = self.distance_maps
+
+        global_cnn_feature = self._global_cnn_buffer
+        global_cnn_feature.fill(0)
+        carbon_feature, base_feature, collector_feature, planter_feature, worker_carbon_feature, tree_feature = \
+            global_cnn_feature[:6]
+        action_feature = global_cnn_feature[6:]  # dim: 5 x 15 x 15
+
+        for point, cell in current_obs.cells.items():
+            if cell.carbon > 0:
+                carbon_feature[point.x, point.y] = cell.carbon / self.max_cell_carbon
+
+        my_base_distance_feature = None
+        for base_id, base in current_obs.recrtCenters.items():
+            is_myself = base.player_id == my_player_id
+            base_x, base_y = base.position.x, base.position.y
+
+            base_feature[base_x, base_y] = 1.0 if is_myself else -1.0
+            action_feature[:, base_x, base_y] = 0
+            action_feature[previous_action.get(base_id, 0), base_x, base_y] = 1
+            if is_myself:
+                available_actions[base_id] = np.array([1, 1, 1, 0, 0])
+                my_base_distance_feature = distance_maps[base_x, base_y]
+
+        for worker_id, worker in current_obs.workers.items():
+            is_myself = worker.player_id == my_player_id
+            available_actions[worker_id] = np.array([1, 1, 1, 1, 1])
+
+            worker_x, worker_y = worker.position.x, worker.position.y
+            action_feature[:, worker_x, worker_y] = 0
+            action_feature[previous_action.get(worker_id, 0), worker_x, worker_y] = 1
+            if worker.is_collector:
+                collector_feature[worker_x, worker_y] = 1.0 if is_myself else -1.0
+            else:
+                planter_feature[worker_x, worker_y] = 1.0 if is_myself else -1.0
+            worker_carbon_feature[worker_x, worker_y] = worker.carbon
+        worker_carbon_feature /= self.max_cell_carbon
+        worker_carbon_feature /= 2
+        np.clip(worker_carbon_feature, -1, 1, out=worker_carbon_feature)
+
+        for tree in current_obs.trees.values():
+            tree_feature[tree.position.x, tree.position.y] = tree.age if tree.player_id == my_player_id else -tree.age
+        tree_feature /= self.tree_lifespan
+
+        my_cash, opponent_cash = current_obs.current_player.cash, current_obs.opponents[0].cash
+        global_vector_feature = [current_obs.step / (self.max_step - 1),
+                                 np.clip(my_cash / 2000., -1., 1.),
+                                 np.clip(opponent_cash / 2000., -1., 1.)]
+
+        previous_worker_ids = set() if previous_obs is None else set(previous_obs.current_player.worker_ids)
+        worker_ids = set(current_obs.current_player.worker_ids)
+        new_worker_ids, death_worker_ids = worker_ids - previous_worker_ids, previous_worker_ids - worker_ids
+        obs = previous_obs if previous_obs is not None else current_obs
+        total_agents = obs.current_player.recrtCenters + \
+                       obs.current_player.workers + \
+                       [current_obs.workers[id_] for id_ in new_worker_ids]  # 基地 + prev_workers + new_workers
+
+        if len(total_agents) > len(self.observation_buffer):
+            self.observation_buffer = np.zeros((2 * len(total_agents), self.observation_dim), dtype=np.float32)
+        vector_dim, global_cnn_dim = self.observation_vector_shape, global_cnn_feature.size
+        grid_dim = self.grid_size * self.grid_size
+
+        dones = {}
+        local_obs = {}
+        for my_agent, agent_obs in zip(total_agents, self.observation_buffer):
+            local_obs[my_agent.id] = agent_obs
+            if my_agent.id in death_worker_ids:  # 死亡的agent, 直接赋值为0
+                agent_obs.fill(0)
+                available_actions[my_agent.id] = np.array([1, 1, 1, 1, 1])
+                dones[my_agent.id] = True
+                continue
+
+            if not hasattr(my_agent, 'is_collector'):  # 转化中心
+                agent_type = [1, 0, 0]
+                agent_position = current_obs.recrtCenters[my_agent.id].position
+            else:  # 工人
+                agent_type = [0, int(my_agent.is_collector), int(my_agent.is_planter)]
+                agent_position = current_obs.workers[my_agent.id].position
+            agent_obs[:vector_dim] = [*global_vector_feature,
+                                      *agent_type,
+                                      my_agent.position.x / self.grid_size,
+                                      my_agent.position.y / self.grid_size]  # dim: 8
+            cnn_feature = agent_obs[vector_dim:]  # dim: 2925 (13 x 15 x 15)
+            cnn_feature[:global_cnn_dim] = global_cnn_feature.reshape(-1)
+            cnn_feature[global_cnn_dim:global_cnn_dim + grid_dim] = my_base_distance_feature.reshape(-1)
+            cnn_feature[global_cnn_dim + grid_dim:] = distance_maps[agent_position.x, agent_position.y].reshape(-1)
+            dones[my_agent.id] = False
+
+        return local_obs, dones, available_actions
     
 
     def obs_transform_new(self, current_obs: Board):
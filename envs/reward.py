@@ -0,0 +1,198 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from envs.obs_parser import WorkerDirections, WorkerActionsByName
+from zerosum_env.envs.carbon.helpers import Board
+
+
+# 奖励的默认参数, None表示使用max_step (对局的步数)
+default_reward_shaping = dict(
+    game_end_reward=None,  # 对局结束时, 赢/输/平局的奖励为 +/-game_end_reward/0 (取代金额的变化)
+    death_reward=None,  # 工人死亡的奖励, None表示-max_step
+    collision_reward=None,  # 工人移动(或转化中心招募)导致我方碰撞的奖励, None表示-max_step
+    planter_idle_reward=-1,  # 种树员没有树收益时的奖励
+    collector_idle_reward=-1,  # 捕碳员没有捕碳收益时的奖励
+    carbon_gain_scale=0.01,  # 捕碳员携带CO2增加量的系数
+    max_carbon_gain_reward=0.5,  # 捕碳员捕碳的最高奖励
+    plant_cost_scale=1.0,  # 种/抢树花费的系数
+)
+
+
+class RewardCalculator:
+    """
+    Computes the game reward and the reward of every agent of a player from two consecutive boards.
+
+    The workers of the player are handled as arrays (position, carbon, occupation...), every reward term is a
+    numpy operation over all the workers. The recruits and collisions come from the events recorded by the engine
+    (Board.events), or from the commands sent at the previous step when the boards have no events.
+    """
+
+    def __init__(self, configuration, max_step: int = 300, reward_shaping: Optional[dict] = None):
+        """
+        :param configuration: carbon game configuration
+        :param max_step: (int) 对局的步数, 作为结束/死亡/碰撞奖励的默认值
+        :param reward_shaping: (dict optional) 覆盖default_reward_shaping中的参数
+        """
+        unknown_keys = set(reward_shaping or {}) - set(default_reward_shaping)
+        assert not unknown_keys, f"Unknown reward shaping parameters: {sorted(unknown_keys)}"
+        shaping = {**default_reward_shaping, **(reward_shaping or {})}
+
+        self.configuration = configuration
+        self.max_step = max_step
+        self.game_end_reward = max_step if shaping["game_end_reward"] is None else shaping["game_end_reward"]
+        self.death_reward = -max_step if shaping["death_reward"] is None else shaping["death_reward"]
+        self.collision_reward = -max_step if shaping["collision_reward"] is None else shaping["collision_reward"]
+        self.planter_idle_reward = shaping["planter_idle_reward"]
+        self.collector_idle_reward = shaping["collector_idle_reward"]
+        self.carbon_gain_scale = shaping["carbon_gain_scale"]
+        self.max_carbon_gain_reward = shaping["max_carbon_gain_reward"]
+        self.plant_cost_scale = shaping["plant_cost_scale"]
+
+    @staticmethod
+    def _game_end_code(my_state, opponent_state) -> Optional[int]:
+        """
+        :return: None表示对局未结束, 1: 我赢, -1: 我输, 0: 平局
+        """
+        if my_state.status == "ACTIVE":
+            return None
+        if my_state.reward == opponent_state.reward:  # 两选手分数相同(float)/或者均出错(None) (平局)
+            return 0
+        if my_state.reward is None:  # 我输,对手赢
+            return -1
+        if opponent_state.reward is None:  # 我赢,对手输
+            return 1
+        return 1 if my_state.reward > opponent_state.reward else -1
+
+    def calculate(self, my_state, opponent_state, current_obs: Board, previous_obs: Board,
+                  previous_commands=None, normalize=False) -> Tuple[float, Dict[str, float]]:
+        """
+        基于当前轮次和前一个轮次,估算玩家reward和玩家各个agent的reward.
+
+        :param previous_commands: 上一轮次各玩家的指令, 仅在Board没有记录事件时用于计算碰撞
+        :return env_reward, agent_rewards: my_state的游戏奖励以及my_state中我方各个agent的奖励
+        """
+        assert previous_obs is not None  # S(t), a(t) -> r(t), S(t+1)
+        configuration = self.configuration
+
+        my_player = current_obs.players[current_obs.current_player_id]
+        previous_my_player = previous_obs.players[previous_obs.current_player_id]
+        my_base_position = my_player.recrtCenters[0].position
+
+        game_end_code = self._game_end_code(my_state, opponent_state)
+        if game_end_code is not None:  # 游戏结束(注意: 游戏结束时,返回的current_cash不准确;未结束时,才准确!!!)
+            env_reward = game_end_code * self.game_end_reward
+        else:  # 选手金额的变化
+            env_reward = my_player.cash - previous_my_player.cash
+
+        # 我方工人的数组, 按my_player.worker_ids的顺序
+        # 列: 是否为捕碳员, 携带的CO2, 是否在转化中心, 是否为新招募成员, 上一轮携带的CO2
+        workers, previous_workers = current_obs.workers, previous_obs.workers
+        worker_ids = my_player.worker_ids
+        worker_index = {worker_id: i for i, worker_id in enumerate(worker_ids)}
+        n_workers = len(worker_ids)
+        worker_array = np.array([
+            (worker.is_collector, worker._carbon, worker._position == my_base_position, previous_worker is None,
+             0 if previous_worker is None else previous_worker._carbon)
+            for worker, previous_worker in ((workers[worker_id], previous_workers.get(worker_id))
+                                            for worker_id in worker_ids)], dtype=float).reshape(n_workers, 5)
+        is_collector, at_base, is_fresher = worker_array[:, [0, 2, 3]].T.astype(bool)
+        carbon, previous_carbon = worker_array[:, 1], worker_array[:, 4]
+
+        # 树的收益, 按种(抢)树的工人汇总; 非我方工人的树记入最后一项
+        trees_dict = my_state.observation["trees"]
+        tree_array = np.array([(worker_index.get(owner, n_workers), reward) for owner, reward in trees_dict.values()],
+                              dtype=float).reshape(len(trees_dict), 2)
+        tree_reward = np.bincount(tree_array[:, 0].astype(int), tree_array[:, 1], minlength=n_workers + 1)[:n_workers]
+
+        # 种树/抢树的花费, 按种(抢)树的工人汇总
+        previous_tree_ids = set(previous_my_player.tree_ids)
+        new_tree_ids = [tree_id for tree_id in my_player.tree_ids if tree_id not in previous_tree_ids]
+        plant_cost = np.zeros(n_workers)
+        if new_tree_ids:
+            plant_market_price = configuration.plantCost + configuration.plantCostInflationRatio * (
+                    configuration.plantCostInflationBase ** len(current_obs.trees))
+            first_plant_cost = configuration.plantCost if not previous_tree_ids else plant_market_price
+            current_trees = current_obs.trees
+            new_tree_array = np.array([
+                (worker_index.get(trees_dict[tree_id][0], n_workers),
+                 first_plant_cost if current_trees[tree_id]._age == 1 else configuration.seizeCost)
+                for tree_id in new_tree_ids], dtype=float)
+            plant_cost = np.bincount(new_tree_array[:, 0].astype(int), new_tree_array[:, 1],
+                                     minlength=n_workers + 1)[:n_workers]
+
+        # 种树员: 树收益, 无收益时为planter_idle_reward
+        planter_reward = np.where(tree_reward == 0, self.planter_idle_reward, tree_reward)
+        # 捕碳员: 运回基地的CO2, 或携带CO2的变化 (增加量按系数缩放, 减少量为惩罚)
+        carbon_gain = carbon - previous_carbon
+        carbon_gain = np.minimum(np.where(carbon_gain >= 0, carbon_gain * self.carbon_gain_scale, carbon_gain),
+                                 self.max_carbon_gain_reward)
+        carbon_reward = np.where(at_base & ~is_fresher, previous_carbon, carbon_gain)
+        carbon_reward = np.where(carbon_reward == 0, self.collector_idle_reward, carbon_reward)
+        collector_reward = tree_reward + carbon_reward
+
+        worker_reward = np.where(is_collector, collector_reward, planter_reward) - plant_cost * self.plant_cost_scale
+        agent_reward_dict = dict(zip(worker_ids, worker_reward.tolist()))
+
+        # 已经死亡的agent
+        previous_worker_ids = previous_my_player.worker_ids
+        agent_reward_dict.update({worker_id: self.death_reward for worker_id in previous_worker_ids
+                                  if worker_id not in worker_index})
+
+        # 转化中心的奖励, 碰撞的惩罚
+        is_base_collision, collided_worker_ids = self._collisions(current_obs, previous_obs, previous_commands)
+        base_reward = self.collision_reward if is_base_collision else env_reward
+        for recrtCenter_id in my_player.recrtCenter_ids:
+            agent_reward_dict[recrtCenter_id] = base_reward
+        for worker_id in collided_worker_ids:
+            agent_reward_dict[worker_id] = self.collision_reward
+
+        if normalize:
+            agent_reward_dict = {k: float(np.clip(v / self.max_step, -1, 1)) for k, v in agent_reward_dict.items()}
+        return env_reward, agent_reward_dict
+
+    def _collisions(self, current_obs: Board, previous_obs: Board, previous_commands=None):
+        """
+        上一轮次我方的碰撞: 若多个我方工人到达同一位置, 其中移动的工人受惩罚; 若转化中心招募的工人发生碰撞, 转化中心受惩罚.
+
+        :return: (转化中心是否受惩罚, 受惩罚的工人id列表)
+        """
+        previous_my_player = previous_obs.players[previous_obs.current_player_id]
+        previous_worker_ids = previous_my_player.worker_ids
+        base_id = current_obs.players[current_obs.current_player_id].recrtCenter_ids[0]
+        base_position = current_obs.recrtCenters[base_id].position
+
+        events = current_obs.events
+        if events is not None:  # 由引擎记录的实际动作和碰撞计算
+            previous_workers = previous_obs.workers
+            is_base_collision = base_id in events.recruits and base_position in events.collisions
+            collided_worker_ids = []
+            for worker_ids in events.collisions.values():
+                my_worker_ids = [worker_id for worker_id in worker_ids if worker_id in previous_workers and
+                                 previous_workers[worker_id].player_id == previous_my_player.id]
+                if len(my_worker_ids) > 1:
+                    collided_worker_ids.extend(worker_id for worker_id in my_worker_ids
+                                               if events.worker_actions.get(worker_id) is not None)
+            return is_base_collision, collided_worker_ids
+
+        # 基于上一轮次的位置+指令计算
+        my_id = previous_my_player.id
+        previous_my_command = previous_commands[my_id] if previous_commands and my_id < len(previous_commands) \
+            else None
+        if not previous_my_command or not previous_worker_ids:
+            return False, []
+
+        previous_workers = previous_obs.workers
+        n_workers = len(previous_worker_ids)
+        position = np.array([tuple(previous_workers[worker_id]._position) for worker_id in previous_worker_ids])
+        action = np.fromiter((WorkerActionsByName[previous_my_command[worker_id]].value
+                              if worker_id in previous_my_command else 0 for worker_id in previous_worker_ids),
+                             int, n_workers)
+        # 与原先的实现一致, 新位置不对地图大小取模
+        new_position = position + WorkerDirections[action]
+        keys = (new_position[:, 0] + 1) * (self.configuration.size + 2) + new_position[:, 1] + 1
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        collided = (counts[inverse] > 1) & (action != 0)
+        base_key = (base_position.x + 1) * (self.configuration.size + 2) + base_position.y + 1
+        is_base_collision = base_id in previous_my_command and bool(np.any(keys == base_key))
+        return is_base_collision, [worker_id for worker_id, flag in zip(previous_worker_ids, collided) if flag]
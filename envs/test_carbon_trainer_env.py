@@ -1,3 +1,4 @@
+import json
 import random
 
 import pytest
@@ -7,6 +8,7 @@ import torch
 from envs.carbon_trainer_env import CarbonTrainerEnv
 from algorithms.base_policy import BasePolicy
 from algorithms.model import Model
+from zerosum_env.envs.carbon.helpers import Board
 
 
 class TestCarbonTrainerEnv:
@@ -85,3 +87,39 @@ class TestCarbonTrainerEnv:
 
             if all(env_output.done):
                 break
+
+    def test_board_view(self):
+        # 由解释器的Board得到的各玩家Board与由观测重建的一致
+        class RebuildBoardEnv(CarbonTrainerEnv):
+            def _get_board(self, state, last_view=True):
+                board = Board(state.observation, self.configuration)
+                interpreter_board = self._env.env.interpreter_state.board
+                if interpreter_board is not None:  # 附上本步的事件, 使reward的计算一致
+                    board._events = interpreter_board.events
+                return board
+
+        def play(env):
+            random.seed(0)
+            np.random.seed(0)  # 碳的再生使用全局随机数
+            rng = random.Random(0)
+            outputs = env.reset([None, None])
+            steps = []
+            for _ in range(120):
+                outputs = env.step([BasePolicy.to_env_commands({
+                    agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+                    for agent_id, available_actions in zip(output.agent_id, output.available_actions)})
+                    for output in outputs])
+                # 解释器的Board中实体的顺序与重建的不同, 按id比较
+                steps.append((json.dumps([env.current_obs.observation, env.current_opponent_obs.observation],
+                                         sort_keys=True),
+                              [{agent_id: (obs.tolist(), reward, done) for agent_id, obs, reward, done in
+                                zip(output.agent_id, output.obs, output.reward, output.done)} for output in outputs]))
+                if all(outputs[0].done):
+                    break
+            return steps
+
+        env = CarbonTrainerEnv({"randomSeed": 7, "recCollectorCost": 10, "recPlanterCost": 10})
+        rebuild_env = RebuildBoardEnv({"randomSeed": 7, "recCollectorCost": 10, "recPlanterCost": 10})
+        steps = play(env)
+        assert env.current_opponent_obs._id_generator is not None  # 由解释器的Board得到, 而非重建
+        assert steps == play(rebuild_env)
@@ -0,0 +1,71 @@
+import random
+
+import numpy as np
+
+from envs.carbon_trainer_env import CarbonTrainerEnv
+from envs.obs_parser import ObservationParser
+from algorithms.base_policy import BasePolicy
+
+
+class TestObservationParser:
+    def test_cached_obs_transform(self):
+        env = CarbonTrainerEnv({"randomSeed": 7})
+        parser = ObservationParser(cached=True)
+
+        rng = random.Random(7)
+        env_output = env.reset([None, "random"])
+        for _ in range(60):
+            actions = {agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+                       for agent_id, available_actions in zip(env_output.agent_id, env_output.available_actions)}
+            env_output = env.step(BasePolicy.to_env_commands(actions))
+
+            expected_obs, expected_dones, expected_available_actions = env.observation_parser.obs_transform(
+                env.current_obs, env.previous_obs)
+            local_obs, dones, available_actions = parser.obs_transform(env.current_obs, env.previous_obs)
+
+            assert list(local_obs) == list(expected_obs)
+            assert dones == expected_dones
+            for agent_id, obs in expected_obs.items():
+                assert local_obs[agent_id].dtype == np.float32
+                assert np.array_equal(local_obs[agent_id], obs)
+                assert np.array_equal(available_actions[agent_id], expected_available_actions[agent_id])
+            if all(env_output.done):
+                break
+
+    def test_previous_actions(self):
+        # 由引擎记录的事件得到的动作即为实际执行的指令
+        env = CarbonTrainerEnv({"randomSeed": 7, "recCollectorCost": 10, "recPlanterCost": 10})
+        parser = env.observation_parser
+
+        rng = random.Random(7)
+        env_output = env.reset([None, "random"])
+        for _ in range(100):
+            actions = {agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+                       for agent_id, available_actions in zip(env_output.agent_id, env_output.available_actions)}
+            commands = BasePolicy.to_env_commands(actions)
+            env_output = env.step(commands)
+
+            events = env.current_obs.events
+            assert events is not None
+            agent_cmds = parser._previous_actions(env.previous_obs, env.current_obs)
+            guessed_cmds = parser._guess_previous_actions(env.previous_obs, env.current_obs)
+            for agent_id, cmd in agent_cmds.items():
+                if agent_id in env.previous_obs.workers:  # 存活的工人
+                    assert cmd == guessed_cmds[agent_id]
+                    if agent_id in actions:
+                        assert (cmd.name if cmd is not None else None) == commands.get(agent_id)
+                elif agent_id in events.recruits:  # 转化中心的招募成功
+                    assert cmd is not None
+                    assert cmd.name == commands.get(agent_id, cmd.name)
+                else:
+                    assert cmd is None
+            if all(env_output.done):
+                break
+
+    def test_distance_maps(self):
+        parser = ObservationParser()
+        for x in range(parser.grid_size):
+            for y in range(parser.grid_size):
+                expected = parser._distance_feature(x, y) / (parser.grid_size - 1)
+                assert parser.distance_maps[x, y].dtype == expected.dtype
+                assert np.array_equal(parser.distance_maps[x, y], expected)
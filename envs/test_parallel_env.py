@@ -0,0 +1,104 @@
+import random
+
+import numpy as np
+
+from envs.carbon_trainer_env import CarbonTrainerEnv
+from utils.parallel_env import ParallelEnv
+from zerosum_env.profiling import StepProfiler
+from algorithms.base_policy import BasePolicy
+
+
+def random_commands(env_output, rng):
+    actions = {agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+               for agent_id, available_actions in zip(env_output.agent_id, env_output.available_actions)}
+    return BasePolicy.to_env_commands(actions)
+
+
+def assert_same_output(output, expected_output):
+    assert list(output) == list(expected_output)
+    for key, value in expected_output.items():
+        if key in ("obs", "available_actions", "reserved_obs", "reserved_available_actions"):
+            assert len(output[key]) == len(value)
+            assert all(np.array_equal(v1, v2) for v1, v2 in zip(output[key], value))
+        else:
+            assert output[key] == value
+
+
+class TestParallelEnv:
+    def make_env(self, n_envs, episode_steps=40, **kwargs):
+        envs = [CarbonTrainerEnv({"randomSeed": seed, "episodeSteps": episode_steps}) for seed in range(n_envs)]
+        # 碳的再生和内置的random对手使用全局随机数, 保证fork出的子进程随机状态一致
+        random.seed(0)
+        np.random.seed(0)
+        return ParallelEnv(envs, **kwargs)
+
+    def test_shared_memory(self):
+        # max_agents较小时, 超出容量的输出直接通过管道发送
+        for max_agents in (32, 4):
+            env = self.make_env(3)
+            shared_env = self.make_env(3, shared_memory=True, max_agents=max_agents)
+
+            outputs = env.reset(selfplay=True)
+            shared_outputs = shared_env.reset(selfplay=True)
+            rng1, rng2 = random.Random(0), random.Random(0)
+            for _ in range(45):  # 包含对局结束后的自动重置
+                for player_outputs, shared_player_outputs in zip(outputs, shared_outputs):
+                    # 第一个环境在主进程内运行, 两者共用全局的id生成器, 仅比较子进程中的环境
+                    for output, shared_output in zip(player_outputs[1:], shared_player_outputs[1:]):
+                        assert_same_output(shared_output, output)
+
+                outputs = env.step([[random_commands(output1, rng1), random_commands(output2, rng1)]
+                                    for output1, output2 in zip(*outputs)])
+                shared_outputs = shared_env.step([[random_commands(output1, rng2), random_commands(output2, rng2)]
+                                                  for output1, output2 in zip(*shared_outputs)])
+
+    def test_shared_memory_outputs_kept(self):
+        # 对局很短, selfplay下结束+重置的step一次写入4个输出, 保留的输出跨越多次重置
+        for zero_copy in (False, True):
+            env = self.make_env(2, episode_steps=3, shared_memory=True, zero_copy=zero_copy)
+            outputs = env.reset(selfplay=True)
+            rng = random.Random(0)
+            kept = []  # (子进程环境的输出, 当时obs的拷贝)
+            for _ in range(8):
+                outputs = env.step([[random_commands(output1, rng), random_commands(output2, rng)]
+                                    for output1, output2 in zip(*outputs)])
+                kept.extend((output[1], [obs.copy() for obs in output[1].obs]) for output in outputs)
+            unchanged = [all(np.array_equal(obs, expected_obs) for obs, expected_obs in zip(output.obs, snapshot))
+                         for output, snapshot in kept]
+            if zero_copy:
+                assert not all(unchanged)  # 共享内存的视图已被后续输出覆盖
+            else:
+                assert all(unchanged)
+
+    def test_step_async(self):
+        env = self.make_env(3, shared_memory=True)
+        outputs = env.reset()
+        rng = random.Random(0)
+        n_resets = 0
+        for _ in range(45):
+            env.step_async([random_commands(output, rng) for output in outputs])
+            ready_outputs = dict(env.iter_step_wait())
+            assert sorted(ready_outputs) == [0, 1, 2]
+
+            outputs = [ready_outputs[env_id] for env_id in range(3)]
+            for output in outputs:
+                assert len(output.agent_id) == len(output.obs) == len(output.available_actions)
+                if "reserved_agent_id" in output:  # 对局结束, 已在子进程内重置
+                    assert all(output.done)
+                    assert len(output.reserved_agent_id) == len(output.reserved_obs) == len(output.reward)
+                    n_resets += 1
+        assert n_resets == 3
+
+    def test_collect_profile(self):
+        env = self.make_env(3)
+        profiler = StepProfiler()
+        with profiler:
+            assert env.collect_profile(profiler).n_steps == 0  # 开始记录子进程
+            outputs = env.reset()
+            rng = random.Random(0)
+            for _ in range(10):
+                outputs = env.step([random_commands(output, rng) for output in outputs])
+            env.collect_profile(profiler)
+        assert profiler.n_steps == 3 * 10  # 主进程中的第一个环境 + 两个子进程
+        assert len(profiler.times["board.copy"]) == 30
+        assert env.collect_profile(StepProfiler()).n_steps == 0  # 已取走的记录不再返回
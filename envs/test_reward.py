@@ -0,0 +1,225 @@
+import random
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from envs.carbon_trainer_env import CarbonTrainerEnv
+from envs.obs_parser import WorkerDirections, WorkerActionsByName
+from envs.reward import RewardCalculator
+from algorithms.base_policy import BasePolicy
+from zerosum_env.envs.carbon.helpers import Board, Point
+
+
+def reference_reward(env, my_state, opponent_state, current_obs: Board, previous_obs: Board, normalize=False):
+    """
+    原先基于dict和循环的CarbonTrainerEnv._calculate_reward, 作为对照.
+
+    :return env_reward, agent_rewards: my_state的游戏奖励以及my_state中我方各个agent的奖励
+    """
+    assert previous_obs is not None  # S(t), a(t) -> r(t), S(t+1)
+
+    # 游戏结束状态
+    game_end_code = None
+    if my_state.status != "ACTIVE":  # 对局结束
+        if my_state.reward == opponent_state.reward:  # 两选手分数相同(float)/或者均出错(None) (平局)
+            game_end_code = 0
+        elif my_state.reward is None:  # 我输,对手赢
+            game_end_code = -1
+        elif opponent_state.reward is None:  # 我赢,对手输
+            game_end_code = 1
+        elif my_state.reward > opponent_state.reward:  # 我赢,对手输
+            game_end_code = 1
+        elif my_state.reward < opponent_state.reward:  # 我输,对手赢
+            game_end_code = -1
+        else:
+            raise Exception("Should not go to here!")
+
+    # 工人信息
+    my_player = current_obs.players[current_obs.current_player_id]  # 本轮次当前玩家的工人信息
+    my_base_position = my_player.recrtCenters[0].position 
+    my_workers = {worker.id: worker for worker in my_player.workers}
+    previous_my_player = previous_obs.players[previous_obs.current_player_id]  # 上一轮次
+    previous_my_workers = {worker.id: worker for worker in previous_my_player.workers}
+
+    # 通树的信息,计算每个agent种树/抢树的花费
+    current_trees = {tree.id: tree for tree in current_obs.current_player.trees}
+    previous_trees = {tree.id: tree for tree in previous_obs.current_player.trees}
+    new_tree_ids = list(set(current_trees.keys()) - set(previous_trees.keys()))
+    worker_plant_cost = defaultdict(float)  # 种/抢树需要额外的花费
+    if new_tree_ids:  # 计算种树/抢树的花费
+        plant_cost = env.configuration.plantCost  # 默认种树价格
+        plant_cost_ratio = env.configuration.plantCostInflationRatio
+        plant_cost_base = env.configuration.plantCostInflationBase
+        alive_tree_count = len(current_obs.trees)
+        plant_market_price = plant_cost + plant_cost_ratio * (plant_cost_base ** alive_tree_count)  # 市场价格
+        is_first_tree = not previous_trees  # 首次种树价格: plant_cost, 其余树价格: plant_market_price
+        seize_cost = env.configuration.seizeCost  # 抢树价格
+        for tree_id in new_tree_ids:
+            tree = current_trees[tree_id]
+            tree_owner, _ = my_state.observation.trees[tree_id]
+            # tree owner 表示是哪个种树员种的树
+            if tree.age == 1:  # 种树
+                worker_plant_cost[tree_owner] += plant_cost if is_first_tree else plant_market_price
+            else:  # 抢树
+                worker_plant_cost[tree_owner] += seize_cost
+
+    # 下面计算单个agent的reward
+    max_reward = env.max_step
+    agent_reward_dict = {}  # 单个agent的reward, key: worker_id (含已死亡), value: 智能体reward
+
+    # 游戏结束时，会根据结束时的状态计算reward，如果输了会添加-300的惩罚、赢了会有正300的奖励
+    if game_end_code is not None:  # 游戏结束(注意: 游戏结束时,返回的current_cash不准确;未结束时,才准确!!!)
+        env_reward = game_end_code * max_reward
+    else:  # 游戏未结束
+        env_reward = my_player.cash - previous_my_player.cash  # 选手金额的变化
+
+    agent_accumulate_reward = 0  # 各agent的奖励总和
+
+    # 计算每个agent 种(抢)树和捕碳的每轮收益
+    tree_owner_reward = dict()  # key: worker_id, value: float
+    trees_dict = my_state.observation["trees"]
+    for tree_owner, tree_reward in trees_dict.values():
+        if tree_owner not in tree_owner_reward:
+            tree_owner_reward[tree_owner] = 0
+
+        tree_owner_reward[tree_owner] += tree_reward
+
+        agent_accumulate_reward += tree_reward
+
+    # 当前轮次，所有工人的reward
+    for worker in my_player.workers:
+        is_fresher = worker.id not in previous_my_workers  # 是否为新招募成员
+
+        # 计算种(抢)树收益
+        if worker.is_planter:
+            tree_reward = tree_owner_reward.get(worker.id, 0)  # 树收益
+            tree_reward = -1 if tree_reward == 0 else tree_reward
+        else:  # 捕碳员
+            tree_reward = tree_owner_reward.get(worker.id, 0)
+
+        # 计算捕碳收益
+        carbon_reward = 0
+        if worker.is_collector:
+            # 上一轮携带的CO2量
+            previous_carbon = 0 if is_fresher else previous_my_workers[worker.id].carbon
+            current_carbon = worker.carbon  # 当前轮携带的CO2量
+
+            if not is_fresher and worker.position == my_base_position:  # 非新招募人员,且在转化中心位置处
+                carbon_reward = previous_carbon  # 运回基地收益 (>= 0)
+                agent_accumulate_reward += carbon_reward
+            else:
+                carbon_reward = current_carbon - previous_carbon  # +/-/0, 正值:携带CO2增多,负值:被对方树吸收,0:游走
+                carbon_reward = carbon_reward / 100. if carbon_reward >= 0 else carbon_reward  # 捕碳增加量 / 100
+                carbon_reward = min(carbon_reward, 0.5)  # 身上碳减少 (惩罚项); 捕碳,最高奖励 +0.5
+            if carbon_reward == 0:  # 捕碳无收益
+                carbon_reward = -1
+
+        worker_reward = tree_reward + carbon_reward - worker_plant_cost[worker.id]  # 树净化收益 + 捕碳收益 - 树价格
+        agent_reward_dict[worker.id] = worker_reward
+
+    # 碰撞,被自己树/转化中心直接吸收奖励(碰撞后,agent可能活着,也可能死亡). 记录一下，暂时无法区分
+    env_extra_reward = max(round(env_reward - agent_accumulate_reward, 2), 0)  # 排除各agent自己的奖励
+
+    # 已经死亡的agent
+    death_agent_ids = {id_ for id_ in previous_my_workers.keys() if id_ not in agent_reward_dict}
+    agent_reward_dict.update({id_: -max_reward for id_ in death_agent_ids})
+    # death_agent_reward = max(env_extra_reward, 0)
+    # agent_reward_dict.update({id_: -max_reward if death_agent_reward == 0 else death_agent_reward
+    #                           for id_ in death_agent_ids})
+
+    # 基于上一轮次的位置+动作,计算新位置是否有碰撞,若碰撞,则惩罚
+    is_my_base_recruit = False  # 是否有招募新工人
+    position_agent_dict = defaultdict(set)
+    no_action_agent_ids = set()
+    events = current_obs.events
+    if events is not None:  # 由引擎记录的实际动作和碰撞计算
+        is_my_base_recruit = my_player.recrtCenters[0].id in events.recruits
+        for position, worker_ids in events.collisions.items():
+            position_agent_dict[position].update(id_ for id_ in worker_ids if id_ in previous_my_workers)
+        no_action_agent_ids.update(id_ for id_ in previous_my_workers if events.worker_actions.get(id_) is None)
+    elif my_player.id < len(env.previous_commands):
+        previous_my_command = env.previous_commands[my_player.id]
+        if previous_my_command:
+            is_my_base_recruit = my_player.recrtCenters[0].id in previous_my_command
+            for worker_id, worker in previous_my_workers.items():
+                if worker_id in previous_my_command:  # 有移动动作
+                    dx, dy = WorkerDirections[WorkerActionsByName[previous_my_command[worker_id]].value].tolist()
+                    new_position = worker.position + Point(dx, dy)
+                    position_agent_dict[new_position].add(worker_id)
+                else:  # 停留动作
+                    no_action_agent_ids.add(worker_id)
+                    position_agent_dict[worker.position].add(worker_id)
+    # 转化中心的奖励
+    if is_my_base_recruit and my_base_position in position_agent_dict:  # 转化中心招募,导致碰撞
+        for base in my_player.recrtCenters:
+            agent_reward_dict[base.id] = -max_reward
+    else:
+        for base in my_player.recrtCenters:
+            agent_reward_dict[base.id] = env_reward
+
+    for agent_ids in position_agent_dict.values():
+        if len(agent_ids) > 1:  # 人员移动, 发生碰撞
+            for agent_id in agent_ids:
+                if agent_id not in no_action_agent_ids:  # 仅仅惩罚移动的人员
+                    agent_reward_dict[agent_id] = -max_reward
+
+    if normalize:
+        agent_reward_dict = {k: np.clip(v / env.max_step, -1, 1)
+                             for k, v in agent_reward_dict.items()}
+    
+    return env_reward, agent_reward_dict
+
+
+def assert_same_reward(reward, expected):
+    env_reward, agent_rewards = reward
+    expected_env_reward, expected_agent_rewards = expected
+    assert np.isclose(env_reward, expected_env_reward)
+    assert set(agent_rewards) == set(expected_agent_rewards)  # 原先的实现中死亡的agent来自set, 顺序不定
+    for agent_id, value in expected_agent_rewards.items():
+        assert np.isclose(agent_rewards[agent_id], value), agent_id
+
+
+class RecordingEnv(CarbonTrainerEnv):
+    """每步同时用RewardCalculator和原先的实现计算reward, 包括由observation重建(没有事件)的Board"""
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.n_checked = 0
+
+    def _calculate_reward(self, my_state, opponent_state, current_obs, previous_obs, normalize=False):
+        reward = super()._calculate_reward(my_state, opponent_state, current_obs, previous_obs, normalize)
+        assert_same_reward(reward, reference_reward(self, my_state, opponent_state, current_obs, previous_obs,
+                                                    normalize))
+
+        rebuilt_obs = [Board(obs.observation, self.configuration) for obs in (current_obs, previous_obs)]
+        assert rebuilt_obs[0].events is None
+        assert_same_reward(super()._calculate_reward(my_state, opponent_state, *rebuilt_obs, normalize),
+                           reference_reward(self, my_state, opponent_state, *rebuilt_obs, normalize))
+        self.n_checked += 1
+        return reward
+
+
+class TestRewardCalculator:
+    @pytest.mark.parametrize("selfplay", [False, True])
+    def test_same_as_reference(self, selfplay):
+        env = RecordingEnv({"randomSeed": 5, "recCollectorCost": 10, "recPlanterCost": 10, "episodeSteps": 120})
+        rng = random.Random(5)
+        outputs = env.reset([None, None] if selfplay else None)
+        outputs = outputs if selfplay else [outputs]
+        for _ in range(200):
+            commands = [BasePolicy.to_env_commands({
+                agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+                for agent_id, available_actions in zip(output.agent_id, output.available_actions)})
+                for output in outputs]
+            outputs = env.step(commands if selfplay else commands[0])
+            outputs = outputs if selfplay else [outputs]
+            if all(outputs[0].done):
+                break
+        assert env.n_checked > 50
+
+    def test_reward_shaping(self):
+        env = CarbonTrainerEnv({"randomSeed": 5}, reward_shaping={"death_reward": -3, "collector_idle_reward": 0})
+        assert env.reward_calculator.death_reward == -3 and env.reward_calculator.collision_reward == -env.max_step
+        assert env.reward_calculator.collector_idle_reward == 0
+        with pytest.raises(AssertionError):
+            RewardCalculator(env.configuration, reward_shaping={"unknown": 1})
@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+
+from envs.carbon_trainer_env import CarbonTrainerEnv
+from envs.vector_carbon_env import VectorCarbonEnv
+from algorithms.base_policy import BasePolicy
+from zerosum_env import core
+
+
+def scripted_opponent(obs, configuration):
+    _, recrtCenters, workers, _ = obs.players[obs.player]
+    rng = random.Random(obs.step)
+    commands = {recrtCenter_id: rng.choice(["RECCOLLECTOR", "RECPLANTER"]) for recrtCenter_id in recrtCenters}
+    for worker_id in workers:
+        command = rng.choice([None, "UP", "RIGHT", "DOWN", "LEFT"])
+        if command is not None:
+            commands[worker_id] = command
+    return commands
+
+
+def random_commands(env_output, rng):
+    actions = {agent_id: rng.choice([i for i, available in enumerate(available_actions) if available == 1])
+               for agent_id, available_actions in zip(env_output.agent_id, env_output.available_actions)}
+    return BasePolicy.to_env_commands(actions)
+
+
+def assert_same_output(output, expected_output):
+    assert set(output) == set(expected_output)
+    for key, value in expected_output.items():
+        if key in ("obs", "available_actions"):
+            assert all(np.array_equal(v1, v2) for v1, v2 in zip(output[key], value))
+        else:
+            assert output[key] == value
+
+
+class TestVectorCarbonEnv:
+    def test_same_as_trainer_env(self):
+        trainer_env = CarbonTrainerEnv({"randomSeed": 3})
+        vector_env = VectorCarbonEnv({}, 1, seed=3, opponent_factory=lambda: scripted_opponent)
+
+        np.random.seed(0)
+        expected_output = trainer_env.reset([None, scripted_opponent])
+        np.random.seed(0)
+        output = vector_env.reset()[0]
+        assert_same_output(output, expected_output)
+
+        rng1, rng2 = random.Random(0), random.Random(0)
+        for _ in range(300):
+            expected_output = trainer_env.step(random_commands(expected_output, rng1))
+            output = vector_env.step([random_commands(output, rng2)])[0]
+            if all(expected_output.done):  # 对局结束后, VectorCarbonEnv 已自动重置
+                output = {key: output.get(f"reserved_{key}", output[key]) for key in expected_output}
+                assert_same_output(output, expected_output)
+                break
+            assert_same_output(output, expected_output)
+
+    def test_selfplay(self):
+        n_envs = 3
+        vector_env = VectorCarbonEnv({}, n_envs, seed=0)
+        outputs = vector_env.reset(selfplay=True)
+        assert len(outputs) == 2 and len(outputs[0]) == n_envs
+        assert vector_env.carbon.shape == (n_envs, 15, 15)
+
+        rng = random.Random(0)
+        for _ in range(20):
+            commands = [[random_commands(output1, rng), random_commands(output2, rng)]
+                        for output1, output2 in zip(*outputs)]
+            outputs = vector_env.step(commands)
+            for output in outputs[0]:
+                assert len(output.obs) == len(output.reward) == len(output.done)
+
+    def test_new_map_per_episode(self):
+        def trainer_map(env):
+            return np.array(env._env.env.steps[-1][0].observation.full_carbon).reshape(15, 15)
+
+        core.clear_initial_state_cache()
+        trainer_env = CarbonTrainerEnv({"randomSeed": 3})
+        vector_env = VectorCarbonEnv({}, 2, seed=3)
+        trainer_maps, vector_maps = [], []
+        for _ in range(3):
+            trainer_env.reset([None, None])
+            vector_env.reset(selfplay=True)
+            trainer_maps.append(trainer_map(trainer_env))
+            vector_maps.append(vector_env.carbon.copy())
+        # 同一个环境(对局位置)每局使用不同的地图, 两种环境的地图序列相同
+        assert len({map_.tobytes() for map_ in trainer_maps}) == 3
+        assert len({map_[0].tobytes() for map_ in vector_maps}) == 3
+        assert all(np.allclose(vector_map[0], map_) for vector_map, map_ in zip(vector_maps, trainer_maps))
+        assert not np.allclose(vector_maps[0][0], vector_maps[0][1])  # 对局位置1使用seed 4
+
+        # 指定的种子: 新的环境按相同的顺序使用缓存的初始状态
+        n_cached = len(core._initial_states)
+        trainer_env = CarbonTrainerEnv({"randomSeed": 3})
+        for map_ in trainer_maps:
+            trainer_env.reset([None, None])
+            assert np.array_equal(trainer_map(trainer_env), map_)
+        assert len(core._initial_states) == n_cached
@@ -0,0 +1,284 @@
+import copy
+from typing import Callable, Dict, List, Optional, Union
+
+from easydict import EasyDict
+import numpy as np
+
+from envs.carbon_trainer_env import CarbonTrainerEnv
+from envs.obs_parser import ObservationParser
+from envs.reward import RewardCalculator
+from zerosum_env import make
+from zerosum_env.core import episode_seed
+from zerosum_env.envs.carbon.array_board import ArrayBoard
+from zerosum_env.envs.carbon.helpers import Board
+from zerosum_env.utils import Struct, structify
+
+
+class CarbonGame(CarbonTrainerEnv):
+    """
+    Per game bookkeeping of VectorCarbonEnv: keeps the previous boards / commands and reuses the observation
+    and reward computation of CarbonTrainerEnv, without owning a zerosum environment.
+    """
+    def __init__(self, configuration, observation_parser: ObservationParser, reward_calculator: RewardCalculator):
+        self.previous_obs = self.current_obs = None
+        self.previous_opponent_obs = self.current_opponent_obs = None
+        self.previous_commands = []
+        self._configuration = configuration
+
+        self.grid_size = configuration.size
+        self.max_step = configuration.episodeSteps
+        self.observation_parser = observation_parser
+        self.reward_calculator = reward_calculator
+
+    @property
+    def configuration(self):
+        return self._configuration
+
+
+class VectorCarbonEnv:
+    """
+    N carbon games held in one process and advanced together by a single ArrayBoard step.
+    It has the same reset/step interface and outputs as ParallelEnv over CarbonTrainerEnv,
+    so it can replace it inside CarbonGameRunner.
+
+    The learner controls player 0. Without self-play, player 1 is driven by the opponent policy
+    (one instance per game, created by opponent_factory). The remaining overage time is not tracked.
+    """
+
+    def __init__(self, cfg: dict, n_envs: int, seed: Optional[int] = None,
+                 opponent_factory: Optional[Callable[[], Callable]] = None, reward_shaping: Optional[dict] = None):
+        """
+        :param cfg: (dict) carbon game configuration
+        :param n_envs: (int) number of games
+        :param seed: (int optional) game i uses the seeds derived from seed + i (zerosum_env.core.episode_seed), like
+            train.py does for ParallelEnv, otherwise a new seed is drawn for every game
+        :param opponent_factory: (callable optional) returns the agent function (obs, configuration) -> commands
+            of a new opponent, default is the planning policy used by CarbonEnv
+        :param reward_shaping: (dict optional) reward parameters, see envs.reward.default_reward_shaping
+        """
+        assert n_envs >= 1, "No environment given."
+        self.n_envs = n_envs
+        self.seed = seed
+        self._n_episodes = np.zeros(n_envs, dtype=int)  # 每个对局位置已开始的局数
+        self._env = make("carbon", configuration=cfg)  # 仅用于生成初始地图
+        self.configuration = self._env.configuration
+        self.opponent_factory = opponent_factory or self._default_opponent
+
+        self.observation_parser = ObservationParser(grid_size=self.configuration.size,
+                                                    max_step=self.configuration.episodeSteps,
+                                                    max_cell_carbon=self.configuration.maxCellCarbon,
+                                                    tree_lifespan=self.configuration.treeLifespan,
+                                                    action_space=5)
+        self.reward_calculator = RewardCalculator(self.configuration, self.configuration.episodeSteps, reward_shaping)
+        self.games = [CarbonGame(self.configuration, self.observation_parser, self.reward_calculator)
+                      for _ in range(n_envs)]
+        self.opponents = [None] * n_envs
+        self.selfplay = False
+
+        self._board = None
+        self._statuses = np.full((n_envs, 2), "ACTIVE", dtype=object)
+        self._rewards = np.zeros((n_envs, 2), dtype=object)
+        self._remaining_overage_time = [None] * n_envs
+        self._observations = [None] * n_envs
+        self._hidden = np.ones(n_envs, dtype=bool)  # 刚重置的对局, 选手还看不到任何格子的碳
+
+    @staticmethod
+    def _default_opponent():
+        from algorithms.daisheng_policy.daisheng_policy_20211223 import MyPolicy
+        return MyPolicy().take_action
+
+    @property
+    def carbon(self) -> np.ndarray:
+        """Full cell carbon of all games, shape (n_envs, size, size) in observation index order."""
+        size = self.configuration.size
+        return self._board.carbon.reshape(self.n_envs, size, size)
+
+    def _initial_observation(self, env_id: int) -> Dict:
+        if self.seed is not None:  # 每局使用不同的地图
+            self._env.configuration.randomSeed = episode_seed(self.seed + env_id, int(self._n_episodes[env_id]))
+        self._n_episodes[env_id] += 1
+        states = self._env.reset(2)
+        self._statuses[env_id] = [state.status for state in states]
+        self._rewards[env_id] = [state.reward for state in states]
+
+        observation = copy.deepcopy(states[0].observation)
+        observation.carbon = observation.pop("full_carbon")
+        self._remaining_overage_time[env_id] = observation.remainingOverageTime
+        return observation
+
+    def _agent_observation(self, full_observation: Dict, env_id: int, player_id: int) -> Struct:
+        """Observation seen by a player: the carbon is only visible around its workers."""
+        carbon = np.zeros(self.configuration.size ** 2)
+        if not self._hidden[env_id]:
+            indices = self._board.visible_indices(player_id, env_id)
+            carbon[indices] = self._board.carbon[env_id, indices]
+        return Struct(remainingOverageTime=self._remaining_overage_time[env_id],
+                      step=full_observation["step"],
+                      player=player_id,
+                      carbon=carbon.tolist(),
+                      players=full_observation["players"],
+                      trees=full_observation["trees"])
+
+    def _agent_states(self, full_observation: Dict, env_id: int) -> List[Struct]:
+        return [Struct(observation=self._agent_observation(full_observation, env_id, player_id),
+                         status=self._statuses[env_id, player_id],
+                         reward=self._rewards[env_id, player_id])
+                for player_id in range(2)]
+
+    def _reset_game(self, env_id: int) -> Union[EasyDict, List[EasyDict]]:
+        observation = self._observations[env_id] = self._initial_observation(env_id)
+        self._hidden[env_id] = True
+        if self._board is None:
+            return observation
+        self._board.reset_game(env_id, observation)  # 重置该局的id生成器
+        if not self.selfplay:
+            self.opponents[env_id] = self.opponent_factory()
+        return self._reset_output(env_id, self._agent_states(observation, env_id))
+
+    def _reset_output(self, env_id: int, states: List[Struct]) -> Union[EasyDict, List[EasyDict]]:
+        game = self.games[env_id]
+        my_state, opponent_state = states
+        game.previous_obs = None
+        game.current_obs = Board(my_state.observation, self.configuration)
+        game.previous_commands.clear()
+        my_output = game._parse_observation_and_reward(my_state, opponent_state, game.current_obs, None,
+                                                       env_reset=True)
+        if not self.selfplay:
+            return my_output
+
+        game.previous_opponent_obs = None
+        game.current_opponent_obs = Board(opponent_state.observation, self.configuration)
+        opponent_output = game._parse_observation_and_reward(opponent_state, my_state, game.current_opponent_obs,
+                                                             None, env_reset=True)
+        return [my_output, opponent_output]
+
+    def reset(self, selfplay=False):
+        """
+        Reset all games, the outputs are the same as ParallelEnv.reset:
+          a list with the output of each game, or [player1 outputs, player2 outputs] when selfplay is True
+        """
+        self.selfplay = selfplay
+        self._board = None
+        observations = [self._reset_game(env_id) for env_id in range(self.n_envs)]
+        self._board = ArrayBoard(observations, self.configuration)
+        self.opponents = [None if selfplay else self.opponent_factory() for _ in range(self.n_envs)]
+
+        total_outputs = [self._reset_output(env_id, self._agent_states(observation, env_id))
+                         for env_id, observation in enumerate(observations)]
+        if self.selfplay:  # 拆分出player1, player2的数据
+            total_outputs = [list(outputs) for outputs in zip(*total_outputs)]
+        return total_outputs
+
+    def _opponent_commands(self, full_observations: List[Dict]) -> List[Optional[Dict[str, str]]]:
+        commands = []
+        for env_id, (opponent, observation) in enumerate(zip(self.opponents, full_observations)):
+            if self._statuses[env_id, 1] != "ACTIVE":
+                commands.append(None)
+                continue
+            agent_observation = structify(self._agent_observation(observation, env_id, 1))
+            try:
+                commands.append(opponent(agent_observation, self.configuration))
+            except Exception:  # 同 zerosum_env 中出错的选手
+                self._statuses[env_id, 1] = "ERROR"
+                commands.append(None)
+        return commands
+
+    def step(self, actions):
+        """
+        Step all games with one ArrayBoard.next() call.
+        :param actions: commands of each game, a dict for player 0 or [player 0 dict, player 1 dict] in self-play
+        :return: the same outputs as ParallelEnv.step, finished games are reset and their last outputs kept under
+            the "reserved_" prefix
+        """
+        configuration = self.configuration
+        commands = [list(command) if isinstance(command, (list, tuple)) else [command, None] for command in actions]
+        if not self.selfplay:
+            for command, opponent_command in zip(commands, self._opponent_commands(self._observations)):
+                command[1] = opponent_command
+
+        board = self._board
+        board.set_next_actions([[command or {} for command in game_commands] for game_commands in commands])
+        board = self._board = board.next()
+        self._update_statuses()
+        self._hidden[:] = False
+
+        full_observations = self._observations = board.observations()
+        total_outputs = []
+        for env_id, (game, full_observation) in enumerate(zip(self.games, full_observations)):
+            game.previous_commands = commands[env_id]
+            my_state, opponent_state = self._agent_states(full_observation, env_id)
+
+            game.previous_obs = game.current_obs
+            game.current_obs = Board(my_state.observation, configuration)
+            my_output = game._parse_observation_and_reward(my_state, opponent_state,
+                                                           game.current_obs, game.previous_obs)
+            if self.selfplay:
+                game.previous_opponent_obs = game.current_opponent_obs
+                game.current_opponent_obs = Board(opponent_state.observation, configuration)
+                opponent_output = game._parse_observation_and_reward(opponent_state, my_state,
+                                                                     game.current_opponent_obs,
+                                                                     game.previous_opponent_obs)
+                total_outputs.append([my_output, opponent_output])
+            else:
+                total_outputs.append(my_output)
+
+        if self.selfplay:  # 拆分出player1, player2的数据
+            player1_outputs, player2_outputs = [list(outputs) for outputs in zip(*total_outputs)]
+            self._reset_if_env_done(player1_outputs, player2_outputs)
+            return [player1_outputs, player2_outputs]
+
+        self._reset_if_env_done(total_outputs, None)
+        return total_outputs
+
+    def _update_statuses(self) -> None:
+        """
+        Status and reward updates of the carbon interpreter and of Environment.step, applied to every game.
+        """
+        configuration = self.configuration
+        board = self._board
+        statuses, rewards = self._statuses, self._rewards
+        players = range(2)
+        n_workers = np.stack([(board.w_alive & (board.w_player == p)).sum(axis=1) for p in players], axis=1)
+        n_trees = np.stack([(board.t_alive & (board.t_player == p)).sum(axis=1) for p in players], axis=1)
+        n_bases = board.base_alive.sum(axis=2)
+
+        # 无捕碳员 且无种树员 且无树 且（无转化中心 或 玩家金额不足以招募）
+        no_potential = (n_workers == 0) & (n_trees == 0) & (
+                (n_bases == 0) | (board.cash < min(configuration.recCollectorCost, configuration.recPlanterCost)))
+        finished = (statuses == "ACTIVE") & no_potential
+        statuses[finished] = "DONE"
+        rewards[finished] = (board.steps[:, None] - configuration.episodeSteps - 1).repeat(2, axis=1)[finished]
+
+        failed = (statuses != "ACTIVE") & (statuses != "DONE")
+        for env_id, player_id in zip(*failed.nonzero()):  # 出错的选手失去所有工人和树
+            board.cash[env_id, player_id] = 0
+            board.w_alive[env_id] &= board.w_player[env_id] != player_id
+            board.t_alive[env_id] &= board.t_player[env_id] != player_id
+
+        last_active = ((statuses == "ACTIVE").sum(axis=1) < 2)[:, None] & (statuses == "ACTIVE")
+        statuses[last_active] = "DONE"
+
+        active = statuses == "ACTIVE"
+        rewards[active] = board.cash[active]
+        rewards[~active & (statuses != "DONE")] = 0
+        rewards[failed] = None
+
+        episode_end = (board.steps >= configuration.episodeSteps - 1)[:, None] & active
+        statuses[episode_end] = "DONE"
+
+    def _reset_if_env_done(self, player1_outputs, player2_outputs=None):
+        player2_outputs = [None] * len(player1_outputs) if player2_outputs is None else player2_outputs
+        for env_id, (output1, output2) in enumerate(zip(player1_outputs, player2_outputs)):  # 遍历每个环境的输出
+            if not all(output1['done']):
+                continue
+
+            reset_output = self._reset_game(env_id)
+            if isinstance(reset_output, list):
+                # 要替换的数据添加reserved_前缀
+                output1.update({f"reserved_{k}": output1[k] for k in reset_output[0].keys()})
+                output1.update(reset_output[0])  # 替换掉output中的 agent_id, obs, available_actions
+                output2.update({f"reserved_{k}": output2[k] for k in reset_output[1].keys()})
+                output2.update(reset_output[1])
+            else:
+                output1.update({f"reserved_{k}": output1[k] for k in reset_output.keys()})
+                output1.update(reset_output)
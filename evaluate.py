@@ -3,6 +3,7 @@ import torch
 from collections import Counter
 
 from zerosum_env import evaluate
+from zerosum_env.envs.carbon.replay import ReplayWriter
 from zerosum_env.envs.carbon.helpers import *
 from algorithms.planning_policy.planning_policy import PlanningPolicy
 from algorithms.eval_policy import EvalPolicy
@@ -15,6 +16,7 @@ try:
 except IndexError as e:
     print("没有指定测评轮数，使用默认值50")
     NUM_EPISODES = 3
+REPLAY_PATH = sys.argv[2] if len(sys.argv) > 2 else None  # 可选: 对局逐步写入回放文件 (ReplayReader读取)
 
 # 计算从start到现在花费的时间
 def time_cost(start):
@@ -42,12 +44,20 @@ if __name__ == '__main__':
 
     # function for testing
     def evaluate_agent():
-        rew, _, _, _ = evaluate(
-            "carbon",
-            agents=[agent, "random"],
-            configuration={"randomSeed": random.randint(1,2147483646)},
-            debug=True,
-            num_episodes=NUM_EPISODES)  # default == 1
+        replay_writer = ReplayWriter(REPLAY_PATH) if REPLAY_PATH else None
+        try:
+            episodes = evaluate(
+                "carbon",
+                agents=[agent, "random"],
+                configuration={"randomSeed": random.randint(1,2147483646)},
+                debug=True,
+                num_episodes=NUM_EPISODES,  # default == 1
+                record="rewards",  # 只需要rewards, 不渲染json和html
+                replay_writer=replay_writer)  # 对局不保留在内存中, 逐步写入回放文件
+        finally:
+            if replay_writer is not None:
+                replay_writer.close()
+        rew = [episode.rewards for episode in episodes]
         # measure the mean of rewards of two agents
         # counter = Counter("win vs. loss")
         # TODO: More rounds to evaluate?
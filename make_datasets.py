@@ -279,7 +279,16 @@ class ObservationParser:
         return local_obs, dones, available_actions
 
 
-def run_one_episode(player1Policy, player2Policy="random"):
+def make_env():
+    return make(environment="carbon",
+                configuration={"randomSeed": random.randint(1,2147483646)},
+                steps=[],
+                debug=False,
+                state=None,
+                trusted=True,
+                history="none")
+
+def run_one_episode(player1Policy, player2Policy="random", e=None):
     try:
         player1Policy.reset_record()
     except:
@@ -288,11 +297,10 @@ def run_one_episode(player1Policy, player2Policy="random"):
         player2Policy.reset_record()
     except:
         pass
-    e = make(environment="carbon", 
-             configuration={"randomSeed": random.randint(1,2147483646)},
-             steps=[],
-             debug=False,
-             state=None)
+    if e is None:
+        e = make_env()
+    else:  # 复用环境, 每局使用新的随机种子
+        e.configuration.randomSeed = random.randint(1,2147483646)
     player1Policy_action = "random" if player1Policy == "random" else player1Policy.take_action
     player2Policy_action = "random" if player2Policy == "random" else player2Policy.take_action
     agents = [player1Policy_action, player2Policy_action]
@@ -407,8 +415,9 @@ def transfer_ob_feature_to_model_feature(ob_result, label_agent2action=None, mas
 def collect_data(player1Policy, player2Policy="random", episode_count=1):
     data_list = []
     ob_parser = ObservationParser()
+    e = make_env()  # 所有对局复用同一个环境
     for _ in tqdm(range(episode_count), total=episode_count):
-        run_records = run_one_episode(player1Policy, player2Policy)
+        run_records = run_one_episode(player1Policy, player2Policy, e)
         for overall_action, current_obs, previous_obs, masked_map in run_records:
             local_obs, dones, available_actions = ob_parser.obs_transform(current_obs, previous_obs)
             label_agent2action = trans_policy_result(overall_action)
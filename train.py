@@ -6,6 +6,7 @@ import tensorboardX
 
 from config.main_config import config
 from envs.carbon_trainer_env import CarbonTrainerEnv
+from envs.vector_carbon_env import VectorCarbonEnv
 from carbon_game_runner import CarbonGameRunner
 from utils.parallel_env import ParallelEnv
 from utils.utils import create_folders_if_necessary
@@ -17,13 +18,17 @@ def main(cfg):
     cfg.runner.policy.critic_model.to(cfg.runner.device)
 
     # Load parallel environments
-    envs = []
-    for i in range(cfg.envs.n_threads):  # 对于每一个线程
-        carbon_env_config = copy.deepcopy(cfg.carbon_game)  # cfg.carbon_game == {}
-        carbon_env_config["randomSeed"] = cfg.envs.seed + i
-        envs.append(CarbonTrainerEnv(carbon_env_config))
+    if cfg.envs.vectorized:  # 单进程内批量运行所有对局
+        env = VectorCarbonEnv(copy.deepcopy(cfg.carbon_game), cfg.envs.n_threads, seed=cfg.envs.seed,
+                              reward_shaping=cfg.envs.reward_shaping)
+    else:
+        envs = []
+        for i in range(cfg.envs.n_threads):  # 对于每一个线程
+            carbon_env_config = copy.deepcopy(cfg.carbon_game)  # cfg.carbon_game == {}
+            carbon_env_config["randomSeed"] = cfg.envs.seed + i
+            envs.append(CarbonTrainerEnv(carbon_env_config, reward_shaping=cfg.envs.reward_shaping))
 
-    env = ParallelEnv(envs)  # 创建carbon_game的环境类
+        env = ParallelEnv(envs, shared_memory=cfg.envs.shared_memory)  # 创建carbon_game的环境类
 
     # Running dir
     training_from_scratch = cfg.envs.training_from_scratch
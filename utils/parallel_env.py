@@ -1,21 +1,138 @@
 from collections import defaultdict
+from multiprocessing.connection import wait
 
+from easydict import EasyDict
+import torch
 from torch.multiprocessing import Process, Pipe
 import gym
 
+from zerosum_env.profiling import StepProfiler
 
-def worker(conn, env):
+
+class SharedOutputRing:
+    """
+    Preallocated shared-memory slots holding the array part of CarbonTrainerEnv outputs.
+
+    The worker process writes agent observations, available actions, dones and rewards of each output into the next
+    slot of the ring and only sends the remaining small metadata (agent ids, infos, env reward) over the pipe.
+    The main process rebuilds the output with a copy of the slot, or with numpy views of the slot (zero_copy), in which
+    case a rebuilt output stays valid only until `n_slots` further outputs have been written by the worker.
+    """
+    array_keys = ("obs", "available_actions", "done", "reward")
+
+    def __init__(self, n_slots: int, max_agents: int, observation_dim: int, action_dim: int):
+        """
+        :param n_slots: (int) number of outputs kept in the ring (selfplay + reset writes 4 outputs in one step)
+        :param max_agents: (int) agent capacity of each slot, larger outputs are sent over the pipe directly
+        :param observation_dim: (int) dimension of agent observation features
+        :param action_dim: (int) dimension of agent available actions
+        """
+        self.n_slots = n_slots
+        self.max_agents = max_agents
+        self.position = 0  # 下一个写入的slot, 仅在worker进程中使用
+        self.tensors = {
+            "obs": torch.zeros((n_slots, max_agents, observation_dim), dtype=torch.float32).share_memory_(),
+            "available_actions": torch.zeros((n_slots, max_agents, action_dim), dtype=torch.int64).share_memory_(),
+            "done": torch.zeros((n_slots, max_agents), dtype=torch.bool).share_memory_(),
+            "reward": torch.zeros((n_slots, max_agents), dtype=torch.float64).share_memory_(),
+        }
+        self.arrays = {key: tensor.numpy() for key, tensor in self.tensors.items()}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["arrays"]  # numpy视图无法跨进程共享, 在新进程中基于共享的tensor重新创建
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.arrays = {key: tensor.numpy() for key, tensor in self.tensors.items()}
+
+    def write(self, output: EasyDict):
+        """
+        Write the array part of output into the next slot (worker process).
+        :return: (tuple) ("shared", metadata) or ("raw", output) if the output does not fit in a slot
+        """
+        n_agents = len(output["agent_id"]) if "agent_id" in output else 0
+        if n_agents > self.max_agents:
+            return "raw", output
+
+        slot = self.position
+        self.position = (self.position + 1) % self.n_slots
+        metadata = {"slot": slot, "n_agents": n_agents, "keys": list(output.keys()), "values": {}}
+        for key, value in output.items():
+            if key in self.array_keys and n_agents > 0:
+                self.arrays[key][slot, :n_agents] = value
+            else:
+                metadata["values"][key] = value
+        return "shared", metadata
+
+    def read(self, message, zero_copy=False) -> EasyDict:
+        """
+        Rebuild the output from metadata sent by the worker process (main process).
+        :param zero_copy: (bool) the arrays of the output are views of the slot instead of copies
+        """
+        kind, data = message
+        if kind == "raw":
+            return data
+
+        slot, n_agents, values = data["slot"], data["n_agents"], data["values"]
+        output = EasyDict()
+        for key in data["keys"]:
+            if key in values:
+                output[key] = values[key]
+            elif key in ("done", "reward"):
+                output[key] = self.arrays[key][slot, :n_agents].tolist()
+            else:
+                value = self.arrays[key][slot, :n_agents]
+                output[key] = list(value if zero_copy else value.copy())  # 每个key只拷贝一次
+        return output
+
+
+def is_env_done(env_output) -> bool:
+    """
+    Whether the game is over, env_output is a list of two players' outputs in self-play.
+    """
+    output = env_output[0] if isinstance(env_output, list) else env_output
+    return all(output['done'])
+
+
+def merge_reset_output(env_output, reset_output):
+    """
+    Replace env_output's agent_id, obs, available_actions... by the reset output of the finished game,
+    the replaced values of the last step are kept with a "reserved_" prefix.
+    """
+    if isinstance(reset_output, list):
+        for output, player_reset_output in zip(env_output, reset_output):
+            merge_reset_output(output, player_reset_output)
+    else:
+        reserved_output = {f"reserved_{k}": env_output[k] for k in reset_output.keys()}  # 要替换的数据添加reserved_前缀
+        env_output.update(reserved_output)
+        env_output.update(reset_output)  # 替换掉output中的 agent_id, obs, available_actions
+
+
+def worker(conn, env, ring=None):
+    def pack(env_output):
+        if ring is None or env_output is None:
+            return env_output
+        # 数组写入共享内存, 仅发送元数据
+        return [ring.write(output) for output in env_output] if isinstance(env_output, list) else ring.write(env_output)
+
+    players = None
+    profiler = None
     while True:
         cmd, data = conn.recv()
         if cmd == "step":
             env_output = env.step(data)
-            # env_done = env_output.done if isinstance(env_output.done, bool) else all(env_output.done)
-            # if env_done:
-            #     obs = env.reset()
-            conn.send(env_output)
+            reset_output = env.reset(players) if is_env_done(env_output) else None  # 游戏结束, 在子进程内直接重置
+            conn.send((pack(env_output), pack(reset_output)))
         elif cmd == "reset":
-            env_output = env.reset(data)
-            conn.send(env_output)
+            players = data
+            conn.send(pack(env.reset(data)))
+        elif cmd == "profile":
+            if profiler is None:  # 第一次调用时开始记录
+                profiler = StepProfiler().start()
+            conn.send(profiler)  # 发送后清空, 只返回上次调用后的记录
+            profiler.reset()
         else:
             raise NotImplementedError
 
@@ -23,17 +140,34 @@ def worker(conn, env):
 class ParallelEnv(gym.Env):
     """A concurrent execution of environments in multiple processes."""
 
-    def __init__(self, envs):
+    def __init__(self, envs, shared_memory=False, max_agents=32, n_slots=4, zero_copy=False):
+        """
+        :param envs: (List[CarbonTrainerEnv]) the first env runs in the main process, the others in worker processes
+        :param shared_memory: (bool optional) workers write observations, available actions, dones and rewards into
+            preallocated shared memory instead of pickling them through the pipe, the main process copies them out.
+        :param max_agents: (int optional) agent capacity of a shared-memory slot
+        :param n_slots: (int optional) number of outputs kept in the shared memory of each env
+        :param zero_copy: (bool optional) with shared_memory, the returned arrays are views of the shared memory
+            instead of copies, valid only until `n_slots` further outputs of the same env (selfplay + reset writes
+            4 outputs in one step), copy them to keep longer.
+        """
         assert len(envs) >= 1, "No environment given."
         self.envs = envs
         # self.observation_space = self.envs[0].observation_space
         # self.action_space = self.envs[0].action_space
         self.selfplay = False
+        self.zero_copy = zero_copy
+        self._pending_action = None  # step_async后, 等待在主进程内执行的第一个环境的动作
         self.locals = []
+        self.rings = []
         for env in self.envs[1:]:
             local, remote = Pipe()
             self.locals.append(local)
-            p = Process(target=worker, args=(remote, env))
+            ring = None
+            if shared_memory:
+                ring = SharedOutputRing(n_slots, max_agents, env.observation_parser.observation_dim, env.act_space.n)
+            self.rings.append(ring)
+            p = Process(target=worker, args=(remote, env, ring))
             p.daemon = True
             p.start()
             remote.close()
@@ -49,7 +183,7 @@ class ParallelEnv(gym.Env):
         for local in self.locals:
             local.send(("reset", players))
         one_output = self.envs[0].reset(players)
-        other_outputs = [local.recv() for local in self.locals]
+        other_outputs = [self._read(env_id, local.recv()) for env_id, local in enumerate(self.locals, 1)]
         total_outputs = [one_output] + other_outputs
         if self.selfplay:  # 拆分出player1, player2的数据
             total_outputs = [[v[i] for v in total_outputs] for i, _ in enumerate(total_outputs[0])]
@@ -58,45 +192,76 @@ class ParallelEnv(gym.Env):
         return total_outputs
 
     def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """
+        Send actions to all envs without waiting for the results, finished games are reset inside the worker process.
+        Call step_wait or iter_step_wait to get the outputs.
+        """
+        assert self._pending_action is None, "step_async called before the previous step finished."
         for local, action in zip(self.locals, actions[1:]):
             local.send(("step", action))
-        one_output = self.envs[0].step(actions[0])
-        total_outputs = [one_output] + [local.recv() for local in self.locals]
+        self._pending_action = actions[0]
 
-        if self.selfplay:  # 拆分出player1, player2的数据
-            player1_outputs, player2_outputs = [[v[i] for v in total_outputs] for i, _ in enumerate(total_outputs[0])]
-            self._reset_if_env_done(player1_outputs, player2_outputs)
-            total_outputs = [player1_outputs, player2_outputs]
-        else:
-            self._reset_if_env_done(total_outputs, None)
+    def iter_step_wait(self):
+        """
+        Yield (env_id, env_output) in the order the envs finish stepping, so that the outputs of fast envs
+        can be processed while the slower ones are still running. Finished games are already reset, their last
+        outputs are kept with a "reserved_" prefix. Outputs are not split by player in self-play.
+        """
+        action, self._pending_action = self._pending_action, None
+        players = [None, None] if self.selfplay else None
+        env_output = self.envs[0].step(action)  # 第一个环境在主进程内运行, 与子进程并行
+        if is_env_done(env_output):
+            merge_reset_output(env_output, self.envs[0].reset(players))
+        yield 0, env_output
+
+        pending = {local: env_id for env_id, local in enumerate(self.locals, 1)}
+        while pending:
+            for local in wait(list(pending)):
+                env_id = pending.pop(local)
+                env_output, reset_output = local.recv()
+                env_output = self._read(env_id, env_output)
+                if reset_output is not None:
+                    merge_reset_output(env_output, self._read(env_id, reset_output))
+                yield env_id, env_output
+
+    def step_wait(self):
+        """
+        Wait for all envs started by step_async, the outputs are the same as step.
+        """
+        total_outputs = [None] * len(self.envs)
+        for env_id, env_output in self.iter_step_wait():
+            total_outputs[env_id] = env_output
 
+        if self.selfplay:  # 拆分出player1, player2的数据
+            total_outputs = [[v[i] for v in total_outputs] for i, _ in enumerate(total_outputs[0])]
         return total_outputs
 
-    def _reset_if_env_done(self, player1_outputs, player2_outputs=None):
-        player2_outputs = [None] * len(player1_outputs) if player2_outputs is None else player2_outputs
-        for env_id, (output1, output2) in enumerate(zip(player1_outputs, player2_outputs)):  # 遍历每个并行环境的输出
-            env_done = all(output1['done'])
-            if env_done:
-                players = [None, None] if self.selfplay else None
-                if env_id == 0:
-                    reset_output = self.envs[0].reset(players)
-                else:
-                    self.locals[env_id - 1].send(("reset", players))
-                    reset_output = self.locals[env_id - 1].recv()
-
-                if isinstance(reset_output, list):
-                    # 要替换的数据添加reserved_前缀
-                    reserved_output = {f"reserved_{k}": output1[k] for k in reset_output[0].keys()}
-                    output1.update(reserved_output)
-                    output1.update(reset_output[0])  # 替换掉output中的 agent_id, obs, available_actions
-
-                    reserved_output = {f"reserved_{k}": output2[k] for k in reset_output[1].keys()}
-                    output2.update(reserved_output)
-                    output2.update(reset_output[1])  # 替换掉output中的 agent_id, obs, available_actions
-                else:
-                    reserved_output = {f"reserved_{k}": output1[k] for k in reset_output.keys()}
-                    output1.update(reserved_output)
-                    output1.update(reset_output)  # 替换掉output中的 agent_id, obs, available_actions
+    def collect_profile(self, profiler: StepProfiler) -> StepProfiler:
+        """
+        Merges the steps recorded in the worker processes since the previous call into profiler, the first call
+        starts profiling the workers. The first env runs in the main process and is recorded by the active profiler
+        of the main process.
+        """
+        for local in self.locals:
+            local.send(("profile", None))
+        for local in self.locals:
+            profiler.merge(local.recv())
+        return profiler
+
+    def _read(self, env_id, message):
+        """
+        Rebuild the output of worker env from shared memory if necessary.
+        """
+        ring = self.rings[env_id - 1]
+        if ring is None or message is None:
+            return message
+        if isinstance(message, list):
+            return [ring.read(m, self.zero_copy) for m in message]
+        return ring.read(message, self.zero_copy)
 
     def render(self, mode="human"):
         raise NotImplementedError
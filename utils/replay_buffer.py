@@ -1,29 +1,63 @@
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Iterator
 
 from easydict import EasyDict
 
 import numpy as np
 import torch
 
-from utils.utils import to_tensor, flatten
-
 
 class ReplayBuffer(object):
     """ Replay Memory of transition data.
+
+    The transitions are stored in preallocated tensors (one per key).
     Args:
-        max_size (int): size of replay memory. If size of data inserted into the buffer exceeds, then the max_size will
-            increase according to the new full data size.
+        max_size (int): size of replay memory. If the inserted data exceeds it, the max_size grows (at least doubled),
+            the stored data is kept.
+        device: device of the training data.
+        obs_dtype: dtype to store the observations, e.g. torch.float16 to halve the memory of the largest key.
+        pin_memory (bool): keep the data in pinned CPU memory and copy the minibatches to the (cuda) device
+            asynchronously, instead of storing the data on the device. Ignored when cuda is not available.
+        ring (bool): write the transitions as a ring: data beyond max_size overwrites the oldest transitions instead
+            of growing the buffer (only a single batch larger than max_size still grows it).
     """
 
-    def __init__(self, max_size: int, device):
+    def __init__(self, max_size: int, device, obs_dtype: torch.dtype = torch.float32, pin_memory: bool = False,
+                 ring: bool = False):
         self.max_size = max_size
-        self.device = device
+        self.ring = ring
+        self.device = torch.device(device)
+        self.obs_dtype = obs_dtype
+        self.pin_memory = pin_memory and torch.cuda.is_available() and self.device.type == 'cuda'
+        self._storage_device = torch.device('cpu') if self.pin_memory else self.device
 
         self._build = False
-        self._data = {}
+        self._data: Dict[str, torch.Tensor] = {}
+        self._shuffled: Dict[str, torch.Tensor] = {}  # iter_batches打乱顺序后的数据 (复用)
 
         self.reset()
 
+    def _empty(self, size: int, shape, dtype) -> torch.Tensor:
+        return torch.zeros((size, *shape), dtype=dtype, device=self._storage_device, pin_memory=self.pin_memory)
+
+    def _enlarge(self, max_size: int):
+        """
+        扩展容量, 按时间顺序保留已有数据 (写满后, 最旧的数据位于_current_pos)
+        """
+        print(f"Enlarge replay buffer size from {self.max_size} to {max_size}")
+        is_full = self._valid_count == self.max_size
+        for key, old_data in self._data.items():
+            new_data = self._empty(max_size, old_data.shape[1:], old_data.dtype)
+            if is_full:
+                n_tail = self.max_size - self._current_pos
+                new_data[: n_tail] = old_data[self._current_pos:]
+                new_data[n_tail: self._valid_count] = old_data[: self._current_pos]
+            else:
+                new_data[: self._valid_count] = old_data[: self._valid_count]
+            self._data[key] = new_data
+        self._shuffled.clear()
+        self.max_size = max_size
+        self._current_pos = self._valid_count
+
     def get_batches_starting_indexes(self, batch_size):
         if batch_size >= self._valid_count:
             return [np.arange(self._valid_count)]
@@ -37,53 +71,84 @@ class ReplayBuffer(object):
         return batches_starting_indexes
 
     def sample_batch_by_indices(self, batch_indices) -> EasyDict:
-        return EasyDict({key: value[batch_indices] for key, value in self._data.items()})
+        return EasyDict({key: self._to_device(value[batch_indices]) for key, value in self._data.items()})
+
+    def iter_batches(self, batch_size: int, shuffle: bool = True) -> Iterator[EasyDict]:
+        """
+        Iterate over all the valid data by minibatches.
+        The data is shuffled once (into a reused buffer) per call, each minibatch is a view of it, not a copy.
+
+        :param batch_size: (int) size of the minibatches, the last one may be smaller.
+        :param shuffle: (bool) shuffle the data, otherwise the minibatches are views of the buffer itself.
+        :return: minibatches of the data (EasyDict: key -> tensor)
+        """
+        data = {key: value[: self._valid_count] for key, value in self._data.items()}
+        if shuffle and batch_size < self._valid_count:
+            indices = torch.randperm(self._valid_count, device=self._storage_device)
+            for key, value in data.items():
+                shuffled = self._shuffled.get(key)
+                if shuffled is None or len(shuffled) < self._valid_count:
+                    shuffled = self._shuffled[key] = self._empty(self._valid_count, value.shape[1:], value.dtype)
+                data[key] = torch.index_select(value, 0, indices, out=shuffled[: self._valid_count])
+
+        for start in range(0, self._valid_count, batch_size):
+            yield EasyDict({key: self._to_device(value[start: start + batch_size]) for key, value in data.items()})
 
-    def append(self, data: Union[List[Dict[str, Dict[str, List[np.ndarray]]]], Dict[str, Dict[str, List[np.ndarray]]]]):
+    def _to_device(self, value: torch.Tensor) -> torch.Tensor:
+        return value.to(self.device, non_blocking=True) if self.pin_memory else value
+
+    def append(self, data: Union[List[Dict[str, Dict[str, np.ndarray]]], Dict[str, Dict[str, np.ndarray]]]):
+        """
+        Append the transitions of agents.
+        :param data: agent_id -> key -> data of the agent (first dim is step), or a list of them.
+            The data of each key is written into the buffer with a single copy.
+        """
         if isinstance(data, (list, tuple)):   # list of dict to dict of list
             data = [agent_value for env_value in data for agent_value in env_value.values()]
         else:
             data = list(data.values())
-        data = {k: np.concatenate(flatten([d[k] for d in data])).astype(np.float32) for k in data[0]}
+        if not data:
+            return
+        self.append_batch({k: [d[k] for d in data] for k in data[0]})
 
-        batch_size = None
-        if not self._build:  # 初始化
-            for key, value in data.items():
-                value = to_tensor(value, raise_error=False)
-                if value is not None:
-                    batch_size = len(value) if batch_size is None else batch_size
-                    if batch_size > self.max_size:
-                        print(f"Enlarge replay buffer size from {self.max_size} to {batch_size}")
-                        self.max_size = batch_size
-                    buffer = torch.zeros((self.max_size, *value.shape[1:]),
-                                         dtype=torch.float32, device=self.device)
-                    buffer[: batch_size] = value
-                    self._data[key] = buffer
+    def append_batch(self, batch: Dict[str, Union[np.ndarray, List[np.ndarray]]]):
+        """
+        Append columnar transitions.
+        :param batch: key -> data (first dim is transition), or a list of data to be concatenated.
+        """
+        batch = {key: value if isinstance(value, (list, tuple)) else [value] for key, value in batch.items()}
+        batch_size = sum(len(value) for value in next(iter(batch.values())))
 
+        if not self._build:  # 初始化
+            if batch_size > self.max_size:
+                print(f"Enlarge replay buffer size from {self.max_size} to {batch_size}")
+                self.max_size = batch_size
+            for key, value in batch.items():
+                dtype = self.obs_dtype if key == 'obs' else torch.float32
+                self._data[key] = self._empty(self.max_size, np.shape(value[0])[1:], dtype)
             self._build = True
-        else:
-            valid_key = next(iter(self._data.keys()))
-            batch_size = len(data[valid_key])
-
-            new_data_size = self._current_pos + batch_size
-            if new_data_size > self.max_size:  # 溢出,自动扩展
-                print(f"Enlarge replay buffer size from {self.max_size} to {new_data_size}")
-                self.max_size = new_data_size
-
-                new_data = {}
-                for key, old_data in self._data.items():
-                    new_data[key] = torch.zeros((self.max_size, *old_data.shape[1:]),
-                                                dtype=torch.float32)
-                    new_data[key][: self._current_pos] = old_data[self._current_pos]
-                self._data = new_data
-
-            for key, buffer in self._data.items():
-                value = to_tensor(data[key], raise_error=True)
-                buffer[self._current_pos: self._current_pos + batch_size] = value
+        elif batch_size > self.max_size or not self.ring and self._valid_count + batch_size > self.max_size:
+            # 溢出时自动扩展 (ring模式下覆盖最旧的数据, 仅单批数据超出容量时扩展)
+            self._enlarge(max(self._valid_count + batch_size, 2 * self.max_size))
+
+        end = self._current_pos + batch_size
+        for key, buffer in self._data.items():
+            if buffer.device.type == 'cpu' and buffer.dtype == torch.float32 and end <= self.max_size:  # 一次拷贝
+                np.concatenate(batch[key], axis=0, out=buffer[self._current_pos: end].numpy(), casting='unsafe')
+                continue
+            if buffer.device.type == 'cpu':  # 逐段直接写入buffer (转换类型时numpy较慢)
+                values = [torch.from_numpy(np.asarray(value)) for value in batch[key]]
+            else:  # 拼接后一次拷贝到device
+                values = [torch.from_numpy(np.concatenate(batch[key], axis=0))]
+            position = self._current_pos
+            for value in values:
+                n_head = min(len(value), self.max_size - position)
+                buffer[position: position + n_head] = value[: n_head]
+                buffer[: len(value) - n_head] = value[n_head:]  # 写满后, 覆盖最旧的数据
+                position = (position + len(value)) % self.max_size
 
         self._valid_count = min(self._valid_count + batch_size, self.max_size)  # 当前size
-        # print(f"Replay Buffer: data position: [{self._current_pos} : {self._valid_count}], size: {batch_size}")
-        self._current_pos = (self._current_pos + batch_size) % self.max_size  # 当前最新的位置
+        self._current_pos = end % self.max_size  # 当前最新的位置
 
     def count(self) -> int:
         """
@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+
+from utils.replay_buffer import ReplayBuffer
+
+
+def make_transitions(n_agents, n_steps, start=0, obs_dim=4):
+    """
+    :return: agent_id -> transition data, 各行的obs/reward为其全局序号 (从start开始)
+    """
+    transitions, c = {}, start
+    for i in range(n_agents):
+        index = np.arange(c, c + n_steps)
+        transitions[f"agent-{c}"] = dict(obs=np.repeat(index[:, None], obs_dim, axis=1).astype(np.float32),
+                                         action=index % 5, reward=index.astype(np.float32),
+                                         return_=index.astype(np.float64))  # compute_returns的输出为float64
+        c += n_steps
+    return transitions
+
+
+class TestReplayBuffer:
+    def test_append_and_enlarge(self):
+        buffer = ReplayBuffer(10, "cpu")
+        buffer.append([make_transitions(2, 3), make_transitions(1, 2, start=6)])
+        buffer.append(make_transitions(2, 4, start=8))  # 溢出, 扩展并保留已有数据
+        assert len(buffer) == 16 and buffer.max_size >= 16
+        data = buffer.sample_batch_by_indices(np.arange(len(buffer)))
+        assert torch.equal(data.reward, torch.arange(16, dtype=torch.float32))
+        assert torch.equal(data.obs, data.reward[:, None].repeat(1, 4))
+        assert data.return_.dtype == torch.float32 and torch.equal(data.action, data.reward % 5)
+
+    def test_exact_fill(self):
+        buffer = ReplayBuffer(10, "cpu")
+        buffer.append(make_transitions(2, 5))  # 恰好写满
+        assert len(buffer) == 10 and buffer.max_size == 10
+        buffer.append(make_transitions(1, 5, start=10))  # 写满后继续扩展, 不覆盖已有数据
+        assert len(buffer) == 15 and buffer.max_size == 20
+        rewards = buffer.sample_batch_by_indices(np.arange(len(buffer))).reward
+        assert rewards.tolist() == list(range(15))
+
+        buffer = ReplayBuffer(8, "cpu")
+        buffer.append(make_transitions(2, 4))
+        buffer.append(make_transitions(1, 5, start=8))
+        assert len(buffer) == 13
+        assert buffer.sample_batch_by_indices(np.arange(13)).reward.tolist() == list(range(13))
+
+    def test_ring(self):
+        buffer = ReplayBuffer(8, "cpu", ring=True)
+        buffer.append(make_transitions(2, 4))  # 写满
+        buffer.append(make_transitions(1, 3, start=8))  # 覆盖最旧的数据
+        assert len(buffer) == 8 and buffer.max_size == 8
+        rewards = buffer.sample_batch_by_indices(np.arange(8)).reward
+        assert sorted(rewards.tolist()) == list(range(3, 11))
+
+        buffer.append(make_transitions(1, 10, start=11))  # 单批数据超出容量, 按时间顺序保留已有数据
+        rewards = buffer.sample_batch_by_indices(np.arange(len(buffer))).reward
+        assert rewards.tolist() == list(range(3, 21))
+
+        buffer = ReplayBuffer(100, "cpu", ring=True)
+        buffer.append(make_transitions(1, 90))
+        buffer.append(make_transitions(1, 20, start=90))  # 未写满时跨越边界, 同样覆盖最旧的数据
+        assert len(buffer) == 100 and buffer.max_size == 100
+        assert sorted(buffer.sample_batch_by_indices(np.arange(100)).reward.tolist()) == list(range(10, 110))
+
+    def test_iter_batches(self):
+        buffer = ReplayBuffer(100, "cpu", obs_dtype=torch.float16)
+        buffer.append(make_transitions(5, 9))
+        batches = list(buffer.iter_batches(8))
+        assert [len(batch.reward) for batch in batches] == [8] * 5 + [5]
+        rewards = torch.cat([batch.reward for batch in batches])
+        assert sorted(rewards.tolist()) == list(range(45))  # 每条数据恰好一次
+        for batch in batches:
+            assert batch.obs.dtype == torch.float16
+            assert torch.equal(batch.obs.float(), batch.reward[:, None].repeat(1, 4))
+
+        batch, = buffer.iter_batches(64)
+        assert batch.reward.data_ptr() == buffer.sample_batch_by_indices(0).reward.data_ptr()  # 视图, 没有拷贝
+
+        buffer.reset()
+        buffer.append(make_transitions(1, 3, start=100))
+        batch, = buffer.iter_batches(8)
+        assert batch.reward.tolist() == [100, 101, 102]
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from utils.tournament import wilson_interval, elo_ratings, summarize, run_tournament, load_results, play_match
+
+created = []  # 创建的策略实例, 每局两个
+
+
+class IdlePolicy:
+    def __init__(self):
+        created.append(self)
+
+    def take_action(self, observation, configuration):
+        return {}
+
+
+class MalformedPolicy(IdlePolicy):
+    def take_action(self, observation, configuration):
+        return {"not-an-agent": "JUMP"}
+
+
+def result(policy_a, policy_b, winner, seed=0, reward_a=1.0, reward_b=0.0):
+    return {"policy_a": policy_a, "policy_b": policy_b, "seed": seed, "reward_a": reward_a, "reward_b": reward_b,
+            "winner": winner}
+
+
+class TestTournament:
+    def test_wilson_interval(self):
+        assert wilson_interval(0, 0) == (0.0, 1.0)
+        low, high = wilson_interval(8, 10)
+        assert low == pytest.approx(0.4902, abs=1e-4) and high == pytest.approx(0.9433, abs=1e-4)
+        low, high = wilson_interval(5, 10)
+        assert low + high == pytest.approx(1.0)  # 50%胜率的区间对称
+        assert wilson_interval(10, 10)[1] == 1.0 and wilson_interval(0, 10)[0] == 0.0
+        assert wilson_interval(50, 100)[1] - wilson_interval(50, 100)[0] < high - low  # 对局越多区间越窄
+
+    def test_elo_ratings(self):
+        results = [result("a", "b", "A", seed) for seed in range(5)] + \
+                  [result("b", "c", "A", seed) for seed in range(5)] + [result("a", "c", "draw", 0)]
+        ratings = elo_ratings(results)
+        assert ratings["a"] > ratings["b"] > ratings["c"]
+        assert sum(ratings.values()) == pytest.approx(1500 * 3)
+        shuffled = list(results)
+        random.Random(0).shuffle(shuffled)
+        assert elo_ratings(shuffled) == ratings  # 与对局完成的顺序无关
+
+    def test_summarize(self):
+        results = [result("a", "b", "A", 0), result("b", "a", "A", 0), result("a", "c", "draw", 0),
+                   result("c", "a", "A", 1, reward_a=1.0, reward_b=None)]
+        summary = summarize(results)
+        assert list(summary) == sorted(summary, key=lambda name: -summary[name]["elo"])
+        a = summary["a"]
+        assert (a["games"], a["wins"], a["draws"], a["losses"], a["errors"]) == (4, 1, 1, 2, 1)
+        assert a["win_rate"] == pytest.approx(1.5 / 4)
+        assert a["win_rate_ci"] == wilson_interval(1.5, 4)
+        assert a["opponents"] == {"b": 0.5, "c": 0.25}
+        assert summary["b"]["opponents"] == {"a": 0.5} and summary["c"]["errors"] == 0
+
+    def test_play_match(self):
+        policies = {"idle": IdlePolicy, "malformed": MalformedPolicy}
+        match = play_match("malformed", "idle", 3, {"episodeSteps": 5}, policy_factories=policies)
+        assert (match["seed"], match["status_a"], match["reward_a"], match["winner"]) == (3, "INVALID", None, "B")
+
+    @pytest.mark.parametrize("file_name", ["results.jsonl", "results.csv"])
+    def test_resume(self, tmp_path, file_name):
+        path = str(tmp_path / file_name)
+        policies = {"idle": IdlePolicy, "malformed": MalformedPolicy}
+        configuration = {"episodeSteps": 5}
+        created.clear()
+        results = run_tournament(policies, range(2), path, configuration=configuration)
+        assert len(results) == 4 and len(created) == 8  # 2个有序对 x 2个种子
+        for r in results:  # 非法动作判负
+            malformed_side = "A" if r["policy_a"] == "malformed" else "B"
+            assert r[f"status_{malformed_side.lower()}"] == "INVALID"
+            assert r["winner"] == ("B" if malformed_side == "A" else "A")
+
+        created.clear()
+        resumed = run_tournament(policies, range(3), path, configuration=configuration)
+        assert len(created) == 4  # 仅新种子的对局
+        assert len(resumed) == 6 and len(load_results(path)) == 6
+        assert {(r["policy_a"], r["policy_b"], r["seed"]) for r in resumed} == \
+               {(a, b, seed) for a, b in (("idle", "malformed"), ("malformed", "idle")) for seed in range(3)}
+        assert resumed[:4] == load_results(path)[:4]
@@ -0,0 +1,183 @@
+import copy
+import random
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+from easydict import EasyDict
+
+from utils.trajectory_buffer import TrajectoryBuffer
+
+
+class ReferenceTrajectoryBuffer:
+    """
+    原先基于嵌套dict和deepcopy的TrajectoryBuffer, 作为对照.
+    """
+    def __init__(self):
+        self.policy_data = defaultdict(dict)  # policy_id -> env_id -> agent_id -> key -> [step1, step2, ...]
+
+    def get_transitions(self, policy_id: int, env_id: int) -> Dict[str, Dict[str, List[Any]]]:
+        """
+        返回玩家的transition数据,并清除
+
+        :param policy_id: 玩家ID
+        :param env_id: 游戏环境ID
+        :return: 每个agent对应的transition数据: S(t), a(t), logit(t), V(t), r(t), done(t+1)
+        """
+        assert env_id in self.policy_data[policy_id]
+        raw_policy_data = self.policy_data[policy_id].pop(env_id)  # 单个玩家某个并行环境下的数据
+        # 将每个玩家的每个游戏环境下, 单个agent的数据 (过滤掉出生即死亡的agent, 仅有策略数据,没有环境数据)
+        policy_data = {agent_id: {key: np.array(value[: len(agent_data['done'])], dtype=np.float32)
+                                  for key, value in agent_data.items()  # 每个key对应的value,转成numpy.ndarray类型
+                                  }
+                       for agent_id, agent_data in raw_policy_data.items() if 'done' in agent_data  # 每个agent
+                       }
+
+        for agent_id, agent_data in policy_data.items():  # 校验agent done是否结束
+            assert agent_data['done'][-1] == 1
+
+        return policy_data
+
+    def add_policy_data(self, policy_id: int, policy_data):
+        """
+        添加策略相关的数据
+        :param policy_id: 玩家ID
+        :param policy_data: 策略相关数据: S(t) => Policy => a(t), V(t), logit(t)
+        """
+        if not self.policy_data[policy_id]:
+            env_buffer = {}
+            for env_id, new_data in policy_data.items():
+                env_buffer[env_id] = {}
+                for agent_id, agent_new_data in new_data.items():
+                    env_buffer[env_id][agent_id] = {}
+                    for new_key, new_value in agent_new_data.items():
+                        env_buffer[env_id][agent_id][new_key] = [copy.deepcopy(new_value)]
+            self.policy_data[policy_id] = env_buffer
+        else:
+            for env_id, new_data in policy_data.items():
+                if env_id not in self.policy_data[policy_id]:  # env数据已经被取出,此时为空,需重新添加
+                    self.policy_data[policy_id][env_id] = {}
+
+                env_buffer = self.policy_data[policy_id][env_id]
+                for agent_id, agent_new_data in new_data.items():
+                    if agent_id not in env_buffer:
+                        env_buffer[agent_id] = {}
+                    for new_key, new_value in agent_new_data.items():
+                        if new_key not in env_buffer[agent_id]:
+                            env_buffer[agent_id][new_key] = []
+                        env_buffer[agent_id][new_key].append(copy.deepcopy(new_value))
+
+    def add_env_data(self, policy_id: int, env_data):
+        """
+        添加执行动作后,环境输出的数据
+        :param policy_id: 玩家ID
+        :param env_data: 环境输出数据: env.step(a(t)) => r(t), done(t+1)
+        """
+        for env_id, env_buffer in self.policy_data[policy_id].items():
+            new_data = env_data[env_id]
+            for agent_id, agent_done, agent_reward in zip(new_data.get('reserved_agent_id', new_data['agent_id']),
+                                                          new_data.get('reserved_done', new_data['done']),
+                                                          new_data.get('reserved_reward', new_data['reward'])):
+                if agent_id not in env_buffer:  # 没有policy data, (next step添加)
+                    continue
+
+                if 'done' not in env_buffer[agent_id]:
+                    env_buffer[agent_id]['done'] = []
+                if 'reward' not in env_buffer[agent_id]:
+                    env_buffer[agent_id]['reward'] = []
+
+                env_buffer[agent_id]['done'].append(copy.deepcopy(agent_done))  # t+1 时刻
+                env_buffer[agent_id]['reward'].append(copy.deepcopy(agent_reward))  # t时刻
+
+    def reset(self):
+        self.policy_data.clear()
+
+
+class BatchTrajectoryBuffer(TrajectoryBuffer):
+    """
+    将add_policy_data的数据转为add_policy_batch的形式 (与CarbonGameRunner.policy_actions_values的输出一致).
+    """
+    def add_policy_data(self, policy_id: int, policy_data):
+        agent_ids = [list(policy_data[env_id]) for env_id in range(len(policy_data))]
+        agent_values = [value for env_id in range(len(policy_data)) for value in policy_data[env_id].values()]
+        self.add_policy_batch(policy_id, agent_ids, {key: np.stack([value[key] for value in agent_values])
+                                                     for key in agent_values[0]})
+
+
+def play(buffers, n_envs=3, n_policies=2, n_steps=120, obs_dim=7, seed=0):
+    """
+    模拟多个并行环境的对局 (agent出生/死亡, 对局结束后自动重置), 将相同的数据写入各个buffer.
+    :return: 每个buffer取出的transition数据
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.RandomState(seed)
+    n_agents = 0
+    alive = [[[] for _ in range(n_envs)] for _ in range(n_policies)]  # policy_id -> env_id -> agent_ids
+    results = [[] for _ in buffers]
+    for step in range(n_steps):
+        for policy_id in range(n_policies):
+            policy_data = {}
+            for env_id in range(n_envs):
+                if not alive[policy_id][env_id] or rng.random() < 0.2:  # 招募新agent
+                    alive[policy_id][env_id].append(f"agent-{n_agents}")
+                    n_agents += 1
+                obs = np_rng.rand(len(alive[policy_id][env_id]), obs_dim).astype(np.float32)  # 共享内存中的观测
+                policy_data[env_id] = {agent_id: EasyDict(obs=obs[i], action=np.int64(rng.randrange(5)),
+                                                          log_prob=np.float32(-rng.random()),
+                                                          value=np.float32(rng.random()),
+                                                          available_actions=np.ones(5))
+                                       for i, agent_id in enumerate(alive[policy_id][env_id])}
+            for buffer in buffers:
+                buffer.add_policy_data(policy_id, policy_data)
+            obs[:] = -1  # 共享内存被下一步覆盖, 不影响已写入的数据
+
+        done_env_ids = []
+        for policy_id in range(n_policies):
+            env_data = []
+            for env_id in range(n_envs):
+                agent_ids = alive[policy_id][env_id]
+                game_over = rng.random() < 0.03 or step == n_steps - 1
+                dones = [game_over or rng.random() < 0.1 for _ in agent_ids]
+                output = dict(agent_id=list(agent_ids), done=dones, reward=[rng.random() for _ in agent_ids])
+                if policy_id == 0 and game_over:
+                    done_env_ids.append(env_id)
+                if env_id in done_env_ids:  # 对局结束, 环境已重置
+                    dones = [True] * len(agent_ids)
+                    output = dict(agent_id=[], done=[], reward=[], reserved_agent_id=list(agent_ids),
+                                  reserved_done=dones, reserved_reward=output['reward'])
+                alive[policy_id][env_id] = [agent_id for agent_id, done in zip(agent_ids, dones) if not done]
+                env_data.append(output)
+            for buffer in buffers:
+                buffer.add_env_data(policy_id, env_data)
+        for env_id in done_env_ids:
+            for buffer, result in zip(buffers, results):
+                for policy_id in range(n_policies):
+                    result.append(buffer.get_transitions(policy_id, env_id))
+    return results
+
+
+class TestTrajectoryBuffer:
+    def test_same_as_reference(self):
+        buffer, batch_buffer = TrajectoryBuffer(), BatchTrajectoryBuffer()
+        for seed in range(3):  # 复用预分配的数组
+            transitions, batch_transitions, expected_transitions = play(
+                [buffer, batch_buffer, ReferenceTrajectoryBuffer()], seed=seed)
+            assert len(transitions) == len(batch_transitions) == len(expected_transitions) > 6
+            for policy_data, expected_policy_data in zip(transitions + batch_transitions, expected_transitions * 2):
+                assert list(policy_data) == list(expected_policy_data)
+                for agent_id, expected_agent_data in expected_policy_data.items():
+                    agent_data = policy_data[agent_id]
+                    assert list(agent_data) == list(expected_agent_data)
+                    for key, value in expected_agent_data.items():
+                        assert agent_data[key].dtype == value.dtype and np.array_equal(agent_data[key], value)
+            buffer.reset()
+            batch_buffer.reset()
+
+    def test_episode_views(self):
+        buffer = TrajectoryBuffer()
+        transitions = play([buffer], n_steps=60, obs_dim=3000)[0]
+        for policy_data in transitions:
+            agent_obs = [agent_data['obs'] for agent_data in policy_data.values()]
+            # 各agent的数据是同一局数组中连续的一段
+            assert all(obs.base is not None and obs.base is agent_obs[0].base for obs in agent_obs)
+            assert sum(len(obs) for obs in agent_obs) == len(agent_obs[0].base)
@@ -0,0 +1,236 @@
+from typing import Callable, Dict, Iterable, List, Optional
+from collections import defaultdict
+from multiprocessing import Pool
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+from zerosum_env import make
+
+
+RESULT_FIELDS = ["policy_a", "policy_b", "seed", "reward_a", "reward_b", "status_a", "status_b", "winner",
+                 "steps", "duration"]
+
+_policy_factories = {}  # 子进程内的策略工厂, 由_init_worker设置
+
+
+def _init_worker(policy_factories):
+    global _policy_factories
+    _policy_factories = policy_factories
+
+
+def match_winner(reward_a, reward_b) -> str:
+    """
+    Return the winner of a game from the final rewards: "A", "B" or "draw". A None reward (error) loses.
+    """
+    if reward_a == reward_b:
+        return "draw"
+    elif reward_a is None:
+        return "B"
+    elif reward_b is None:
+        return "A"
+    return "A" if reward_a > reward_b else "B"
+
+
+def play_match(policy_a: str, policy_b: str, seed: int, configuration: Optional[dict] = None, render=False,
+               policy_factories: Optional[Dict[str, Callable]] = None) -> dict:
+    """
+    Play one game between two registered policies, the map and the random modules are seeded by seed.
+
+    :param policy_a: (str) name of the first player's policy
+    :param policy_b: (str) name of the second player's policy
+    :param seed: (int) random seed of the game
+    :param configuration: (dict optional) carbon configuration
+    :param render: (bool optional) keep the full history and render the game in ipython
+    :param policy_factories: (Dict[str, Callable] optional) policy name -> callable creating a policy, defaults to
+        the policies of the running tournament
+    :return: (dict) match result with the fields of RESULT_FIELDS
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    policy_factories = policy_factories if policy_factories is not None else _policy_factories
+    players = [policy_factories[policy_a](), policy_factories[policy_b]()]  # 每局使用新的策略实例
+
+    env = make("carbon", configuration={**(configuration or {}), "randomSeed": seed},
+               history="full" if render else "none")
+    start = time.time()
+    state_a, state_b = env.run([player.take_action for player in players])[-1]
+    duration = time.time() - start
+    if render:
+        env.render(mode="ipython", width=1000, height=700)
+
+    return {
+        "policy_a": policy_a,
+        "policy_b": policy_b,
+        "seed": seed,
+        "reward_a": state_a.reward,
+        "reward_b": state_b.reward,
+        "status_a": state_a.status,
+        "status_b": state_b.status,
+        "winner": match_winner(state_a.reward, state_b.reward),
+        "steps": state_a.observation.step,
+        "duration": round(duration, 3),
+    }
+
+
+def _play_match(args) -> dict:
+    return play_match(*args)
+
+
+class ResultWriter:
+    """
+    Stream match results into a .jsonl or .csv file, one line per match.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.is_csv = path.endswith(".csv")
+        write_header = self.is_csv and (not os.path.exists(path) or os.path.getsize(path) == 0)
+        self._file = open(path, "a", newline="")
+        self._csv_writer = csv.DictWriter(self._file, RESULT_FIELDS) if self.is_csv else None
+        if write_header:
+            self._csv_writer.writeheader()
+
+    def write(self, result: dict):
+        if self.is_csv:
+            self._csv_writer.writerow(result)
+        else:
+            self._file.write(json.dumps(result) + "\n")
+        self._file.flush()  # 每局结束即写入, 中断后可以继续
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_results(path: str) -> List[dict]:
+    """
+    Load the match results written by ResultWriter.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as f:
+        if not path.endswith(".csv"):
+            return [json.loads(line) for line in f if line.strip()]
+
+        results = []
+        for row in csv.DictReader(f):
+            for key in ("reward_a", "reward_b"):
+                row[key] = float(row[key]) if row[key] != "" else None
+            row["seed"], row["steps"], row["duration"] = int(row["seed"]), int(row["steps"]), float(row["duration"])
+            results.append(row)
+        return results
+
+
+def run_tournament(policy_factories: Dict[str, Callable], seeds: Iterable[int], output_path: str,
+                   n_workers: int = 1, configuration: Optional[dict] = None, resume=True) -> List[dict]:
+    """
+    Play a round-robin tournament: every ordered pair of different policies plays one game per seed, so each pair
+    meets on the same maps from both sides. Games run on a pool of n_workers processes without rendering,
+    results are streamed into output_path as soon as a game ends.
+
+    :param policy_factories: (Dict[str, Callable]) policy name -> callable creating a policy with take_action
+    :param seeds: (Iterable[int]) fixed random seeds of the games
+    :param output_path: (str) .jsonl or .csv file of the results
+    :param n_workers: (int optional) number of processes, 1 plays the games in the current process
+    :param configuration: (dict optional) carbon configuration
+    :param resume: (bool optional) skip the games already in output_path
+    :return: (List[dict]) results of all games of the tournament, including the resumed ones
+    """
+    seeds = list(seeds)
+    results = load_results(output_path) if resume else []
+    played = {(r["policy_a"], r["policy_b"], r["seed"]) for r in results}
+    matches = [(policy_a, policy_b, seed, configuration)
+               for policy_a, policy_b in itertools.permutations(policy_factories, 2)
+               for seed in seeds if (policy_a, policy_b, seed) not in played]
+
+    with ResultWriter(output_path) as writer:
+        if n_workers > 1:
+            with Pool(processes=n_workers, initializer=_init_worker, initargs=(policy_factories,)) as pool:
+                for result in pool.imap_unordered(_play_match, matches):
+                    writer.write(result)
+                    results.append(result)
+        else:
+            _init_worker(policy_factories)
+            for match in matches:
+                result = _play_match(match)
+                writer.write(result)
+                results.append(result)
+    return results
+
+
+def wilson_interval(wins: float, games: int, z: float = 1.96):
+    """
+    Wilson score interval of a win rate (95% confidence by default), draws count as half a win.
+    """
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denominator = 1 + z ** 2 / games
+    center = (p + z ** 2 / (2 * games)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / games + z ** 2 / (4 * games ** 2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def elo_ratings(results: List[dict], k: float = 16, initial: float = 1500, n_passes: int = 10) -> Dict[str, float]:
+    """
+    Elo rating of each policy. The games are replayed n_passes times in a fixed order (seed, policy_a, policy_b)
+    with a decreasing k, so the ratings don't depend on the order in which the workers finished the games.
+    """
+    ratings = defaultdict(lambda: initial)
+    ordered = sorted(results, key=lambda r: (r["seed"], r["policy_a"], r["policy_b"]))
+    for n in range(n_passes):
+        k_pass = k / (n + 1)
+        for r in ordered:
+            rating_a, rating_b = ratings[r["policy_a"]], ratings[r["policy_b"]]
+            expected_a = 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+            score_a = {"A": 1.0, "B": 0.0, "draw": 0.5}[r["winner"]]
+            ratings[r["policy_a"]] = rating_a + k_pass * (score_a - expected_a)
+            ratings[r["policy_b"]] = rating_b - k_pass * (score_a - expected_a)
+    return dict(ratings)
+
+
+def summarize(results: List[dict]) -> Dict[str, dict]:
+    """
+    Aggregate results per policy: games, wins/draws/losses, errors, win rate (draw = 0.5) with its 95% Wilson
+    interval, Elo rating and the win rate against each opponent.
+    """
+    summary = defaultdict(lambda: {"games": 0, "wins": 0, "draws": 0, "losses": 0, "errors": 0,
+                                   "opponents": defaultdict(lambda: [0.0, 0])})
+    for r in results:
+        for me, opponent, side in ((r["policy_a"], r["policy_b"], "A"), (r["policy_b"], r["policy_a"], "B")):
+            score = 0.5 if r["winner"] == "draw" else float(r["winner"] == side)
+            stats = summary[me]
+            stats["games"] += 1
+            stats["wins" if score == 1 else "draws" if score == 0.5 else "losses"] += 1
+            stats["errors"] += r["reward_a" if side == "A" else "reward_b"] is None
+            stats["opponents"][opponent][0] += score
+            stats["opponents"][opponent][1] += 1
+
+    ratings = elo_ratings(results)
+    for name, stats in summary.items():
+        score = stats["wins"] + 0.5 * stats["draws"]
+        stats["win_rate"] = score / stats["games"]
+        stats["win_rate_ci"] = wilson_interval(score, stats["games"])
+        stats["elo"] = ratings[name]
+        stats["opponents"] = {opponent: score / games for opponent, (score, games) in stats["opponents"].items()}
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["elo"]))
+
+
+def format_summary(summary: Dict[str, dict]) -> str:
+    lines = [f"{'policy':<16}{'elo':>8}{'games':>7}{'w/d/l':>12}{'err':>5}  win rate (95% CI)"]
+    for name, s in summary.items():
+        low, high = s["win_rate_ci"]
+        lines.append(f"{name:<16}{s['elo']:>8.1f}{s['games']:>7}{s['wins']:>5}/{s['draws']}/{s['losses']:<3}"
+                     f"{s['errors']:>5}  {s['win_rate']:.3f} [{low:.3f}, {high:.3f}]")
+    return "\n".join(lines)
@@ -1,33 +1,120 @@
 from typing import Dict, Any, List
 from collections import defaultdict
-import copy
 
 import numpy as np
 
 
+class _EnvTrajectory:
+    """
+    单个玩家在单个并行环境下的轨迹数据, 按列预分配存储.
+
+    每一步每个agent占一行(按写入顺序), 每个key对应一列 (capacity, *value_shape) 的float32数组.
+    对局之间复用已分配的数组, 容量不足时按2倍扩展.
+    """
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.columns: Dict[str, np.ndarray] = {}  # key -> (capacity, *value_shape)
+        self.row_slot = np.zeros(capacity, dtype=np.int64)  # 每一行所属agent的slot
+        self.has_env_data = np.zeros(capacity, dtype=bool)  # 该行是否已有环境数据 (reward, done)
+        self.agent_slots: Dict[str, int] = {}  # agent_id -> slot (按出现的顺序)
+        self.last_rows: List[int] = []  # slot -> 该agent最新一行
+        self.n_rows = 0
+
+    def clear(self):
+        self.agent_slots.clear()
+        self.last_rows.clear()
+        self.n_rows = 0
+
+    def _column(self, key: str, value) -> np.ndarray:
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = np.zeros((self.capacity, *np.shape(value)), dtype=np.float32)
+        return column
+
+    def _reserve(self, n_rows: int):
+        if n_rows <= self.capacity:
+            return
+        capacity = max(n_rows, 2 * self.capacity)
+        for key, column in self.columns.items():
+            new_column = np.zeros((capacity, *column.shape[1:]), dtype=np.float32)
+            new_column[: self.n_rows] = column[: self.n_rows]
+            self.columns[key] = new_column
+        self.row_slot = np.concatenate([self.row_slot[: self.n_rows], np.zeros(capacity - self.n_rows, np.int64)])
+        self.has_env_data = np.concatenate([self.has_env_data[: self.n_rows], np.zeros(capacity - self.n_rows, bool)])
+        self.capacity = capacity
+
+    def add_policy_data(self, agent_ids: List[str], batch: Dict[str, Any]):
+        """
+        写入一步的策略数据, 每个agent一行.
+        :param batch: key -> 各agent的值 (第一维与agent_ids对应), 每个key整体写入一次 (写入即复制, 无需deepcopy)
+        """
+        start, end = self.n_rows, self.n_rows + len(agent_ids)
+        self._reserve(end)
+        self.has_env_data[start: end] = False
+        agent_slots, last_rows, row_slot = self.agent_slots, self.last_rows, self.row_slot
+        for row, agent_id in enumerate(agent_ids, start):
+            slot = agent_slots.get(agent_id)
+            if slot is None:
+                slot = agent_slots[agent_id] = len(last_rows)
+                last_rows.append(row)
+            else:
+                last_rows[slot] = row
+            row_slot[row] = slot
+        for key, values in batch.items():
+            if len(values) > 0:
+                self._column(key, values[0])[start: end] = values
+        self.n_rows = end
+
+    def add_env_data(self, agent_ids, dones, rewards):
+        done_column, reward_column = self._column('done', 0), self._column('reward', 0)
+        for agent_id, agent_done, agent_reward in zip(agent_ids, dones, rewards):
+            slot = self.agent_slots.get(agent_id)
+            if slot is None:  # 没有policy data, (next step添加)
+                continue
+            row = self.last_rows[slot]
+            done_column[row] = agent_done  # t+1 时刻
+            reward_column[row] = agent_reward  # t时刻
+            self.has_env_data[row] = True
+
+    def transitions(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        按agent整理本局的数据: 每列按(agent slot, step)的顺序取出一次, 各agent的数据为其中连续的一段(视图).
+        过滤掉没有环境数据的行 (出生即死亡的agent, 或最后一步仅有策略数据).
+        """
+        rows = np.flatnonzero(self.has_env_data[: self.n_rows])
+        rows = rows[np.argsort(self.row_slot[rows], kind='stable')]  # 同一agent的行按step的顺序
+        slots = self.row_slot[rows]
+        columns = {key: column[rows] for key, column in self.columns.items()}
+
+        agent_ids = list(self.agent_slots)
+        present_slots, starts, counts = np.unique(slots, return_index=True, return_counts=True)
+        return {agent_ids[slot]: {key: column[start: start + count] for key, column in columns.items()}
+                for slot, start, count in zip(present_slots.tolist(), starts.tolist(), counts.tolist())}
+
+
 class TrajectoryBuffer:
     """
     收集玩家多agent多环境的轨迹数据.
+    每个玩家的每个环境按列预分配存储 (见_EnvTrajectory), 对局结束时按agent取出.
     """
     def __init__(self):
-        self.policy_data = defaultdict(dict)  # policy_id -> env_id -> agent_id -> key -> [step1, step2, ...]
+        self.policy_data = defaultdict(dict)  # policy_id -> env_id -> _EnvTrajectory (本局正在收集的数据)
+        self._free = []  # 已取出数据的_EnvTrajectory, 复用其预分配的数组
 
-    def get_transitions(self, policy_id: int, env_id: int) -> Dict[str, Dict[str, List[Any]]]:
+    def get_transitions(self, policy_id: int, env_id: int) -> Dict[str, Dict[str, np.ndarray]]:
         """
         返回玩家的transition数据,并清除
 
         :param policy_id: 玩家ID
         :param env_id: 游戏环境ID
-        :return: 每个agent对应的transition数据: S(t), a(t), logit(t), V(t), r(t), done(t+1)
+        :return: 每个agent对应的transition数据: S(t), a(t), logit(t), V(t), r(t), done(t+1).
+            每个agent的数据是本局数据的视图 (float32)
         """
         assert env_id in self.policy_data[policy_id]
-        raw_policy_data = self.policy_data[policy_id].pop(env_id)  # 单个玩家某个并行环境下的数据
-        # 将每个玩家的每个游戏环境下, 单个agent的数据 (过滤掉出生即死亡的agent, 仅有策略数据,没有环境数据)
-        policy_data = {agent_id: {key: np.array(value[: len(agent_data['done'])], dtype=np.float32)
-                                  for key, value in agent_data.items()  # 每个key对应的value,转成numpy.ndarray类型
-                                  }
-                       for agent_id, agent_data in raw_policy_data.items() if 'done' in agent_data  # 每个agent
-                       }
+        trajectory = self.policy_data[policy_id].pop(env_id)  # 单个玩家某个并行环境下的数据
+        policy_data = trajectory.transitions()
+        trajectory.clear()
+        self._free.append(trajectory)
 
         for agent_id, agent_data in policy_data.items():  # 校验agent done是否结束
             assert agent_data['done'][-1] == 1
@@ -40,28 +127,32 @@ class TrajectoryBuffer:
         :param policy_id: 玩家ID
         :param policy_data: 策略相关数据: S(t) => Policy => a(t), V(t), logit(t)
         """
-        if not self.policy_data[policy_id]:
-            env_buffer = {}
-            for env_id, new_data in policy_data.items():
-                env_buffer[env_id] = {}
-                for agent_id, agent_new_data in new_data.items():
-                    env_buffer[env_id][agent_id] = {}
-                    for new_key, new_value in agent_new_data.items():
-                        env_buffer[env_id][agent_id][new_key] = [copy.deepcopy(new_value)]
-            self.policy_data[policy_id] = env_buffer
-        else:
-            for env_id, new_data in policy_data.items():
-                if env_id not in self.policy_data[policy_id]:  # env数据已经被取出,此时为空,需重新添加
-                    self.policy_data[policy_id][env_id] = {}
-
-                env_buffer = self.policy_data[policy_id][env_id]
-                for agent_id, agent_new_data in new_data.items():
-                    if agent_id not in env_buffer:
-                        env_buffer[agent_id] = {}
-                    for new_key, new_value in agent_new_data.items():
-                        if new_key not in env_buffer[agent_id]:
-                            env_buffer[agent_id][new_key] = []
-                        env_buffer[agent_id][new_key].append(copy.deepcopy(new_value))
+        for env_id, new_data in policy_data.items():
+            keys = next(iter(new_data.values())).keys() if new_data else ()
+            self._trajectory(policy_id, env_id).add_policy_data(
+                list(new_data), {key: [agent_new_data[key] for agent_new_data in new_data.values()] for key in keys})
+
+    def add_policy_batch(self, policy_id: int, agent_ids: List[List[str]], batch: Dict[str, np.ndarray]):
+        """
+        添加策略相关的数据 (add_policy_data的批量形式, 避免逐个agent处理)
+        :param policy_id: 玩家ID
+        :param agent_ids: 每个环境的agent_id列表
+        :param batch: 策略相关数据, key -> 所有环境所有agent的值 (第一维按环境依次排列, 与agent_ids一致)
+        """
+        start = 0
+        for env_id, env_agent_ids in enumerate(agent_ids):
+            end = start + len(env_agent_ids)
+            if env_agent_ids:  # 与add_policy_data一致, 没有agent的环境不添加
+                self._trajectory(policy_id, env_id).add_policy_data(
+                    env_agent_ids, {key: values[start: end] for key, values in batch.items()})
+            start = end
+
+    def _trajectory(self, policy_id: int, env_id: int) -> _EnvTrajectory:
+        env_buffers = self.policy_data[policy_id]
+        trajectory = env_buffers.get(env_id)
+        if trajectory is None:  # env数据已经被取出,此时为空,需重新添加
+            trajectory = env_buffers[env_id] = self._free.pop() if self._free else _EnvTrajectory()
+        return trajectory
 
     def add_env_data(self, policy_id: int, env_data):
         """
@@ -69,21 +160,15 @@ class TrajectoryBuffer:
         :param policy_id: 玩家ID
         :param env_data: 环境输出数据: env.step(a(t)) => r(t), done(t+1)
         """
-        for env_id, env_buffer in self.policy_data[policy_id].items():
+        for env_id, trajectory in self.policy_data[policy_id].items():
             new_data = env_data[env_id]
-            for agent_id, agent_done, agent_reward in zip(new_data.get('reserved_agent_id', new_data['agent_id']),
-                                                          new_data.get('reserved_done', new_data['done']),
-                                                          new_data.get('reserved_reward', new_data['reward'])):
-                if agent_id not in env_buffer:  # 没有policy data, (next step添加)
-                    continue
-
-                if 'done' not in env_buffer[agent_id]:
-                    env_buffer[agent_id]['done'] = []
-                if 'reward' not in env_buffer[agent_id]:
-                    env_buffer[agent_id]['reward'] = []
-
-                env_buffer[agent_id]['done'].append(copy.deepcopy(agent_done))  # t+1 时刻
-                env_buffer[agent_id]['reward'].append(copy.deepcopy(agent_reward))  # t时刻
+            trajectory.add_env_data(new_data.get('reserved_agent_id', new_data['agent_id']),
+                                    new_data.get('reserved_done', new_data['done']),
+                                    new_data.get('reserved_reward', new_data['reward']))
 
     def reset(self):
+        for env_buffers in self.policy_data.values():
+            for trajectory in env_buffers.values():
+                trajectory.clear()
+                self._free.append(trajectory)
         self.policy_data.clear()
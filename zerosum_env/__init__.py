@@ -23,7 +23,7 @@ from . import utils
 
 __version__ = "1.7.11"
 
-__all__ = ["Agent", "environments", "errors", "evaluate", "http_request",
+__all__ = ["Agent", "environments", "Episode", "errors", "evaluate", "Evaluator", "http_request",
            "make", "register", "utils", "__version__",
            "get_episode_replay", "list_episodes", "list_episodes_for_team", "list_episodes_for_submission"]
 
@@ -15,14 +15,18 @@
 import traceback
 import copy
 import json
+import random
 import uuid
+from collections import OrderedDict
 from contextlib import redirect_stderr, redirect_stdout
 from io import StringIO
 from multiprocessing import Pool
 from time import perf_counter
+import numpy as np
+from . import profiling
 from .agent import Agent
 from .errors import DeadlineExceeded, FailedPrecondition, Internal, InvalidArgument
-from .utils import get, has, get_player, process_schema, schemas, structify
+from .utils import get, has, get_player, process_schema, schemas, structify, Struct
 
 # Registered Environments.
 environments = {}
@@ -30,6 +34,32 @@ environments = {}
 # Registered Interactive Sessions.
 interactives = {}
 
+# Initial states built by Environment.reset, key: (environment name, number of agents, configuration json).
+# The initial state is a function of the configuration (including its randomSeed), so resetting with a
+# configuration seen before clones the cached state instead of running the interpreter again.
+_initial_states = OrderedDict()
+initial_state_cache_size = 64  # LRU淘汰, 0表示不缓存
+
+
+def clear_initial_state_cache():
+    _initial_states.clear()
+
+
+def episode_seed(seed, episode):
+    """
+    randomSeed of an episode of an environment seeded with seed, so that every episode has its own map.
+
+    Args:
+        seed (int): seed of the environment, used as is by the first episode.
+        episode (int): index of the episode (from 0).
+
+    Returns:
+        int: a 31-bit seed derived from (seed, episode) for the following episodes.
+    """
+    if episode == 0:
+        return seed
+    return int(np.random.SeedSequence([seed, episode]).generate_state(1)[0] >> 1)
+
 
 def register(name, environment):
     """
@@ -43,7 +73,8 @@ def register(name, environment):
     environments[name] = environment
 
 
-def evaluate(environment, agents=[], configuration={}, steps=[], num_episodes=1, debug=False, state=None):
+def evaluate(environment, agents=[], configuration={}, steps=[], num_episodes=1, debug=False, state=None,
+             n_workers=1, record="full", replay_writer=None):
     """
     Evaluate and return the rewards of one or more episodes (environment and agents combo).
 
@@ -52,29 +83,187 @@ def evaluate(environment, agents=[], configuration={}, steps=[], num_episodes=1,
         agents (list):
         configuration (dict, optional):
         steps (list, optional):
-        num_episodes (int=1, optional): How many episodes to execute (run until done).
+        num_episodes (int=1, optional): How many episodes to execute (run until done). With a randomSeed in the
+            configuration, episode i is played with episode_seed(randomSeed, i).
         debug (bool=False, optional): Render print() statements to stdout
         state (optional)
+        n_workers (int=1, optional): Run the episodes in parallel on n_workers processes (see Evaluator).
+        record (str="full", optional): What is kept of each episode (see Evaluator.evaluate):
+            "full" renders the json and html of every episode,
+            "episodes" keeps the steps in an Episode which renders them on demand,
+            "rewards" only keeps the rewards, statuses and errors in an Episode.
+        replay_writer (optional): Writes every step to a replay file while the episodes are played, e.g.
+            zerosum_env.envs.carbon.replay.ReplayWriter (any object with a record(env) method). With record="rewards"
+            the environment then only keeps the current step in memory. Not supported with n_workers > 1.
 
     Returns:
-        list of list of int: List of final rewards for all agents for all episodes.
+        tuple of lists: rewards, jsons, htmls and errors of all episodes if record="full".
+        list of Episode: otherwise.
     """
-    e = make(environment, configuration, steps, debug=debug, state=state)
-    rewards = [[]] * num_episodes
-    jsons = [[]] * num_episodes
-    htmls = [[]] * num_episodes
-    errors = [[]] * num_episodes
+    if record not in _evaluate_records:
+        raise InvalidArgument(f"Invalid record: {record}, expected one of {', '.join(_evaluate_records)}.")
+    # 指定了randomSeed时, 第i局使用episode_seed(seed, i) (同Evaluator.evaluate), 否则每局由解释器重新抽取
+    seed = (configuration or {}).get("randomSeed")
+    if n_workers > 1:
+        if replay_writer is not None:
+            raise InvalidArgument("replay_writer is not supported with n_workers > 1.")
+        with Evaluator(environment, agents, configuration, n_workers=n_workers, steps=steps, debug=debug,
+                       state=state) as evaluator:
+            return evaluator.evaluate(num_episodes, seed=seed, record=record)
+
+    # 对局写入回放文件时, 只需要rewards的评估不再保留整局的steps
+    history = "none" if replay_writer is not None and record == "rewards" else "full"
+    e = make(environment, configuration, steps, debug=debug, state=state, history=history)
+    on_step = replay_writer.record if replay_writer is not None else None
+    results = [None] * num_episodes
     for i in range(num_episodes):
         print(f'round pk: {i}')
-        last_state = e.run(agents)[-1]
-        rewards[i] = [state.reward for state in last_state]
-        jsons[i] = e.toJSON()
-        htmls[i] = e.render(mode="html")
-        errors[i] = e.error
+        if seed is not None:
+            e.configuration.randomSeed = episode_seed(seed, i)
+        results[i] = _play_episode(e, agents, record, on_step)
+    return _evaluate_result(results, record)
+
+
+_evaluate_records = ("full", "episodes", "rewards")
+
+
+def _play_episode(env, agents, record, on_step=None):
+    env.run(agents, on_step=on_step)
+    if record == "full":
+        return [state.reward for state in env.steps[-1]], env.toJSON(), env.render(mode="html"), env.error
+    return Episode(env, keep_steps=record == "episodes")
+
+
+def _evaluate_result(results, record):
+    if record != "full":
+        return results
+    rewards, jsons, htmls, errors = (list(values) for values in zip(*results)) if results else ([], [], [], [])
     return rewards, jsons, htmls, errors
 
 
-def make(environment, configuration={}, info={}, steps=[], logs=[], debug=False, state=None):
+def _to_json(env):
+    """Specification and steps of an Environment or Episode, see Environment.toJSON."""
+    spec = env.specification
+    return copy.deepcopy(
+        {
+            "id": env.id,
+            "name": spec.name,
+            "title": spec.title,
+            "description": spec.description,
+            "version": spec.version,
+            "configuration": env.configuration,
+            "specification": {
+                "action": spec.action,
+                "agents": spec.agents,
+                "configuration": spec.configuration,
+                "info": spec.info,
+                "observation": spec.observation,
+                "reward": spec.reward
+            },
+            "steps": env.steps,
+            "rewards": [state.reward for state in env.steps[-1]],
+            "statuses": [state.status for state in env.steps[-1]],
+            "schema_version": 1,
+            "info": env.info,
+        }
+    )
+
+
+def _render_player(env, mode, kwargs):
+    """Html player of an Environment or Episode (mode html or ipython), see Environment.render."""
+    is_playing = get(kwargs, bool, env.done, path=["playing"])
+    window_kaggle = {
+        "debug": get(kwargs, bool, env.debug, path=["debug"]),
+        "playing": is_playing,
+        "step": 0 if is_playing else len(env.steps) - 1,
+        "controls": get(kwargs, bool, env.done, path=["controls"]),
+        "environment": env.toJSON(),
+        "logs": env.logs,
+        **kwargs,
+    }
+    args = [env]
+    player_html = get_player(window_kaggle, env.html_renderer(*args[:env.html_renderer.__code__.co_argcount]))
+    if mode == "html":
+        return player_html
+
+    from IPython.display import display, HTML
+    player_html = player_html.replace('"', '&quot;')
+    width = get(kwargs, int, 300, path=["width"])
+    height = get(kwargs, int, 300, path=["height"])
+    html = f'<iframe srcdoc="{player_html}" width="{width}" height="{height}" frameborder="0"></iframe> '
+    display(HTML(html))
+
+
+class Episode:
+    """
+    Result of one evaluated episode. The json and html replays are only built on demand, rendering every episode
+    (each html embeds the whole player) would cost more than playing it.
+
+    Attributes:
+        rewards (list): Final reward of every agent.
+        statuses (list): Final status of every agent.
+        error (list): Error of every agent, None if the agent had none.
+    """
+
+    def __init__(self, env, keep_steps=True):
+        """
+        Args:
+            env (Environment): Environment which has just finished the episode. The episode keeps a reference to its
+                steps, Environment.reset starts a new list so the next episode does not change them.
+            keep_steps (bool=True, optional): False only keeps the rewards, statuses and errors.
+        """
+        last_states = env.steps[-1]
+        self.rewards = [state.reward for state in last_states]
+        self.statuses = [state.status for state in last_states]
+        self.error = list(env.error)
+        self.id = env.id
+        self.debug = env.debug
+        self.done = all(status != "ACTIVE" for status in self.statuses)
+        if keep_steps:
+            self.specification = env.specification
+            self.configuration = copy.deepcopy(env.configuration)  # Evaluator修改randomSeed后复用env
+            self.info = env.info
+            self.steps = env.steps
+            self.logs = env.logs[-len(env.steps):]  # env.logs在多局之间累积
+            self.html_renderer = env.html_renderer
+        else:
+            self.steps = None
+
+    def __check_steps(self):
+        if self.steps is None:
+            raise FailedPrecondition("The steps of this episode were not kept (record=\"rewards\").")
+
+    def toJSON(self):
+        """
+        Returns:
+            dict: The same as Environment.toJSON at the end of the episode.
+        """
+        self.__check_steps()
+        return _to_json(self)
+
+    def render(self, **kwargs):
+        """
+        Renders a replay of the episode.
+
+        Args:
+            mode (str): html (default), ipython or json.
+            **kwargs (dict): Other args are directly passed into the html player.
+
+        Returns:
+            str: html if mode=html, json if mode=json.
+            None: prints html if mode=ipython
+        """
+        self.__check_steps()
+        mode = get(kwargs, str, "html", path=["mode"])
+        if mode == "html" or mode == "ipython":
+            return _render_player(self, mode, kwargs)
+        elif mode == "json":
+            return json.dumps(self.toJSON(), sort_keys=True, indent=2 if self.debug else None)
+        raise InvalidArgument("Available render modes: html, ipython, json")
+
+
+def make(environment, configuration={}, info={}, steps=[], logs=[], debug=False, state=None, trusted=False,
+         history="full"):
     """
     Creates an instance of an Environment.
 
@@ -85,22 +274,120 @@ def make(environment, configuration={}, info={}, steps=[], logs=[], debug=False,
         steps (list, optional):
         debug (bool=False, optional): Render print() statments to stdout
         state (optional):
+        trusted (bool=False, optional): Skip the per step action validation, stdout/stderr capture and state copies,
+            for training loops and dataset generation which always send well-formed actions.
+        history (str|int="full", optional): How many steps (and logs) are kept in env.steps: "full" keeps the whole
+            episode (needed for replays and rendering), an int k keeps the last k steps and "none" only the current one.
 
     Returns:
         Environment: Instance of a specific environment.
     """
     if has(environment, str) and has(environments, dict, path=[environment]):
         return Environment(**environments[environment], configuration=configuration, info=info, steps=steps, logs=logs,
-                           debug=debug, state=state)
+                           debug=debug, state=state, trusted=trusted, history=history)
     elif callable(environment):
         return Environment(interpreter=environment, configuration=configuration, info=info, steps=steps, logs=logs,
-                           debug=debug, state=state)
+                           debug=debug, state=state, trusted=trusted, history=history)
     elif has(environment, path=["interpreter"], is_callable=True):
         return Environment(**environment, configuration=configuration, info=info, steps=steps, logs=logs, debug=debug,
-                           state=state)
+                           state=state, trusted=trusted, history=history)
     raise InvalidArgument("Unknown Environment Specification")
 
 
+# Environment and agents of an Evaluator worker process, created once by _init_evaluator_worker.
+_evaluator_worker = None
+
+
+def _init_evaluator_worker(environment, agents, configuration, make_kwargs, reseed):
+    global _evaluator_worker
+    if reseed:  # Forked workers inherit the same random state, draw a new one per worker.
+        random.seed()
+        np.random.seed()
+    env = make(environment, configuration, **make_kwargs)
+    _evaluator_worker = env, [Agent(agent, env) if agent is not None else None for agent in agents]
+
+
+def _run_evaluator_episode(args):
+    seed, record = args
+    env, agents = _evaluator_worker
+    if seed is not None:
+        env.configuration.randomSeed = seed
+        random.seed(seed)
+        np.random.seed(seed)
+    return _play_episode(env, agents, record)
+
+
+class Evaluator:
+    """
+    Long-lived executor running whole episodes of one environment and agents combo.
+
+    Each worker process creates its Environment and Agents once and reuses them for every episode, so imported
+    modules, loaded models and the agents' state stay warm across episodes and calls of evaluate.
+    Agents are built in the workers (fork), they don't need to be picklable. URL agents are not supported with
+    n_workers > 1, since the workers can not start their own agent pool.
+
+    Example:
+        with Evaluator("carbon", [policy_a.take_action, policy_b.take_action], n_workers=8) as evaluator:
+            rewards, jsons, htmls, errors = evaluator.evaluate(num_episodes=100, seed=0)
+    """
+
+    def __init__(self, environment, agents=[], configuration={}, n_workers=1, **make_kwargs):
+        """
+        Args:
+            environment (str|Environment):
+            agents (list):
+            configuration (dict, optional):
+            n_workers (int=1, optional): Number of worker processes, 1 runs the episodes in the current process.
+            make_kwargs (optional): Other args are directly passed into make (steps, debug, state, trusted...).
+        """
+        self.n_workers = n_workers
+        self.pool = None
+        args = (environment, agents, configuration, make_kwargs)
+        if n_workers > 1:
+            self.pool = Pool(processes=n_workers, initializer=_init_evaluator_worker, initargs=(*args, True))
+        else:
+            _init_evaluator_worker(*args, False)
+            self.worker = _evaluator_worker
+
+    def evaluate(self, num_episodes=1, seed=None, record="full"):
+        """
+        Args:
+            num_episodes (int=1, optional): How many episodes to execute (run until done).
+            seed (int, optional): Episode i is played with random seed episode_seed(seed, i) (randomSeed of the
+                configuration, random and numpy.random), which makes the results independent of the number of workers.
+            record (str="full", optional): "full" renders the json and html of every episode in the workers,
+                "episodes" returns Episodes which render on demand, "rewards" returns Episodes without steps, the
+                cheapest to send back from the workers.
+
+        Returns:
+            tuple of lists: rewards, jsons, htmls and errors of all episodes, in the same order as evaluate(), if
+                record="full".
+            list of Episode: otherwise.
+        """
+        if record not in _evaluate_records:
+            raise InvalidArgument(f"Invalid record: {record}, expected one of {', '.join(_evaluate_records)}.")
+        args = [(None if seed is None else episode_seed(seed, i), record) for i in range(num_episodes)]
+        if self.pool is not None:
+            results = self.pool.map(_run_evaluator_episode, args, chunksize=1)
+        else:
+            global _evaluator_worker
+            _evaluator_worker = self.worker
+            results = [_run_evaluator_episode(a) for a in args]
+        return _evaluate_result(results, record)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def act_agent(args):
     agent, state, configuration, none_action = args
     if state["status"] != "ACTIVE":
@@ -125,12 +412,32 @@ class Environment:
             html_renderer=None,
             debug=False,
             state=None,
+            trusted=False,
+            history="full",
     ):
         self.logs = logs
         self.id = str(uuid.uuid1())
         self.debug = debug
+        self.trusted = trusted
+
+        if history == "full":
+            self.max_history = None
+        elif history == "none":
+            self.max_history = 1
+        elif isinstance(history, int) and history >= 1:
+            self.max_history = history
+        else:
+            raise InvalidArgument(f"Invalid history: {history}, expected 'full', 'none' or a positive int.")
+        self.history = history
+        if self.max_history is not None:  # 默认参数logs=[]被所有env共用, 截断前先复制
+            self.logs = list(logs)
         self.info = info
         self.pool = None
+        # State the interpreter keeps between the steps of a game besides the agents' states (e.g. id generators),
+        # replaced on every reset.
+        self.interpreter_state = Struct()
+        # randomSeed drawn by the interpreter (configuration without seed), drawn again at the next reset.
+        self._drawn_seed = None
 
         err, specification = self.__process_specification(specification)
         if err:
@@ -162,12 +469,13 @@ class Environment:
         self.agents = structify(agents)
 
         if steps is not None and len(steps) > 0:
-            self.__set_states(steps[-1])
+            self.__set_state(steps[-1])
             self.steps = steps[0:-1] + self.steps
+            self._num_steps = len(self.steps)
         elif state is not None:
             step = [{}] * self.specification.agents[0]
             step[0] = state
-            self.__set_states(step)
+            self.__set_state(step)
         else:
             self.reset()
 
@@ -188,6 +496,9 @@ class Environment:
             raise FailedPrecondition("Environment done, reset required.")
         if not actions or len(actions) != len(self.states):
             raise InvalidArgument(f"{len(self.states)} actions required.")
+        profiler = profiling.active()
+        if profiler is not None:
+            profiler.start_step()
 
         action_states = [0] * len(self.states)
         for index, action in enumerate(actions):
@@ -201,6 +512,9 @@ class Environment:
                 self.error[index] = f"Error: {traceback.format_exception(None, action, action.__traceback__)}"
                 self.debug_print(self.error[index])
                 action_states[index]["status"] = "ERROR"
+            elif self.trusted:
+                # Well-formed actions are assumed, missing or non-object actions default to {} like the schema does.
+                action_states[index]["action"] = action if isinstance(action, dict) else {}
             else:
                 err, data = process_schema(
                     self.__state_schema.properties.action, action)
@@ -211,6 +525,8 @@ class Environment:
                 else:
                     action_states[index]["action"] = data
 
+        if profiler is not None:
+            profiler.lap("env.actions")
         self.states = self.__run_interpreter(action_states, logs)
 
         # Max Steps reached. Mark ACTIVE/INACTIVE agents as DONE.
@@ -219,18 +535,29 @@ class Environment:
                 if s.status == "ACTIVE" or s.status == "INACTIVE":
                     s.status = "DONE"
 
+        self._num_steps += 1
         self.steps.append(self.states)
         if logs is not None:
             self.logs.append(logs)
-
+        if self.max_history is not None:  # 仅保留最近的max_history个step
+            if len(self.steps) > self.max_history:
+                del self.steps[:-self.max_history]
+            if len(self.logs) > self.max_history:
+                del self.logs[:-self.max_history]
+
+        if profiler is not None:
+            profiler.lap("env.steps")
+            profiler.end_step()
         return self.states
 
-    def run(self, agents):
+    def run(self, agents, on_step=None):
         """
         Steps until the environment is "done" or the runTimeout was reached.
 
         Args:
             agents (list of any): List of agents to obtain actions from.
+            on_step (callable, optional): Called with the environment for the initial state and after every step,
+                e.g. ReplayWriter.record to stream the episode to disk.
 
         Returns:
             tuple of:
@@ -240,17 +567,21 @@ class Environment:
 
         self.error = [None] * len(agents)
 
-        if self.states is None or len(self.steps) == 1 or self.done:
+        if self.states is None or self._num_steps == 1 or self.done:
             self.reset(len(agents))
         if len(self.states) != len(agents):
             raise InvalidArgument(
                 f"{len(self.states)} agents were expected, but {len(agents)} was given.")
 
         runner = self.__agent_runner(agents)
+        if on_step is not None:
+            on_step(self)
         start = perf_counter()
         while not self.done and perf_counter() - start < self.configuration.runTimeout:
             actions, logs = runner.act()
             self.step(actions, logs)
+            if on_step is not None:
+                on_step(self)
         return self.steps
 
     def reset(self, num_agents=None):
@@ -267,7 +598,25 @@ class Environment:
         if num_agents is None:
             num_agents = self.specification.agents[0]
 
+        # 未指定种子的配置每局使用新的地图: 移除上一局抽取的种子 (除非已被替换为指定的种子)
+        if self._drawn_seed is not None and self.configuration.get("randomSeed") == self._drawn_seed:
+            self.configuration.pop("randomSeed")
+            self.configuration.__dict__.pop("randomSeed", None)
+        self._drawn_seed = None
+        has_seed = self.configuration.get("randomSeed") is not None
+
+        cache_key = self.__initial_state_key(num_agents)
+        if cache_key in _initial_states:
+            _initial_states.move_to_end(cache_key)
+            states, logs, self.interpreter_state = copy.deepcopy(_initial_states[cache_key])
+            self.states = states
+            self.steps = [states]
+            self._num_steps = 1
+            self.__append_reset_logs(logs)
+            return self.states
+
         # Get configuration default state.
+        self.interpreter_state = Struct()
         self.__set_state([{} for _ in range(num_agents)])
         # Reset all agents to status=INACTIVE (copy out values to reset afterwards).
         statuses = [a.status for a in self.states]
@@ -276,13 +625,34 @@ class Environment:
         # Give the interpreter an opportunity to make any initializations.
         logs = []
         self.__set_state(self.__run_interpreter(self.states, logs))
-        self.logs.append(logs)
+        self.__append_reset_logs(logs)
         # Replace the starting "status" if still "done".
         if self.done and len(self.states) == len(statuses):
             for i in range(len(self.states)):
                 self.states[i].status = statuses[i]
+
+        # The interpreter may have drawn a randomSeed, drop it on the next reset.
+        if not has_seed:
+            self._drawn_seed = self.configuration.get("randomSeed")
+        # 抽取的种子在下一次重置时被移除, 不会再命中, 只缓存指定了种子的配置
+        cache_key = self.__initial_state_key(num_agents)
+        if has_seed and cache_key is not None and initial_state_cache_size > 0:
+            _initial_states[cache_key] = copy.deepcopy((self.states, logs, self.interpreter_state))
+            while len(_initial_states) > initial_state_cache_size:
+                _initial_states.popitem(last=False)
         return self.states
 
+    def __initial_state_key(self, num_agents):
+        # Only seeded configurations give a reproducible initial state.
+        if not self.name or self.configuration.get("randomSeed") is None:
+            return None
+        return self.name, num_agents, json.dumps(self.configuration, sort_keys=True)
+
+    def __append_reset_logs(self, logs):
+        self.logs.append(logs)
+        if self.max_history is not None and len(self.logs) > self.max_history:
+            del self.logs[:-self.max_history]
+
     def render(self, **kwargs):
         """
         Renders a visual representation of the current state of the environment.
@@ -302,28 +672,7 @@ class Environment:
             if mode == "ansi":
                 return out
         elif mode == "html" or mode == "ipython":
-            is_playing = get(kwargs, bool, self.done, path=["playing"])
-            window_kaggle = {
-                "debug": get(kwargs, bool, self.debug, path=["debug"]),
-                "playing": is_playing,
-                "step": 0 if is_playing else len(self.steps) - 1,
-                "controls": get(kwargs, bool, self.done, path=["controls"]),
-                "environment": self.toJSON(),
-                "logs": self.logs,
-                **kwargs,
-            }
-            args = [self]
-            player_html = get_player(window_kaggle,
-                                     self.html_renderer(*args[:self.html_renderer.__code__.co_argcount]))
-            if mode == "html":
-                return player_html
-
-            from IPython.display import display, HTML
-            player_html = player_html.replace('"', '&quot;')
-            width = get(kwargs, int, 300, path=["width"])
-            height = get(kwargs, int, 300, path=["height"])
-            html = f'<iframe srcdoc="{player_html}" width="{width}" height="{height}" frameborder="0"></iframe> '
-            display(HTML(html))
+            return _render_player(self, mode, kwargs)
         elif mode == "json":
             return json.dumps(self.toJSON(), sort_keys=True, indent=2 if self.debug else None)
         else:
@@ -350,7 +699,7 @@ class Environment:
         Note: This is designed to be a lightweight starting point which can
               be integrated with other frameworks (i.e. gym, stable-baselines).
               The reward returned by the "step" function here is a diff between the
-              current and the previous step.
+              current and the previous step, so the history must keep at least 2 steps.
 
         Example:
             env = make("tictactoe")
@@ -435,7 +784,7 @@ class Environment:
         Note: This is designed to be a lightweight starting point which can
               be integrated with other frameworks (i.e. gym, stable-baselines).
               The reward returned by the "step" function here is a diff between the
-              current and the previous step.
+              current and the previous step, so the history must keep at least 2 steps.
 
         Example:
             env = make("carbon")
@@ -521,37 +870,14 @@ class Environment:
         Returns:
             dict: Specifcation and current state of the Environment instance.
         """
-        spec = self.specification
-        return copy.deepcopy(
-            {
-                "id": self.id,
-                "name": spec.name,
-                "title": spec.title,
-                "description": spec.description,
-                "version": spec.version,
-                "configuration": self.configuration,
-                "specification": {
-                    "action": spec.action,
-                    "agents": spec.agents,
-                    "configuration": spec.configuration,
-                    "info": spec.info,
-                    "observation": spec.observation,
-                    "reward": spec.reward
-                },
-                "steps": self.steps,
-                "rewards": [state.reward for state in self.steps[-1]],
-                "statuses": [state.status for state in self.steps[-1]],
-                "schema_version": 1,
-                "info": self.info,
-            }
-        )
+        return _to_json(self)
 
     def clone(self):
         """
         Returns:
             Environment: A copy of the current environment.
         """
-        return Environment(
+        env = Environment(
             specification=self.specification,
             configuration=self.configuration,
             steps=self.steps,
@@ -560,7 +886,12 @@ class Environment:
             renderer=self.renderer,
             html_renderer=self.html_renderer,
             debug=self.debug,
+            trusted=self.trusted,
+            history=self.history,
         )
+        # 复制解释器状态(如id生成器), 否则由观测重建的生成器可能重新分配已消失的单位的id
+        env.interpreter_state = copy.deepcopy(self.interpreter_state)
+        return env
 
     @property
     def __state_schema(self):
@@ -592,8 +923,8 @@ class Environment:
                 },
             }
             # assert hasattr(self, "__state_schema_value")
-            setattr(self, "__state_schema_value", state_schema_value)
-        return structify(getattr(self, "__state_schema_value"))
+            setattr(self, "__state_schema_value", structify(state_schema_value))
+        return getattr(self, "__state_schema_value")
 
     def __set_state(self, states=[]):
         if len(states) not in self.specification.agents:
@@ -603,6 +934,7 @@ class Environment:
         self.states = structify([self.__get_state(index, s)
                                  for index, s in enumerate(states)])
         self.steps = [self.states]
+        self._num_steps = 1  # 从reset开始的step数(含初始状态), 不受history影响
 
         return self.states
 
@@ -636,6 +968,9 @@ class Environment:
         return data
 
     def __run_interpreter(self, state, logs):
+        if self.trusted and not self.done:
+            return self.__run_trusted_interpreter(state, logs)
+
         out = None
         err = None
         # Append any environmental logs to any agent logs we collected.
@@ -643,24 +978,17 @@ class Environment:
             with StringIO() as out_buffer, StringIO() as err_buffer, redirect_stdout(out_buffer), redirect_stderr(
                     err_buffer):
                 try:
+                    profiler = profiling.active()
                     args = [structify(state), self]
+                    if profiler is not None:
+                        profiler.lap("env.structify")
                     new_state = structify(self.interpreter(
                         *args[:self.interpreter.__code__.co_argcount]))
-                    new_state[0].observation.step = (
-                        0 if self.done
-                        else len(self.steps)
-                    )
-
-                    for index, agent in enumerate(new_state):
-                        if index < len(logs) and "duration" in logs[index]:
-                            duration = logs[index]["duration"]
-                            overage_time_consumed = max(0, duration - self.configuration.actTimeout)
-                            agent.observation.remainingOverageTime -= overage_time_consumed
-                        if agent.status not in self.__state_schema.properties.status.enum:
-                            self.debug_print(f"Invalid Action: {agent.status}")
-                            agent.status = "INVALID"
-                        if agent.status in ["ERROR", "INVALID", "TIMEOUT"]:
-                            agent.reward = None
+                    if profiler is not None:
+                        profiler.lap("env.structify")
+                    new_state = self.__update_interpreter_state(new_state, logs)
+                    if profiler is not None:
+                        profiler.lap("env.states")
                     return new_state
                 except Exception as e:
                     # Print the exception stack trace to our log
@@ -687,6 +1015,39 @@ class Environment:
                     err = err[:-1]
                 self.debug_print(err)
 
+    def __run_trusted_interpreter(self, state, logs):
+        # Only the agent states and their observations are copied: the interpreter assigns new values to their
+        # fields, while the nested values are replaced rather than modified in place.
+        profiler = profiling.active()
+        args = [[Struct(**{**agent, "observation": Struct(**agent["observation"])}) for agent in state], self]
+        if profiler is not None:
+            profiler.lap("env.structify")
+        new_state = self.interpreter(*args[:self.interpreter.__code__.co_argcount])
+        if not all(isinstance(agent, Struct) for agent in new_state):
+            new_state = structify(new_state)
+        new_state = self.__update_interpreter_state(new_state, logs)
+        if profiler is not None:
+            profiler.lap("env.states")
+        return new_state
+
+    def __update_interpreter_state(self, new_state, logs):
+        new_state[0].observation.step = (
+            0 if self.done
+            else self._num_steps
+        )
+
+        for index, agent in enumerate(new_state):
+            if index < len(logs) and "duration" in logs[index]:
+                duration = logs[index]["duration"]
+                overage_time_consumed = max(0, duration - self.configuration.actTimeout)
+                agent.observation.remainingOverageTime -= overage_time_consumed
+            if agent.status not in self.__state_schema.properties.status.enum:
+                self.debug_print(f"Invalid Action: {agent.status}")
+                agent.status = "INVALID"
+            if agent.status in ["ERROR", "INVALID", "TIMEOUT"]:
+                agent.reward = None
+        return new_state
+
     def __process_specification(self, spec):
         if has(spec, path=["reward"]):
             reward = spec["reward"]
@@ -725,7 +1086,8 @@ class Environment:
 
     def __agent_runner(self, agents):
         # Generate the agents.
-        agents = [Agent(agent, self) if agent is not None else None for agent in agents]
+        agents = [Agent(agent, self) if agent is not None and not isinstance(agent, Agent) else agent
+                  for agent in agents]
 
         def act(none_actions=None):
             if len(agents) != len(self.states):
@@ -736,7 +1098,7 @@ class Environment:
             act_args = [
                 (
                     agent,
-                    self.__get_shared_state(i),
+                    self.__get_shared_state(i) if agent is not None else self.states[i],  # 仅需读取status
                     self.configuration,
                     none_actions[i] if none_actions is not None else None,
                 )
@@ -759,21 +1121,23 @@ class Environment:
 
     def __get_shared_state(self, position):
         # Note: state and schema are required to be in sync (apart from shared ones).
+        # Only the dicts along the schema are copied, the values are shared with self.states and must not be
+        # modified in place (Agent.act hands a structified copy to the agent).
         def update_props(shared_state, state, schema_props):
+            state = dict(state)
             for k, prop in schema_props.items():
                 # Hidden fields are tracked in the episode replay but are not provided to the agent at runtime
                 if get(prop, bool, path=["hidden"], fallback=False):
-                    if k in state:
-                        del state[k]
+                    state.pop(k, None)
                 elif get(prop, bool, path=["shared"], fallback=False):
                     state[k] = shared_state[k]
                 elif has(prop, dict, path=["properties"]):
-                    update_props(shared_state[k], state[k], prop["properties"])
-            return state
+                    state[k] = update_props(shared_state[k], state[k], prop["properties"])
+            return Struct(**state)
 
         return update_props(
             self.states[0],
-            copy.deepcopy(self.states[position]),
+            self.states[position],
             self.__state_schema.properties
         )
 
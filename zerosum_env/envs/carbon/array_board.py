@@ -0,0 +1,679 @@
+from copy import copy
+import itertools
+from typing import *
+
+import numpy as np
+
+from .geometry import get_geometry
+from .helpers import Configuration, Observation, RecrtCenterAction, WorkerAction
+from .idgen import IdGenerator
+
+
+# 动作编码, 与 envs/obs_parser.py 中的 WorkerActions / BaseActions 保持一致 (0 表示停留/不招募)
+WorkerActionCodes = {action.name: code for code, action in enumerate(WorkerAction.moves(), start=1)}
+RecrtCenterActionCodes = {RecrtCenterAction.RECCOLLECTOR.name: 1, RecrtCenterAction.RECPLANTER.name: 2}
+
+def round_half_even(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    Vectorized equivalent of the builtin round(value, ndigits) for float arrays.
+    np.round scales, rounds and divides in floating point, which differs from the builtin on values whose scaled
+    form lies right next to a half-way point; those few values are rounded with the builtin instead.
+    """
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    result = np.rint(scaled) / scale
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 1e-9 * np.maximum(np.abs(scaled), 1.0)
+    if near_tie.any():
+        result[near_tie] = [round(value, ndigits) for value in values[near_tie].tolist()]
+    return result
+
+
+class ArrayBoard:
+    # Per game arrays, copied by next(). Worker / tree fields are indexed by (game, slot).
+    _array_fields = (
+        "carbon", "cash", "steps", "current_player", "remaining_overage_time",
+        "base_pos", "base_alive", "base_ids", "base_action",
+        "w_alive", "w_pos", "w_carbon", "w_player", "w_planter", "w_action", "w_uid", "w_ids", "w_next_uid",
+        "t_alive", "t_pos", "t_age", "t_player", "t_order", "t_dict_order", "t_ids", "t_worker", "t_absorption",
+        "t_clock",
+    )
+
+    def __init__(
+            self,
+            raw_observations: List[Dict[str, Any]],
+            raw_configuration: Union[Configuration, Dict[str, Any]],
+            next_actions: Optional[List[List[Dict[str, str]]]] = None,
+            id_generators: Optional[List[Optional[IdGenerator]]] = None
+    ) -> None:
+        """
+        Creates an array-backed board holding one or more games, one per raw observation.
+        It implements the same transition rules as Board.next() with the board state stored in NumPy arrays,
+        so the observations it produces are identical to the ones of Board.next() for the same inputs.
+
+        Workers and trees live in fixed slots, "alive" masks mark the occupied ones.
+        Since observations are dicts, insertion order is tracked separately:
+            w_uid       creation order of workers (Board.workers order)
+            t_order     Board.trees order (a seized tree moves to the end)
+            t_dict_order  Board._trees_dict order (rewritten by tree absorption every step)
+        Consumers should only read the arrays; actions are set with next_actions or set_next_actions().
+        Each game has its own IdGenerator (see Board), None continues after the ids of the game's observation.
+        """
+        self._configuration = Configuration(raw_configuration)
+        self.size = self.configuration.size
+        self.n_cells = self.size * self.size
+        geometry = get_geometry(self.size)
+        self._move, self._quad, self._octet = geometry.move, geometry.quad, geometry.octet
+
+        observations = [Observation(raw_observation) for raw_observation in raw_observations]
+        next_actions = next_actions or [None] * len(observations)
+        self.n_games = len(observations)
+        self.id_generators = list(id_generators) if id_generators is not None else [None] * self.n_games
+        self.n_players = len(observations[0].players)
+        self.n_bases = max(1, max(len(player[1]) for observation in observations for player in observation.players))
+        n_workers = max(1, max(len(player[2]) for observation in observations for player in observation.players))
+        n_trees = max(1, max(sum(len(player[3]) for player in observation.players) for observation in observations))
+
+        games, players, bases = self.n_games, self.n_players, self.n_bases
+        self.carbon = np.zeros((games, self.n_cells), dtype=np.float64)
+        self.cash = np.zeros((games, players), dtype=np.float64)
+        self.steps = np.zeros(games, dtype=np.int64)
+        self.current_player = np.zeros(games, dtype=np.int64)
+        self.remaining_overage_time = np.zeros(games, dtype=object)
+
+        self.base_pos = np.zeros((games, players, bases), dtype=np.int64)
+        self.base_alive = np.zeros((games, players, bases), dtype=bool)
+        self.base_ids = np.full((games, players, bases), None, dtype=object)
+        self.base_action = np.zeros((games, players, bases), dtype=np.int8)
+
+        self._allocate_workers(n_workers * players)
+        self._allocate_trees(n_trees)
+
+        for game, (observation, actions) in enumerate(zip(observations, next_actions)):
+            self._load_observation(game, observation, actions or [{}] * players)
+
+    def _allocate_workers(self, capacity: int) -> None:
+        games = self.n_games
+        self.w_alive = np.zeros((games, capacity), dtype=bool)
+        self.w_pos = np.zeros((games, capacity), dtype=np.int64)
+        self.w_carbon = np.zeros((games, capacity), dtype=np.float64)
+        self.w_player = np.zeros((games, capacity), dtype=np.int64)
+        self.w_planter = np.zeros((games, capacity), dtype=bool)
+        self.w_action = np.zeros((games, capacity), dtype=np.int8)
+        self.w_uid = np.zeros((games, capacity), dtype=np.int64)
+        self.w_ids = np.full((games, capacity), None, dtype=object)
+        self.w_next_uid = np.zeros(games, dtype=np.int64)
+
+    def _allocate_trees(self, capacity: int) -> None:
+        games = self.n_games
+        self.t_alive = np.zeros((games, capacity), dtype=bool)
+        self.t_pos = np.zeros((games, capacity), dtype=np.int64)
+        self.t_age = np.zeros((games, capacity), dtype=np.int64)
+        self.t_player = np.zeros((games, capacity), dtype=np.int64)
+        self.t_order = np.zeros((games, capacity), dtype=np.int64)
+        self.t_dict_order = np.zeros((games, capacity), dtype=np.int64)
+        self.t_ids = np.full((games, capacity), None, dtype=object)
+        self.t_worker = np.full((games, capacity), None, dtype=object)
+        self.t_absorption = np.zeros((games, capacity), dtype=np.float64)
+        self.t_clock = np.zeros(games, dtype=np.int64)
+
+    def _load_observation(self, game: int, observation: Observation, actions: List[Dict[str, str]]) -> None:
+        self.carbon[game] = observation.carbon
+        self.steps[game] = observation.step
+        self.current_player[game] = observation.player
+        self.remaining_overage_time[game] = observation.remaining_overage_time
+
+        worker_slot, tree_slot = 0, 0
+        for player_id, [player_cash, player_bases, player_workers, player_trees] in enumerate(observation.players):
+            player_actions = actions[player_id] or {}
+            self.cash[game, player_id] = player_cash
+
+            for tree_id, [tree_index, tree_age] in player_trees.items():
+                tree_worker_id, tree_absorption = observation.trees[tree_id]
+                self.t_alive[game, tree_slot] = True
+                self.t_pos[game, tree_slot] = tree_index
+                self.t_age[game, tree_slot] = tree_age
+                self.t_player[game, tree_slot] = player_id
+                self.t_order[game, tree_slot] = self.t_dict_order[game, tree_slot] = tree_slot
+                self.t_ids[game, tree_slot] = tree_id
+                self.t_worker[game, tree_slot] = tree_worker_id
+                self.t_absorption[game, tree_slot] = tree_absorption
+                tree_slot += 1
+
+            for worker_id, [worker_index, worker_carbon, worker_type] in player_workers.items():
+                self.w_alive[game, worker_slot] = True
+                self.w_pos[game, worker_slot] = worker_index
+                self.w_carbon[game, worker_slot] = worker_carbon
+                self.w_player[game, worker_slot] = player_id
+                self.w_planter[game, worker_slot] = worker_type == "PLANTER"
+                self.w_action[game, worker_slot] = WorkerActionCodes.get(player_actions.get(worker_id), 0)
+                self.w_uid[game, worker_slot] = worker_slot
+                self.w_ids[game, worker_slot] = worker_id
+                worker_slot += 1
+
+            for base, (base_id, base_index) in enumerate(player_bases.items()):
+                self.base_alive[game, player_id, base] = True
+                self.base_pos[game, player_id, base] = base_index
+                self.base_ids[game, player_id, base] = base_id
+                self.base_action[game, player_id, base] = RecrtCenterActionCodes.get(player_actions.get(base_id), 0)
+                self.carbon[game, base_index] = 0  # Board._add_recrtCenter 会清空转化中心格子的碳
+
+        self.w_next_uid[game] = worker_slot
+        self.t_clock[game] = tree_slot
+
+    def reset_game(self, game: int, raw_observation: Dict[str, Any],
+                   next_actions: Optional[List[Dict[str, str]]] = None) -> None:
+        """Replaces one game by the board of the raw observation, the other games are kept."""
+        observation = Observation(raw_observation)
+        assert max(len(player[1]) for player in observation.players) <= self.n_bases, "Too many recrtCenters."
+        self._grow("w_", sum(len(player[2]) for player in observation.players))
+        self._grow("t_", sum(len(player[3]) for player in observation.players))
+
+        self.w_alive[game] = False
+        self.w_action[game] = 0
+        self.t_alive[game] = False
+        self.base_alive[game] = False
+        self.base_action[game] = 0
+        self.id_generators[game] = None
+        self._load_observation(game, observation, next_actions or [{}] * self.n_players)
+
+    def set_next_actions(self, next_actions: List[List[Dict[str, str]]]) -> None:
+        """Sets the actions of every game in the agent response format, replacing the pending ones."""
+        self.w_action[:] = 0
+        self.base_action[:] = 0
+        for game, actions in enumerate(next_actions):
+            actions = {key: value for player_actions in actions if player_actions for key, value in player_actions.items()}
+            if not actions:
+                continue
+            for slot in self.w_alive[game].nonzero()[0].tolist():
+                self.w_action[game, slot] = WorkerActionCodes.get(actions.get(self.w_ids[game, slot]), 0)
+            for player_id, base in zip(*self.base_alive[game].nonzero()):
+                self.base_action[game, player_id, base] = \
+                    RecrtCenterActionCodes.get(actions.get(self.base_ids[game, player_id, base]), 0)
+
+    @property
+    def configuration(self) -> Configuration:
+        return self._configuration
+
+    @property
+    def step(self) -> int:
+        """The step of the first game."""
+        return int(self.steps[0])
+
+    @property
+    def observation(self) -> Dict[str, Any]:
+        """The observation of the first game, in the same format as Board.observation."""
+        return self.game_observation(0)
+
+    def observations(self) -> List[Dict[str, Any]]:
+        return [self.game_observation(game) for game in range(self.n_games)]
+
+    def game_observation(self, game: int) -> Dict[str, Any]:
+        """Converts a game back to the normalized observation Board.next().observation would return."""
+        workers = self.w_alive[game].nonzero()[0]
+        workers = workers[np.argsort(self.w_uid[game, workers], kind="stable")]
+        trees = self.t_alive[game].nonzero()[0]
+        trees_dict = trees[np.argsort(self.t_dict_order[game, trees], kind="stable")]
+        trees = trees[np.argsort(self.t_order[game, trees], kind="stable")]
+
+        w_ids, w_pos, w_carbon = self.w_ids[game].tolist(), self.w_pos[game].tolist(), self.w_carbon[game].tolist()
+        w_player, w_planter = self.w_player[game].tolist(), self.w_planter[game].tolist()
+        t_ids, t_pos, t_age, t_player = (self.t_ids[game].tolist(), self.t_pos[game].tolist(),
+                                         self.t_age[game].tolist(), self.t_player[game].tolist())
+        cash = self.cash[game].tolist()
+
+        players = []
+        for player_id in range(self.n_players):
+            bases = {self.base_ids[game, player_id, base]: int(self.base_pos[game, player_id, base])
+                     for base in range(self.n_bases) if self.base_alive[game, player_id, base]}
+            player_workers = {w_ids[slot]: [w_pos[slot], w_carbon[slot], "PLANTER" if w_planter[slot] else "COLLECTOR"]
+                              for slot in workers.tolist() if w_player[slot] == player_id}
+            player_trees = {t_ids[slot]: [t_pos[slot], t_age[slot]]
+                            for slot in trees.tolist() if t_player[slot] == player_id}
+            players.append([cash[player_id], bases, player_workers, player_trees])
+
+        t_worker, t_absorption = self.t_worker[game].tolist(), self.t_absorption[game].tolist()
+        return {
+            "carbon": self.carbon[game].tolist(),
+            "players": players,
+            "player": int(self.current_player[game]),
+            "step": int(self.steps[game]),
+            "trees": {t_ids[slot]: [t_worker[slot], t_absorption[slot]] for slot in trees_dict.tolist()},
+            "remainingOverageTime": self.remaining_overage_time[game],
+        }
+
+    def visible_indices(self, player_id: int, game: int = 0) -> np.ndarray:
+        """
+        Returns the observation indices a player can see: the cells of its collectors and
+        the quad connected cells around its planters.
+        """
+        workers = self.w_alive[game] & (self.w_player[game] == player_id)
+        collectors = self.w_pos[game, workers & ~self.w_planter[game]]
+        planters = self.w_pos[game, workers & self.w_planter[game]]
+        return np.concatenate([collectors, self._quad[planters].reshape(-1)])
+
+    def next(self) -> 'ArrayBoard':
+        """
+        Returns a new board with the current board's next actions applied to every game.
+        The current board is unmodified.
+        """
+        board = copy(self)
+        for field in self._array_fields:
+            setattr(board, field, getattr(self, field).copy())
+        board.id_generators = [generator.copy() if generator is not None else None
+                               for generator in self.id_generators]
+        board._apply_next()
+        return board
+
+    def advance(self) -> None:
+        """Applies the next actions of every game in place, next() without the copy (e.g. for rollouts)."""
+        self._apply_next()
+
+    def select(self, games: Union[List[int], np.ndarray]) -> 'ArrayBoard':
+        """
+        Returns a new board holding copies of the given games, a game can be selected several times
+        e.g. board.select(np.zeros(n, dtype=int)) replicates the first game n times.
+        """
+        board = copy(self)
+        games = np.asarray(games, dtype=np.int64)
+        for field in self._array_fields:
+            setattr(board, field, getattr(self, field)[games])
+        board.n_games = len(games)
+        board.id_generators = [self.id_generator(game).copy() for game in games.tolist()]
+        return board
+
+    def id_generator(self, game: int) -> IdGenerator:
+        """ID generator of the workers and trees created in a game."""
+        generator = self.id_generators[game]
+        if generator is None:
+            generator = self.id_generators[game] = IdGenerator.from_ids(itertools.chain(
+                self.w_ids[game, self.w_alive[game]].tolist(), self.t_ids[game, self.t_alive[game]].tolist(),
+                self.base_ids[game, self.base_alive[game]].tolist()))
+        return generator
+
+    def _new_worker_id(self, game: int, player_id: int) -> str:
+        return self.id_generator(game).new_worker_id(player_id)
+
+    def _new_tree_id(self, game: int, player_id: int) -> str:
+        return self.id_generator(game).new_tree_id(player_id)
+
+    def _count_by_player(self, mask: np.ndarray, player: np.ndarray) -> np.ndarray:
+        return np.stack([(mask & (player == player_id)).sum(axis=1) for player_id in range(self.n_players)], axis=1)
+
+    def _grow(self, prefix: str, capacity: int) -> None:
+        for field in self._array_fields:
+            value = getattr(self, field)
+            if field.startswith(prefix) and value.ndim == 2 and value.shape[1] < capacity:
+                padding = np.zeros((self.n_games, capacity - value.shape[1]), dtype=value.dtype)
+                if value.dtype == object:
+                    padding.fill(None)
+                setattr(self, field, np.concatenate([value, padding], axis=1))
+
+    def _free_slots(self, alive: np.ndarray, games: np.ndarray, prefix: str) -> np.ndarray:
+        free = ~alive[games]
+        if not free.any(axis=1).all():
+            self._grow(prefix, alive.shape[1] * 2)
+            return self._free_slots(getattr(self, prefix + "alive"), games, prefix)
+        return free.argmax(axis=1)
+
+    def _spawn_workers(self, games: np.ndarray, player_id: int, positions: np.ndarray,
+                       is_planter: bool) -> np.ndarray:
+        slots = self._free_slots(self.w_alive, games, "w_")
+        self.w_alive[games, slots] = True
+        self.w_pos[games, slots] = positions
+        self.w_carbon[games, slots] = 0
+        self.w_player[games, slots] = player_id
+        self.w_planter[games, slots] = is_planter
+        self.w_action[games, slots] = 0
+        self.w_uid[games, slots] = self.w_next_uid[games]
+        self.w_next_uid[games] += 1
+        return slots
+
+    def _delete_worker(self, game: int, slot: int) -> None:
+        self.w_alive[game, slot] = False
+        self.w_action[game, slot] = 0
+        # 树的种植者死亡后, 树的归属种植者置空 (同 Board._delete_worker)
+        self.t_worker[game, self.t_worker[game] == self.w_ids[game, slot]] = None
+
+    def _spawn_trees(self, games: np.ndarray, players: np.ndarray, positions: np.ndarray,
+                     worker_ids: np.ndarray) -> np.ndarray:
+        slots = self._free_slots(self.t_alive, games, "t_")
+        self.t_alive[games, slots] = True
+        self.t_pos[games, slots] = positions
+        self.t_age[games, slots] = 1
+        self.t_player[games, slots] = players
+        self.t_order[games, slots] = self.t_dict_order[games, slots] = self.t_clock[games]
+        self.t_clock[games] += 1
+        self.t_worker[games, slots] = worker_ids
+        self.t_absorption[games, slots] = 0
+        return slots
+
+    def _worker_grid(self) -> np.ndarray:
+        grid = np.full((self.n_games, self.n_cells), -1, dtype=np.int64)
+        games, slots = self.w_alive.nonzero()
+        grid[games, self.w_pos[games, slots]] = slots
+        return grid
+
+    def _tree_grid(self) -> np.ndarray:
+        grid = np.full((self.n_games, self.n_cells), -1, dtype=np.int64)
+        games, slots = self.t_alive.nonzero()
+        grid[games, self.t_pos[games, slots]] = slots
+        return grid
+
+    def _base_grid(self) -> np.ndarray:
+        grid = np.full((self.n_games, self.n_cells), -1, dtype=np.int64)
+        games, players, bases = self.base_alive.nonzero()
+        grid[games, self.base_pos[games, players, bases]] = players
+        return grid
+
+    def _normalize_order(self) -> None:
+        """
+        Board.next() starts from a deepcopy, which rebuilds the board from its observation:
+        workers and trees are regrouped by player and _trees_dict follows the trees order again.
+        """
+        dead = np.iinfo(np.int64).max
+        worker_keys = np.where(self.w_alive, self.w_player * (self.w_uid.max() + 1) + self.w_uid, dead)
+        self.w_uid = np.argsort(np.argsort(worker_keys, axis=1, kind="stable"), axis=1, kind="stable")
+        self.w_next_uid = self.w_alive.sum(axis=1)
+
+        tree_keys = np.where(self.t_alive, self.t_player * (self.t_order.max() + 1) + self.t_order, dead)
+        self.t_order = np.argsort(np.argsort(tree_keys, axis=1, kind="stable"), axis=1, kind="stable")
+        self.t_dict_order = self.t_order.copy()
+        self.t_clock = self.t_alive.sum(axis=1)
+
+    def _apply_next(self) -> None:
+        """Applies Board.next() to every game in place, phase by phase in the same order."""
+        configuration = self.configuration
+        n_games, n_cells = self.n_games, self.n_cells
+        games = np.arange(n_games)
+        for game in range(n_games):
+            self.id_generator(game)  # 由当前的id创建生成器, 需在新工人/树占用槽位之前
+        self._normalize_order()
+
+        # 计算当前轮招募工人的价格
+        n_collectors = (self.w_alive & ~self.w_planter).sum(axis=1)
+        n_planters = (self.w_alive & self.w_planter).sum(axis=1)
+        rec_collector_cost = configuration.rec_collector_cost + \
+            n_collectors * configuration.rec_collector_increase_cost
+        rec_planter_cost = configuration.rec_planter_cost + n_planters * configuration.rec_planter_increase_cost
+
+        # 计算当前轮树的种植价格
+        alive_tree_count = (self.t_alive & (self.t_age < configuration.tree_lifespan)).sum(axis=1)
+        plant_market_price = np.array([configuration.plant_cost + configuration.plant_cost_inflation_ratio *
+                                       (configuration.plant_cost_inflation_base ** count)
+                                       for count in alive_tree_count.tolist()], dtype=np.float64)
+        player_tree_count = self._count_by_player(self.t_alive, self.t_player)
+        player_plant_cost = np.where(player_tree_count <= configuration.player_tree_protective_number,
+                                     float(configuration.plant_cost), plant_market_price[:, None])
+
+        # 转化中心招募指令, 新工人的 id 按对局依次生成, 与逐个对局调用 Board.next() 时的顺序一致
+        recruits = []
+        for player_id in range(self.n_players):
+            for base in range(self.n_bases):
+                action = self.base_action[:, player_id, base]
+                for code, cost, is_planter in ((1, rec_collector_cost, False), (2, rec_planter_cost, True)):
+                    n_workers = (self.w_alive & (self.w_player == player_id)).sum(axis=1)
+                    recruit = self.base_alive[:, player_id, base] & (action == code) & \
+                        (self.cash[:, player_id] >= cost) & (n_workers < configuration.worker_limit)
+                    if recruit.any():
+                        recruit_games = recruit.nonzero()[0]
+                        self.cash[recruit_games, player_id] = np.maximum(
+                            self.cash[recruit_games, player_id] - cost[recruit_games], 0)
+                        slots = self._spawn_workers(recruit_games, player_id,
+                                                    self.base_pos[recruit_games, player_id, base], is_planter)
+                        recruits.extend(zip(recruit_games.tolist(), slots.tolist(), [player_id] * len(slots)))
+        for game, slot, player_id in sorted(recruits, key=lambda recruit: recruit[0]):
+            self.w_ids[game, slot] = self._new_worker_id(game, player_id)
+        self.base_action[:] = 0
+
+        # 种树员和捕碳员的移动指令
+        moving = self.w_alive & (self.w_action > 0)
+        self.w_pos = self._move[self.w_pos, self.w_action]
+        self.w_carbon[moving] *= (1 - configuration.move_cost)
+
+        # 处理树龄
+        withered = self.t_alive & (self.t_age >= configuration.tree_lifespan)
+        disappeared = np.zeros((n_games, n_cells), dtype=bool)
+        if withered.any():
+            withered_games, withered_slots = withered.nonzero()
+            withered_cells = self.t_pos[withered_games, withered_slots]
+            self.carbon[withered_games, withered_cells] = configuration.co2_frm_withered
+            disappeared[withered_games, withered_cells] = True
+            self.t_alive[withered] = False
+        self.t_age[self.t_alive] += 1
+
+        tree_grid = self._tree_grid()
+        base_grid = self._base_grid()
+
+        # 碰撞检测和更新
+        collided = np.zeros((n_games, n_cells), dtype=bool)
+        worker_games, worker_slots = self.w_alive.nonzero()
+        keys = worker_games * n_cells + self.w_pos[worker_games, worker_slots]
+        crowded = np.bincount(keys, minlength=n_games * n_cells)[keys] > 1
+        if crowded.any():
+            self._resolve_collisions(worker_games[crowded], worker_slots[crowded], tree_grid, base_grid, collided)
+        worker_grid = self._worker_grid()
+
+        # 捕碳员运输CO2到转化中心
+        smelt_cost = configuration.smelt_cost
+        for player_id in range(self.n_players):
+            for base in range(self.n_bases):
+                cells = self.base_pos[:, player_id, base]
+                slots = worker_grid[games, cells]
+                present = self.base_alive[:, player_id, base] & (slots >= 0)
+                slots = np.where(present, slots, 0)
+                carried = self.w_carbon[games, slots]
+                is_collector = present & ~self.w_planter[games, slots]
+                removed = is_collector & (self.w_player[games, slots] != player_id) & (carried <= smelt_cost)
+                delivered = is_collector & ~removed & (carried >= smelt_cost)
+                if delivered.any():
+                    self.cash[delivered, player_id] += carried[delivered] - smelt_cost
+                    self.w_carbon[delivered, slots[delivered]] = 0
+                for game in removed.nonzero()[0].tolist():
+                    self._delete_worker(game, slots[game])
+                    worker_grid[game, cells[game]] = -1
+
+        # 计算工人的停留指令(种树员种树/抢树,捕碳员捕碳)
+        player_collect_rate = np.maximum(
+            configuration.initial_collect_rate -
+            self._count_by_player(self.w_alive & ~self.w_planter, self.w_player) * configuration.collect_decrease_rate,
+            0)
+        staying_games, staying_slots = (self.w_alive & (self.w_action == 0)).nonzero()
+        staying_cells = self.w_pos[staying_games, staying_slots]
+        staying_players = self.w_player[staying_games, staying_slots]
+        staying_planters = self.w_planter[staying_games, staying_slots]
+        free = (tree_grid[staying_games, staying_cells] < 0) & (base_grid[staying_games, staying_cells] < 0)
+
+        delta_carbon = self.carbon[staying_games, staying_cells] * \
+            player_collect_rate[staying_games, staying_players]
+        collect = free & ~staying_planters & (delta_carbon > 0)
+        if collect.any():
+            collect_games, collect_cells = staying_games[collect], staying_cells[collect]
+            self.carbon[collect_games, collect_cells] = np.maximum(
+                self.carbon[collect_games, collect_cells] - delta_carbon[collect], 0)
+            self.w_carbon[collect_games, staying_slots[collect]] += delta_carbon[collect]
+
+        tree_players = self.t_player[staying_games, np.maximum(tree_grid[staying_games, staying_cells], 0)]
+        seizable = (tree_grid[staying_games, staying_cells] >= 0) & \
+            (base_grid[staying_games, staying_cells] < 0) & (tree_players != staying_players)
+        newborn = np.zeros(self.t_alive.shape, dtype=bool)
+        planting = staying_planters & (free | seizable)
+        if planting.any():
+            newborn = self._plant_and_seize(staying_games[planting], staying_slots[planting], free[planting],
+                                            player_plant_cost, tree_grid)
+
+        # 树吸收CO2预处理: 树的四连通区域, 以及其中可被吸收的格子
+        tree_games, tree_slots = self.t_alive.nonzero()
+        quad_member = np.zeros((n_games, n_cells), dtype=bool)
+        quad_member[tree_games[:, None], self._quad[self.t_pos[tree_games, tree_slots]]] = True
+        occupied = worker_grid >= 0
+        occupants = np.where(occupied, worker_grid, 0)
+        moved = self.w_action[games[:, None], occupants] > 0
+        quad_open = quad_member & (tree_grid < 0) & \
+            (~occupied | self.w_planter[games[:, None], occupants] | moved)
+
+        # Collect carbon from cells into trees
+        absorbing = self.t_alive & ~newborn
+        if absorbing.any():
+            self._absorb(absorbing, worker_grid, quad_open)
+
+        # 地图未受影响的格子CO2增长计算
+        regen = ~(occupied & ~moved) & ~collided & (tree_grid < 0) & ~disappeared & ~quad_member
+        self.carbon[regen] = np.minimum(self.carbon[regen] * (1 + configuration.regen_rate),
+                                        configuration.max_cell_carbon)
+
+        # Clear the worker's action so it doesn't repeat the same action automatically
+        self.w_action[:] = 0
+
+        # 玩家金额仅保留2位小数, 地图保留3位小数
+        self.cash = round_half_even(self.cash, 2)
+        self.carbon = round_half_even(self.carbon, 3)
+
+        self.steps += 1
+
+    def _resolve_collisions(self, games: np.ndarray, slots: np.ndarray, tree_grid: np.ndarray,
+                            base_grid: np.ndarray, collided: np.ndarray) -> None:
+        """
+        Resolves every crowded cell like Board.next(): the collector with the unique least carbon survives,
+        otherwise everyone is deleted. Cells are handled in order of their first worker, as group_by does.
+        """
+        max_cell_carbon = self.configuration.max_cell_carbon
+        for game in np.unique(games).tolist():
+            game_slots = slots[games == game]
+            game_slots = game_slots[np.argsort(self.w_uid[game, game_slots], kind="stable")]
+            groups = {}
+            for slot in game_slots.tolist():
+                groups.setdefault(int(self.w_pos[game, slot]), []).append(slot)
+
+            for cell, group in groups.items():
+                collectors = [slot for slot in group if not self.w_planter[game, slot]]
+                winner = None
+                if collectors:
+                    smallest_carbon = min(self.w_carbon[game, slot] for slot in collectors)
+                    smallest_collectors = [slot for slot in collectors if self.w_carbon[game, slot] == smallest_carbon]
+                    if len(smallest_collectors) == 1:
+                        winner = smallest_collectors[0]
+                collided[game, cell] = True
+
+                for slot in group:
+                    if slot == winner:
+                        continue
+                    carried = self.w_carbon[game, slot]
+                    if winner is not None:  # 胜者为捕碳员,缴获对方身上的CO2
+                        self.w_carbon[game, winner] += carried
+                    elif tree_grid[game, cell] >= 0:  # 碰撞处存在树, 被树的拥有方全量吸收
+                        self.cash[game, self.t_player[game, tree_grid[game, cell]]] += carried
+                    elif base_grid[game, cell] >= 0:  # 碰撞处存在转化中心, 被转化中心的拥有方全量吸收
+                        self.cash[game, base_grid[game, cell]] += carried
+                    else:  # 全掉落在格子处
+                        self.carbon[game, cell] = min(self.carbon[game, cell] + carried, max_cell_carbon)
+                    self._delete_worker(game, slot)
+
+    def _plant_and_seize(self, games: np.ndarray, slots: np.ndarray, free: np.ndarray,
+                         player_plant_cost: np.ndarray, tree_grid: np.ndarray) -> np.ndarray:
+        """
+        Plants on free cells and seizes opponent trees for the staying planters.
+        Both spend the player's cash, so each game's planters go in worker order; games are processed side by side.
+        Returns the mask of the trees planted this step.
+        """
+        configuration = self.configuration
+        order = np.lexsort((self.w_uid[games, slots], games))
+        games, slots, free = games[order], slots[order], free[order]
+        first = np.searchsorted(games, games)
+        rank = np.arange(len(games)) - first
+
+        newborn_trees = []
+        for current_rank in range(rank.max() + 1):
+            selected = rank == current_rank
+            rank_games, rank_slots, rank_free = games[selected], slots[selected], free[selected]
+            players = self.w_player[rank_games, rank_slots]
+            cells = self.w_pos[rank_games, rank_slots]
+            cash = self.cash[rank_games, players]
+
+            plant_cost = player_plant_cost[rank_games, players]
+            plant = rank_free & (cash >= plant_cost)
+            if plant.any():
+                plant_games, plant_players, plant_cells = rank_games[plant], players[plant], cells[plant]
+                self.cash[plant_games, plant_players] = self.cash[plant_games, plant_players] - plant_cost[plant]
+                tree_slots = self._spawn_trees(plant_games, plant_players, plant_cells,
+                                               self.w_ids[plant_games, rank_slots[plant]])
+                self.carbon[plant_games, plant_cells] = 0
+                tree_grid[plant_games, plant_cells] = tree_slots
+                newborn_trees.append((plant_games, tree_slots))
+
+            seize = ~rank_free & (cash >= configuration.seize_cost)
+            if seize.any():
+                seize_games, seize_players = rank_games[seize], players[seize]
+                tree_slots = tree_grid[seize_games, cells[seize]]
+                self.cash[seize_games, seize_players] -= configuration.seize_cost
+                self.t_player[seize_games, tree_slots] = seize_players
+                self.t_order[seize_games, tree_slots] = self.t_dict_order[seize_games, tree_slots] = \
+                    self.t_clock[seize_games]
+                self.t_clock[seize_games] += 1
+                self.t_worker[seize_games, tree_slots] = self.w_ids[seize_games, rank_slots[seize]]
+                self.t_absorption[seize_games, tree_slots] = 0
+
+        newborn = np.zeros(self.t_alive.shape, dtype=bool)
+        for newborn_games, tree_slots in newborn_trees:
+            newborn[newborn_games, tree_slots] = True
+        # 新树的 id 按对局依次生成
+        newborn_games, newborn_slots = np.nonzero(newborn)
+        newborn_slots = newborn_slots[np.lexsort((self.t_order[newborn_games, newborn_slots], newborn_games))]
+        newborn_games = np.sort(newborn_games)
+        for game, slot in zip(newborn_games.tolist(), newborn_slots.tolist()):
+            self.t_ids[game, slot] = self._new_tree_id(game, int(self.t_player[game, slot]))
+        return newborn
+
+    def _absorb(self, absorbing: np.ndarray, worker_grid: np.ndarray, quad_open: np.ndarray) -> None:
+        """
+        Tree absorption of Board.next(). Every tree sums its contributions in the same order as Board.next()
+        (the collector under the tree, then for each octet neighbor its collector and its cell),
+        and players / workers / cells accumulate them tree by tree, so all float sums are bit-identical.
+        """
+        configuration = self.configuration
+        n_games, n_cells = self.n_games, self.n_cells
+        n_worker_slots = self.w_alive.shape[1]
+
+        games, slots = absorbing.nonzero()
+        order = np.lexsort((self.t_order[games, slots], games))
+        games, slots = games[order], slots[order]
+        owners = self.t_player[games, slots]
+        positions = self.t_pos[games, slots]
+        cells = np.concatenate([positions[:, None], self._octet[positions]], axis=1)  # 树下 + 8连通区域
+        tree_games = games[:, None]
+
+        workers = worker_grid[tree_games, cells]
+        occupants = np.maximum(workers, 0)
+        opponent_collector = (workers >= 0) & ~self.w_planter[tree_games, occupants] & \
+            (self.w_player[tree_games, occupants] != owners[:, None])
+        worker_absorbed = np.where(opponent_collector,
+                                   self.w_carbon[tree_games, occupants] * configuration.collector_absorption_rate,
+                                   0.0)
+        cell_carbon = self.carbon[tree_games, cells[:, 1:]]
+        cell_absorbing = (cell_carbon > 0) & quad_open[tree_games, cells[:, 1:]]
+        cell_absorbed = np.where(cell_absorbing, cell_carbon * configuration.cell_absorption_rate, 0.0)
+
+        contributions = np.empty((len(games), 17), dtype=np.float64)
+        contributions[:, 0] = worker_absorbed[:, 0]
+        contributions[:, 1::2] = worker_absorbed[:, 1:]
+        contributions[:, 2::2] = cell_absorbed
+        tree_carbon = np.cumsum(contributions, axis=1)[:, -1]  # 顺序累加, 与逐项相加结果一致
+
+        np.add.at(self.cash, (games, owners), tree_carbon)
+        self.t_absorption[games, slots] = tree_carbon
+        first = np.searchsorted(games, games)
+        self.t_dict_order[games, slots] = self.t_clock[games] + np.arange(len(games)) - first
+        self.t_clock += np.bincount(games, minlength=n_games)
+
+        # 树周围（对方捕碳员）在途的CO2被净化
+        worker_keys = tree_games * n_worker_slots + occupants
+        worker_reduction = np.bincount(worker_keys[opponent_collector], weights=worker_absorbed[opponent_collector],
+                                       minlength=n_games * n_worker_slots).reshape(n_games, n_worker_slots)
+        reduced = worker_reduction > 0
+        self.w_carbon[reduced] = np.maximum(self.w_carbon[reduced] - worker_reduction[reduced], 0)
+
+        # 树周围（网格） co2被净化
+        cell_keys = tree_games * n_cells + cells[:, 1:]
+        cell_reduction = np.bincount(cell_keys[cell_absorbing], weights=cell_absorbed[cell_absorbing],
+                                     minlength=n_games * n_cells).reshape(n_games, n_cells)
+        reduced = quad_open & (self.carbon > 0)
+        self.carbon[reduced] = np.maximum(self.carbon[reduced] - cell_reduction[reduced], 0)
@@ -21,9 +21,11 @@ from random import choice, randint, randrange, sample, seed
 from numpy.random import MT19937
 from numpy.random import RandomState, SeedSequence
 
-from .helpers import board_agent, Board, WorkerAction, RecrtCenterAction, Occupation, ConnectedField4
-from .idgen import new_worker_id, new_recrtCenter_id, new_tree_id, reset as reset_ids
-from zerosum_env import utils
+from .array_board import ArrayBoard
+from .geometry import DirectionCodes, get_geometry
+from .helpers import board_agent, Board, WorkerAction, RecrtCenterAction, Occupation
+from .idgen import IdGenerator
+from zerosum_env import profiling, utils
 
 
 def get_col_row(size, pos):
@@ -31,15 +33,7 @@ def get_col_row(size, pos):
 
 
 def get_to_pos(size, pos, direction):
-    col, row = get_col_row(size, pos)
-    if direction == "UP":
-        return pos - size if pos >= size else size ** 2 - size + col
-    elif direction == "DOWN":
-        return col if pos + size >= size ** 2 else pos + size
-    elif direction == "RIGHT":
-        return pos + 1 if col < size - 1 else row * size
-    elif direction == "LEFT":
-        return pos - 1 if col > 0 else (row + 1) * size - 1
+    return int(get_geometry(size).move[pos, DirectionCodes[direction]])
 
 
 @board_agent
@@ -94,9 +88,8 @@ def populate_board(state, env):
         max_int_32 = (1 << 31) - 1
         config.randomSeed = randrange(max_int_32)
 
+    # 地图只使用由randomSeed创建的随机数生成器, 初始状态仅由配置决定 (Environment.reset会缓存初始状态)
     np_rs = RandomState(MT19937(SeedSequence(config.randomSeed)))
-    # np.random.seed(config.randomSeed)
-    # seed(config.randomSeed)
 
     # Distribute Carbon evenly into quartiles.
     half = math.ceil(size / 2)
@@ -106,8 +99,8 @@ def populate_board(state, env):
     n_carbon_cells = max(n_carbon_cells, min_carbon_cells)
     carbon_mean = min(config.startingCarbon / 4 / n_carbon_cells, config.startingCellCarbon)
     assert carbon_mean > 0
-    half_grid_carbon = np.random.uniform(2 * carbon_mean, size=n_carbon_cells)
-    half_grid_indices = np.random.choice((half * half), size=n_carbon_cells, replace=False)
+    half_grid_carbon = np_rs.uniform(2 * carbon_mean, size=n_carbon_cells)
+    half_grid_indices = np_rs.choice((half * half), size=n_carbon_cells, replace=False)
     half_grid = np.zeros(half*half, np.float16)
     half_grid[half_grid_indices] = half_grid_carbon
     half_grid = half_grid.reshape((half, half))
@@ -135,13 +128,15 @@ def populate_board(state, env):
         full_obs.carbon[position] = 0
 
     # Initialize the players.
-    reset_ids()
+    # 每个环境有自己的id生成器, 同一进程中可以同时进行多局游戏
+    env.interpreter_state.id_generator = id_generator = IdGenerator()
     full_obs.players = []
     for i in range(num_agents):
-        # workers = {new_worker_id(i): [starting_positions[i], 0, '']}
+        # workers = {id_generator.new_worker_id(i): [starting_positions[i], 0, '']}
         base_start_index = i * num_bases
-        base_dict = {new_recrtCenter_id(i): starting_positions[base_start_index+j] for j in range(num_bases)}
-        # tree = {new_tree_id(i): starting_positions[i]+3}
+        base_dict = {id_generator.new_recrtCenter_id(i): starting_positions[base_start_index+j]
+                     for j in range(num_bases)}
+        # tree = {id_generator.new_tree_id(i): starting_positions[i]+3}
         full_obs.players.append([state[0].reward, base_dict, {}, {}])
 
     full_obs.trees = {}
@@ -153,6 +148,7 @@ def populate_board(state, env):
 
 
 def compute_next_board(state, env):
+    profiler = profiling.active()
     full_obs = state[0].observation
     config = env.configuration
 
@@ -160,12 +156,29 @@ def compute_next_board(state, env):
 
     # Interpreter invoked here
     actions = [agent.action for agent in state]
-    board = Board(full_obs, config, actions)
-    board = board.next()
+    # 例如由steps直接创建的环境没有生成器, 由观测中的id创建
+    id_generator = env.interpreter_state.get("id_generator")
+    if config.boardEngine == "array":
+        board = ArrayBoard([full_obs], config, [actions], [id_generator])
+        if profiler is not None:
+            profiler.lap("interpreter.board")
+        board = board.next()
+        if profiler is not None:
+            profiler.lap("array_board.next")
+        env.interpreter_state.id_generator = board.id_generator(0)
+    else:
+        board = Board(full_obs, config, actions, id_generator)
+        if profiler is not None:
+            profiler.lap("interpreter.board")
+        board = board.next()
+        env.interpreter_state.id_generator = board.id_generator
     state[0].observation = full_obs = utils.structify(board.observation)
     full_obs.full_carbon = full_obs.carbon
+    if profiler is not None:
+        profiler.lap("interpreter.observation")
 
     # Remove players with invalid status or insufficient potential.
+    board_matches_observation = isinstance(board, Board)
     for index, agent in enumerate(state):
         player_cash, recrtCenters, workers, trees = full_obs.players[index]
         if agent.status == "ACTIVE":
@@ -185,6 +198,7 @@ def compute_next_board(state, env):
 
         if agent.status != "ACTIVE" and agent.status != "DONE":
             full_obs.players[index] = [0, recrtCenters, {}, {}]
+            board_matches_observation = False
 
     # Check if done (< 2 players and num_agents > 1)
     if len(state) > 1 and sum(1 for agent in state if agent.status == "ACTIVE") < 2:
@@ -198,25 +212,38 @@ def compute_next_board(state, env):
             agent.reward = full_obs.players[index][0]
         elif agent.status != "DONE":
             agent.reward = 0
+    if profiler is not None:
+        profiler.lap("interpreter.statuses")
 
     # Filter unseen carbon(s) on map
     for index, agent in enumerate(state):
         agent.observation.carbon = [0] * (config.size ** 2)
-        visible_positions = []
-        for worker in board.players[index].workers:
-            if worker.is_collector:
-                visible_positions.append(worker.position)
-            elif worker.is_planter:
-                for direction in ConnectedField4:
-                    position = worker.position.translate(direction, config.size)
-                    visible_positions.append(position)
-
-        for visible_position in visible_positions:
-            index = visible_position.to_index(config.size)
-            agent.observation.carbon[index] = full_obs.full_carbon[index]
+        for visible_index in get_visible_indices(board, index):
+            agent.observation.carbon[visible_index] = full_obs.full_carbon[visible_index]
+    # 本轮计算得到的Board, 可由Board.view(agent.observation)得到各玩家的Board而不必由观测重建, 与观测不一致时为None
+    env.interpreter_state.board = board if board_matches_observation else None
+    if profiler is not None:
+        profiler.lap("interpreter.visibility")
     return state
 
 
+def get_visible_indices(board, player_id):
+    """
+    Returns the cell indices a player can see: collectors see their own cell, planters see the quad connected cells.
+    """
+    if isinstance(board, ArrayBoard):
+        return board.visible_indices(player_id).tolist()
+
+    geometry = get_geometry(board.configuration.size)
+    visible_indices = []
+    for worker in board.players[player_id].workers:
+        if worker.is_collector:
+            visible_indices.append(geometry.indices[worker.position])
+        elif worker.is_planter:
+            visible_indices.extend(geometry.quad[geometry.indices[worker.position]].tolist())
+    return visible_indices
+
+
 def interpreter(state, env):
     # Initialize the board (place cell carbon and starting workers).
     if env.done:
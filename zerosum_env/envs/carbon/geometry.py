@@ -0,0 +1,118 @@
+from typing import *
+
+import numpy as np
+
+from zerosum_env.helpers import Point
+
+
+ConnectedField4 = [  # 4-连通
+    Point(0, 1),  # 上
+    Point(1, 0),  # 右
+    Point(0, -1),  # 下
+    Point(-1, 0)  # 左
+]
+
+ConnectedField8 = [  # 8-连通
+    Point(-1, 1),  # 左上
+    Point(0, 1),  # 上
+    Point(1, 1),  # 右上
+    Point(1, 0),  # 右
+    Point(1, -1),  # 右下
+    Point(0, -1),  # 下
+    Point(-1, -1),  # 左下
+    Point(-1, 0)  # 左
+]
+
+# 移动方向, 与ConnectedField4及WorkerAction.moves()的顺序一致, 动作编码0表示停留
+Directions = ["UP", "RIGHT", "DOWN", "LEFT"]
+DirectionCodes = {direction: code for code, direction in enumerate(Directions, start=1)}
+DirectionOffsets = dict(zip(Directions, ConnectedField4))
+
+
+class Geometry:
+    """
+    Precomputed lookup tables of a size x size toroidal board, use get_geometry(size) to get the shared instance.
+
+    Tables indexed by observation index (see Point.to_index):
+        points[index]       the shared Point of the index
+        move[index, code]   index reached by a move, code 0 stays and codes 1-4 follow Directions
+        quad / octet        ConnectedField4 / ConnectedField8 neighbors, in the same order
+        distances[i, j]     toroidal Manhattan distance between two indices
+    Tables keyed by Point (the values are the shared Points), for the Board engine and the policies:
+        move_points[point][code], quad_points[point], octet_points[point]
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.points = [Point.from_index(index, size) for index in range(size * size)]
+        self.indices = {point: index for index, point in enumerate(self.points)}
+        # (position, index) of every cell, x then y, the order Board creates its cells in
+        self.cells = [(point, self.indices[point]) for point in sorted(self.points)]
+
+        self.move = self._index_table([Point(0, 0)] + ConnectedField4)
+        self.quad = self._index_table(ConnectedField4)
+        self.octet = self._index_table(ConnectedField8)
+        self.move_points = self._point_table(self.move)
+        self.quad_points = self._point_table(self.quad)
+        self.octet_points = self._point_table(self.octet)
+
+        self.axis_distances = [min(delta, size - delta) for delta in range(size)]  # 单个坐标轴上的环形距离
+        xs = np.array([point.x for point in self.points])
+        ys = np.array([point.y for point in self.points])
+        axis_distances = np.array(self.axis_distances, dtype=np.int64)
+        self.distances = axis_distances[(xs[:, None] - xs[None, :]) % size] + \
+            axis_distances[(ys[:, None] - ys[None, :]) % size]
+        self._distance_rows = self.distances.tolist()
+
+    def _index_table(self, offsets: List[Point]) -> np.ndarray:
+        size = self.size
+        return np.array([[Point((x + dx) % size, (y + dy) % size).to_index(size) for dx, dy in offsets]
+                         for x, y in self.points], dtype=np.int64)
+
+    def _point_table(self, table: np.ndarray) -> Dict[Point, List[Point]]:
+        points = self.points
+        return {point: [points[index] for index in row] for point, row in zip(points, table.tolist())}
+
+    def translate(self, point: Point, direction: Union[str, Point]) -> Point:
+        """
+        Returns the shared Point reached from point by a direction name ("UP", ...) or any offset.
+        """
+        if isinstance(direction, str):
+            return self.move_points[point][DirectionCodes[direction]]
+        return self.points[Point((point[0] + direction[0]) % self.size,
+                                 (point[1] + direction[1]) % self.size).to_index(self.size)]
+
+    def move_code(self, source: Point, target: Point) -> Optional[int]:
+        """
+        Returns the move code (0 stays, 1-4 follow Directions) leading from source to the adjacent target, or None.
+        """
+        moves = self.move_points.get(source)
+        return moves.index(target) if moves is not None and target in moves else None
+
+    def distance(self, point_1: Point, point_2: Point) -> int:
+        """Toroidal Manhattan distance between two points of the board."""
+        return self._distance_rows[self.indices[point_1]][self.indices[point_2]]
+
+    def distance_xy(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        """Toroidal Manhattan distance between (x1, y1) and (x2, y2), the coordinates may lie outside the board."""
+        size = self.size
+        return self.axis_distances[(x1 - x2) % size] + self.axis_distances[(y1 - y2) % size]
+
+    @property
+    def xy_distances(self) -> np.ndarray:
+        """distances laid out by coordinates: xy_distances[x1, y1, x2, y2], dim: size x size x size x size."""
+        size = self.size
+        order = [point.to_index(size) for point in sorted(self.points)]  # x then y
+        return self.distances[np.ix_(order, order)].reshape(size, size, size, size)
+
+
+_geometries = {}  # key: board size, value: Geometry
+
+
+def get_geometry(size: int) -> Geometry:
+    """
+    Returns the Geometry of a board size, built once per process.
+    """
+    geometry = _geometries.get(size)
+    if geometry is None:
+        geometry = _geometries[size] = Geometry(size)
+    return geometry
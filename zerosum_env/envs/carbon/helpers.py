@@ -16,34 +16,18 @@ from collections import defaultdict
 from copy import deepcopy
 from enum import Enum, auto
 from functools import wraps
+from zerosum_env import profiling
 from zerosum_env.helpers import Point, group_by
 from typing import *
+import itertools
 import sys
 import zerosum_env.helpers
 
-from .idgen import new_worker_id, new_tree_id
+from .geometry import ConnectedField4, ConnectedField8, DirectionCodes, get_geometry
+from .idgen import IdGenerator
 from .termtables import to_string
 
 
-ConnectedField4 = [  # 4-连通
-    Point(0, 1),  # 上
-    Point(1, 0),  # 右
-    Point(0, -1),  # 下
-    Point(-1, 0)  # 左
-]
-
-ConnectedField8 = [  # 8-连通
-    Point(-1, 1),  # 左上
-    Point(0, 1),  # 上
-    Point(1, 1),  # 右上
-    Point(1, 0),  # 右
-    Point(1, -1),  # 右下
-    Point(0, -1),  # 下
-    Point(-1, -1),  # 左下
-    Point(-1, 0)  # 左
-]
-
-
 # region Data Model Classes
 class Observation(zerosum_env.helpers.Observation):
     """
@@ -228,6 +212,11 @@ class Configuration(zerosum_env.helpers.Configuration):
         """The number of bases for each player"""
         return self["numberOfBases"]
 
+    @property
+    def board_engine(self) -> str:
+        """The engine computing the next board, "board" or "array"."""
+        return self["boardEngine"]
+
 
 class WorkerAction(Enum):
     UP = auto()
@@ -246,13 +235,7 @@ class WorkerAction(Enum):
         DOWN -> (0, -1)
         LEFT -> (-1, 0)
         """
-        return (
-            Point(0, 1) if self == WorkerAction.UP else
-            Point(1, 0) if self == WorkerAction.RIGHT else
-            Point(0, -1) if self == WorkerAction.DOWN else
-            Point(-1, 0) if self == WorkerAction.LEFT else
-            None
-        )
+        return _action_points.get(self)
 
     def __str__(self) -> str:
         return self.name
@@ -267,6 +250,14 @@ class WorkerAction(Enum):
         ]
 
 
+_action_points = {  # Point是不可变的, 各动作共用同一个实例
+    WorkerAction.UP: Point(0, 1),
+    WorkerAction.RIGHT: Point(1, 0),
+    WorkerAction.DOWN: Point(0, -1),
+    WorkerAction.LEFT: Point(-1, 0),
+}
+
+
 class RecrtCenterAction(Enum):
     RECCOLLECTOR = auto()
     RECPLANTER = auto()
@@ -291,6 +282,8 @@ PlayerId = NewType('PlayerId', int)
 
 
 class Cell:
+    __slots__ = ("_position", "_carbon", "_recrtCenter_id", "_worker_id", "_tree_id", "_board")
+
     def __init__(self, position: Point, carbon: float, recrtCenter_id: Optional[RecrtCenterId],
                  worker_id: Optional[WorkerId],
                  tree_id: Optional[TreeId], board: 'Board') -> None:
@@ -334,12 +327,12 @@ class Cell:
     @property
     def planter(self) -> Optional['Planter']:
         """Returns the planter on this cell if it exists and None otherwise."""
-        return self._board.planters.get(self.worker_id)
+        return self._board._planters.get(self.worker_id)
 
     @property
     def collector(self) -> Optional['Collector']:
         """Returns the collector on this cell if it exists and None otherwise."""
-        return self._board.collectors.get(self.worker_id)
+        return self._board._collectors.get(self.worker_id)
 
     @property
     def recrtCenter(self) -> Optional['RecrtCenter']:
@@ -354,25 +347,27 @@ class Cell:
     @property
     def up(self) -> 'Cell':
         """Returns the cell up of this cell."""
-        return self.neighbor(WorkerAction.UP.to_point())
+        return self._board._cells[self._board._geometry.move_points[self._position][1]]
 
     @property
     def down(self) -> 'Cell':
         """Returns the cell down of this cell."""
-        return self.neighbor(WorkerAction.DOWN.to_point())
+        return self._board._cells[self._board._geometry.move_points[self._position][3]]
 
     @property
     def right(self) -> 'Cell':
         """Returns the cell right of this cell."""
-        return self.neighbor(WorkerAction.RIGHT.to_point())
+        return self._board._cells[self._board._geometry.move_points[self._position][2]]
 
     @property
     def left(self) -> 'Cell':
         """Returns the cell left of this cell."""
-        return self.neighbor(WorkerAction.LEFT.to_point())
+        return self._board._cells[self._board._geometry.move_points[self._position][4]]
 
 
 class Tree:
+    __slots__ = ("_id", "_age", "_position", "_player_id", "_board")
+
     def __init__(self, tree_id: TreeId, position: Point, age: int, player_id: PlayerId, board: 'Board') -> None:
         self._id = tree_id
         self._age = age
@@ -430,6 +425,8 @@ class Tree:
 
 
 class Worker:
+    __slots__ = ("_id", "_occupation", "_position", "_carbon", "_player_id", "_board", "_next_action")
+
     def __init__(self, worker_id: WorkerId, position: Point, carbon: float, player_id: PlayerId, board: 'Board',
                  next_action: Optional[WorkerAction] = None) -> None:
         self._id = worker_id
@@ -499,6 +496,8 @@ class Worker:
 
 # 捕碳人
 class Collector(Worker):
+    __slots__ = ()
+
     def __init__(self, worker_id: WorkerId, position: Point, carbon: float, player_id: PlayerId, board: 'Board',
                  next_action: Optional[WorkerAction] = None) -> None:
         Worker.__init__(self, worker_id, position, carbon, player_id, board, next_action)
@@ -511,6 +510,8 @@ class Collector(Worker):
 
 # 种树人
 class Planter(Worker):
+    __slots__ = ()
+
     def __init__(self, worker_id: WorkerId, position: Point, carbon: float, player_id: PlayerId, board: 'Board',
                  next_action: Optional[WorkerAction] = None) -> None:
         Worker.__init__(self, worker_id, position, carbon, player_id, board, next_action)
@@ -522,6 +523,8 @@ class Planter(Worker):
 
 
 class RecrtCenter:
+    __slots__ = ("_id", "_position", "_player_id", "_board", "_next_action")
+
     def __init__(self, recrtCenter_id: RecrtCenterId, position: Point, player_id: PlayerId, board: 'Board',
                  next_action: Optional[RecrtCenterAction] = None) -> None:
         self._id = recrtCenter_id
@@ -568,6 +571,9 @@ class RecrtCenter:
 
 
 class Player:
+    __slots__ = ("_id", "_cash", "_recrtCenter_ids", "_worker_ids", "_tree_ids", "_board",
+                 "_workers", "_collectors", "_planters", "_trees")
+
     def __init__(self, player_id: PlayerId, cash: float, recrtCenter_ids: List[RecrtCenterId],
                  worker_ids: List[WorkerId],
                  tree_ids: List[TreeId], board: 'Board') -> None:
@@ -577,6 +583,11 @@ class Player:
         self._worker_ids = worker_ids
         self._tree_ids = tree_ids
         self._board = board
+        # 由Board._add_*/_delete_*维护的索引, 顺序与worker_ids/tree_ids一致
+        self._workers: Dict[WorkerId, Worker] = {}
+        self._collectors: Dict[WorkerId, Collector] = {}
+        self._planters: Dict[WorkerId, Planter] = {}
+        self._trees: Dict[TreeId, Tree] = {}
 
     @property
     def id(self) -> PlayerId:
@@ -609,38 +620,38 @@ class Player:
     @property
     def workers(self) -> List[Worker]:
         """Returns all workers owned by this player."""
-        return [
-            self._board.workers[worker_id]
-            for worker_id in self.worker_ids
-        ]
+        return list(self._workers.values())
 
     @property
     def collectors(self) -> List[Collector]:
         """Returns all collectors owned by this player."""
-        res = []
-        for worker_id in self.worker_ids:
-            worker = self._board.workers[worker_id]
-            if worker.occupation == Occupation.COLLECTOR:
-                res.append(worker)
-        return res
+        return list(self._collectors.values())
 
     @property
     def planters(self) -> List[Planter]:
-        """Returns all collectors owned by this player."""
-        res = []
-        for worker_id in self.worker_ids:
-            worker = self._board.workers[worker_id]
-            if worker.occupation == Occupation.PLANTER:
-                res.append(worker)
-        return res
+        """Returns all planters owned by this player."""
+        return list(self._planters.values())
 
     @property
     def trees(self) -> List[Tree]:
-        """Returns all workers owned by this player."""
-        return [
-            self._board.trees[tree_id]
-            for tree_id in self.tree_ids
-        ]
+        """Returns all trees owned by this player."""
+        return list(self._trees.values())
+
+    @property
+    def worker_count(self) -> int:
+        return len(self._workers)
+
+    @property
+    def collector_count(self) -> int:
+        return len(self._collectors)
+
+    @property
+    def planter_count(self) -> int:
+        return len(self._planters)
+
+    @property
+    def tree_count(self) -> int:
+        return len(self._trees)
 
     @property
     def is_current_player(self) -> bool:
@@ -674,12 +685,45 @@ class Player:
 # endregion
 
 
+class StepEvents:
+    """
+    What happened during the step that produced a board (Board.next()): the actions the workers and recrtCenters
+    actually executed and the outcome of every phase. Consumers (the observation parser, the rewards) read it instead
+    of guessing the actions from the difference between two observations.
+    """
+    __slots__ = ("worker_actions", "recruits", "plantings", "seizures", "withered", "collisions", "destroyed",
+                 "deliveries", "absorptions", "worker_absorptions")
+
+    def __init__(self) -> None:
+        # key: 上一步已存在的worker_id (包括本步被消灭的工人), value: 执行的移动, None表示停留
+        self.worker_actions: Dict[WorkerId, Optional[WorkerAction]] = {}
+        # key: 成功招募的转化中心, value: (新工人的id, 执行的招募指令)
+        self.recruits: Dict[RecrtCenterId, Tuple[WorkerId, RecrtCenterAction]] = {}
+        # key: 新种的树, value: 种树员的id
+        self.plantings: Dict[TreeId, WorkerId] = {}
+        # key: 被抢的树, value: (抢树的种树员的id, 树原来的player_id)
+        self.seizures: Dict[TreeId, Tuple[WorkerId, PlayerId]] = {}
+        # 本步枯死的树
+        self.withered: List[TreeId] = []
+        # key: 发生碰撞的坐标, value: 该坐标上所有工人的id (包括胜者)
+        self.collisions: Dict[Point, List[WorkerId]] = {}
+        # 本步被消灭的工人 (碰撞, 无碳进入对方转化中心)
+        self.destroyed: List[WorkerId] = []
+        # key: 捕碳员的id, value: 转化为cash的CO2数量
+        self.deliveries: Dict[WorkerId, float] = {}
+        # key: 树的id, value: 树吸收的CO2总量
+        self.absorptions: Dict[TreeId, float] = {}
+        # key: 捕碳员的id, value: 被对方树吸收的CO2数量
+        self.worker_absorptions: Dict[WorkerId, float] = {}
+
+
 class Board:
     def __init__(
             self,
             raw_observation: Dict[str, Any],
             raw_configuration: Union[Configuration, Dict[str, Any]],
-            next_actions: Optional[List[Dict[str, str]]] = None
+            next_actions: Optional[List[Dict[str, str]]] = None,
+            id_generator: Optional[IdGenerator] = None
     ) -> None:
         """
         Creates a board from the provided observation, configuration, and next_actions as specified by
@@ -690,6 +734,8 @@ class Board:
             [worker.carbon for player in board.players for worker in player.workers]
             worker.player.recrtCenter[0].cell.north.east.worker
         Consumers should not set or modify any attributes except Worker.next_action and RecrtCenter.next_action
+        The ids of the workers and trees created by next() come from id_generator (the generator of the game),
+        by default from a generator continuing after the ids of the observation.
         """
         observation = Observation(raw_observation)
         # next_actions is effectively a Dict[Union[[WorkerId, WorkerAction], [RecrtCenterId, RecrtCenterAction]]]
@@ -699,23 +745,30 @@ class Board:
 
         self._step = observation.step
         self._remaining_overage_time = observation.remaining_overage_time
-        self._configuration = Configuration(raw_configuration)
+        # 配置在Board之间共享(包括next()生成的Board), 不可修改
+        self._configuration = raw_configuration if isinstance(raw_configuration, Configuration) \
+            else Configuration(raw_configuration)
         self._current_player_id = observation.player
+        self._id_generator = id_generator  # 默认在next()需要时由当前的id创建
+        self._events: Optional[StepEvents] = None  # 由next()记录
         self._players: Dict[PlayerId, Player] = {}
         self._trees: Dict[TreeId, Tree] = {}
         self._trees_dict: Dict[TreeId, Any] = {}
         self._workers: Dict[WorkerId, Worker] = {}
+        self._collectors: Dict[WorkerId, Collector] = {}
+        self._planters: Dict[WorkerId, Planter] = {}
+        self._worker_tree_ids: Dict[WorkerId, Set[TreeId]] = {}  # _trees_dict的反向索引, key: worker_id
         self._recrtCenters: Dict[RecrtCenterId, RecrtCenter] = {}
         self._cells: Dict[Point, Cell] = {}
 
         size = self.configuration.size
+        carbon = observation.carbon
+        cells = self._cells
         # Create a cell for every point in a size x size grid
-        for x in range(size):
-            for y in range(size):
-                position = Point(x, y)
-                carbon = observation.carbon[position.to_index(size)]
-                # We'll populate the cell's workers and recrtCenter in _add_worker and _add_recrtCenter
-                self.cells[position] = Cell(position, carbon, None, None, None, self)
+        self._geometry = get_geometry(size)
+        for position, index in self._geometry.cells:
+            # We'll populate the cell's workers and recrtCenter in _add_worker and _add_recrtCenter
+            cells[position] = Cell(position, carbon[index], None, None, None, self)
 
         for (player_id, player_observation) in enumerate(observation.players):
             # We know the len(player_observation) == 3 based on the schema -- this is a hack to have a tuple in json
@@ -761,6 +814,24 @@ class Board:
     def configuration(self) -> Configuration:
         return self._configuration
 
+    @property
+    def id_generator(self) -> IdGenerator:
+        """
+        ID generator of the workers and trees created by next(), the board returned by next() continues with a copy.
+        """
+        if self._id_generator is None:
+            self._id_generator = IdGenerator.from_ids(
+                itertools.chain(self._workers, self._trees, self._recrtCenters))
+        return self._id_generator
+
+    @property
+    def events(self) -> Optional[StepEvents]:
+        """
+        Events of the step that produced this board, None if the board was not returned by next() (e.g. built from an
+        observation or forked).
+        """
+        return self._events
+
     @property
     def players(self) -> Dict[PlayerId, Player]:
         return self._players
@@ -777,23 +848,13 @@ class Board:
 
     @property
     def collectors(self) -> Dict[WorkerId, Collector]:
-        """Returns all collectors on the current board."""
-        res = {}
-        for work_id in self._workers.keys():
-            worker = self._workers[work_id]
-            if worker.occupation == Occupation.COLLECTOR:
-                res[work_id] = worker
-        return res
+        """Returns all collectors on the current board (a copy, the board keeps its own index)."""
+        return dict(self._collectors)
 
     @property
     def planters(self) -> Dict[WorkerId, Planter]:
-        """Returns all collectors on the current board."""
-        res = {}
-        for work_id in self._workers.keys():
-            worker = self._workers[work_id]
-            if worker.occupation == Occupation.PLANTER:
-                res[work_id] = worker
-        return res
+        """Returns all planters on the current board (a copy, the board keeps its own index)."""
+        return dict(self._planters)
 
     @property
     def recrtCenters(self) -> Dict[RecrtCenterId, RecrtCenter]:
@@ -829,8 +890,8 @@ class Board:
     @property
     def observation(self) -> Dict[str, Any]:
         """Converts a Board back to the normalized observation that constructed it."""
-        size = self.configuration.size
-        carbon = [self[Point.from_index(index, size)].carbon for index in range(size * size)]
+        cells = self._cells
+        carbon = [cells[point]._carbon for point in self._geometry.points]
         players = [player._observation for player in self.players.values()]
 
         return {
@@ -843,8 +904,98 @@ class Board:
         }
 
     def __deepcopy__(self, _) -> 'Board':
-        actions = [player.next_actions for player in self.players.values()]
-        return Board(self.observation, self.configuration, actions)
+        return self.fork()
+
+    def fork(self) -> 'Board':
+        """
+        Returns an independent copy of the board with the same next actions, e.g. to simulate several branches with
+        board.fork().next(). The copy is the same as Board(board.observation, board.configuration, next_actions)
+        (entities in the same order), but it is built from the entities directly instead of the observation.
+        """
+        board = Board.__new__(Board)
+        board._load(self)
+        return board
+
+    def snapshot(self) -> 'Board':
+        """
+        Returns a snapshot of the board to go back to with restore(). The snapshot is a fork and must not be modified.
+        """
+        return self.fork()
+
+    def restore(self, snapshot: 'Board') -> None:
+        """
+        Resets this board in place to a snapshot returned by snapshot(), the same snapshot can be restored many times.
+        """
+        self._load(snapshot)
+
+    def view(self, raw_observation: Dict[str, Any], fork: bool = True) -> 'Board':
+        """
+        Returns the board as seen in the observation of one of its agents (current player, visible carbon, overage
+        time), the same as Board(raw_observation, configuration) without rebuilding the board from the observation.
+        fork=False changes this board in place instead of a fork, e.g. for the last view taken of a board. The entities
+        then keep the order of this board, which differs from the one of a rebuilt board after next().
+        """
+        observation = Observation(raw_observation)
+        if fork:
+            board = self.fork()
+            board._events = self._events  # 视角不改变本步的事件
+        else:
+            board = self
+        board._current_player_id = observation.player
+        board._remaining_overage_time = observation.remaining_overage_time
+        cells = board._cells
+        for position, carbon in zip(self._geometry.points, observation.carbon):
+            cells[position]._carbon = carbon
+        for recrtCenter in board._recrtCenters.values():  # 与_add_recrtCenter一致
+            recrtCenter.cell._carbon = 0
+        return board
+
+    def _load(self, source: 'Board') -> None:
+        """Replaces the state of this board by a copy of source, following the order of Board.__init__."""
+        self._step = source._step
+        self._remaining_overage_time = source._remaining_overage_time
+        self._configuration = source._configuration
+        self._geometry = source._geometry
+        self._current_player_id = source._current_player_id
+        self._id_generator = source._id_generator.copy() if source._id_generator is not None else None
+        self._events = None
+        self._players = {}
+        self._trees = {}
+        self._trees_dict = {}
+        self._workers = {}
+        self._collectors = {}
+        self._planters = {}
+        self._worker_tree_ids = {}
+        self._recrtCenters = {}
+        self._cells = cells = {}
+
+        new_cell = Cell.__new__  # 跳过__init__的调用, 格子是fork的主要开销
+        for position, cell in source._cells.items():
+            cells[position] = cell_copy = new_cell(Cell)
+            cell_copy._position, cell_copy._carbon, cell_copy._board = position, cell._carbon, self
+            cell_copy._recrtCenter_id = cell_copy._worker_id = cell_copy._tree_id = None
+
+        trees, trees_dict, workers, recrtCenters = \
+            source._trees, source._trees_dict, source._workers, source._recrtCenters
+        for player_id, player in source._players.items():
+            self._players[player_id] = Player(player_id, player._cash, [], [], [], self)
+
+            for tree_id in player._tree_ids:
+                tree = trees[tree_id]
+                new_tree = Tree(tree_id, tree._position, tree._age, player_id, self)
+                self._add_tree(new_tree)
+                self._add_tree_dict(new_tree, *trees_dict[tree_id])
+
+            for worker_id in player._worker_ids:
+                worker = workers[worker_id]
+                worker_class = Planter if worker.is_planter else Collector
+                self._add_worker(worker_class(worker_id, worker._position, worker._carbon, player_id, self,
+                                              worker._next_action))
+
+            for recrtCenter_id in player._recrtCenter_ids:
+                recrtCenter = recrtCenters[recrtCenter_id]
+                self._add_recrtCenter(RecrtCenter(recrtCenter_id, recrtCenter._position, player_id, self,
+                                                  recrtCenter._next_action))
 
     def __getitem__(self, point: Union[Tuple[int, int], Point]) -> Cell:
         """
@@ -899,18 +1050,39 @@ class Board:
         return to_string(contents)
 
     def _add_tree(self: 'Board', tree: Tree) -> None:
-        tree.player.tree_ids.append(tree.id)
+        player = tree.player
+        player.tree_ids.append(tree.id)
+        player._trees[tree.id] = tree
         tree.cell._tree_id = tree.id
         self._trees[tree.id] = tree
 
     def _add_tree_dict(self: 'Board', tree: Tree, worker_id: WorkerId, tree_absorption) -> None:
         if tree.id in self._trees_dict:
+            self._unlink_tree_worker(tree.id)
             del self._trees_dict[tree.id]
 
         self._trees_dict[tree.id] = [worker_id, tree_absorption]
+        if worker_id is not None:
+            self._worker_tree_ids.setdefault(worker_id, set()).add(tree.id)
+
+    def _unlink_tree_worker(self: 'Board', tree_id: TreeId) -> None:
+        worker_id = self._trees_dict[tree_id][0]
+        tree_ids = self._worker_tree_ids.get(worker_id)
+        if tree_ids is not None:
+            tree_ids.discard(tree_id)
+            if not tree_ids:
+                del self._worker_tree_ids[worker_id]
 
     def _add_worker(self: 'Board', worker: Worker) -> None:
-        worker.player.worker_ids.append(worker.id)
+        player = worker.player
+        player.worker_ids.append(worker.id)
+        player._workers[worker.id] = worker
+        if worker.is_collector:
+            player._collectors[worker.id] = worker
+            self._collectors[worker.id] = worker
+        elif worker.is_planter:
+            player._planters[worker.id] = worker
+            self._planters[worker.id] = worker
         worker.cell._worker_id = worker.id
         self._workers[worker.id] = worker
 
@@ -921,24 +1093,31 @@ class Board:
         self._recrtCenters[recrtCenter.id] = recrtCenter
 
     def _delete_tree(self: 'Board', tree: Tree) -> None:
-        tree.player.tree_ids.remove(tree.id)
+        player = tree.player
+        player.tree_ids.remove(tree.id)
+        del player._trees[tree.id]
         if tree.cell.tree_id == tree.id:
             tree.cell._worker_id = None
         del self.trees[tree.id]
+        self._unlink_tree_worker(tree.id)
         del self._trees_dict[tree.id]
 
     def _delete_worker(self: 'Board', worker: Worker) -> None:
-        worker.player.worker_ids.remove(worker.id)
+        player = worker.player
+        player.worker_ids.remove(worker.id)
+        del player._workers[worker.id]
+        player._collectors.pop(worker.id, None)
+        player._planters.pop(worker.id, None)
 
         if worker.cell.worker_id == worker.id:
             worker.cell._worker_id = None
 
-        for tree_id in self._trees_dict.keys():
-            tree_worker_id = self._trees_dict.get(tree_id)[0]
-            if tree_worker_id == worker.id:
-                self._trees_dict[tree_id][0] = None
+        for tree_id in self._worker_tree_ids.pop(worker.id, ()):
+            self._trees_dict[tree_id][0] = None
 
         del self._workers[worker.id]
+        self._collectors.pop(worker.id, None)
+        self._planters.pop(worker.id, None)
 
     def _delete_recrtCenter(self: 'Board', recrtCenter: RecrtCenter) -> None:
 
@@ -955,15 +1134,21 @@ class Board:
         This can form a carbon interpreter, e.g.
             next_observation = Board(current_observation, configuration, actions).next().observation
         """
+        profiler = profiling.active()
         # Create a copy of the board to modify so we don't affect the current board
         board = deepcopy(self)
         configuration = board.configuration
+        geometry = board._geometry
+        id_generator = board.id_generator
+        events = board._events = StepEvents()
+        if profiler is not None:
+            profiler.lap("board.copy")
 
         # 计算当前轮招募工人的价格
         rec_collector_cost = configuration.rec_collector_cost + \
-                             len(board.collectors) * configuration.rec_collector_increase_cost
+                             len(board._collectors) * configuration.rec_collector_increase_cost
         rec_planter_cost = configuration.rec_planter_cost + \
-                           len(board.planters) * configuration.rec_planter_increase_cost
+                           len(board._planters) * configuration.rec_planter_increase_cost
 
         # 计算当前轮树的种植价格
         plant_cost = configuration.plant_cost
@@ -975,49 +1160,61 @@ class Board:
         player_tree_count_threshold = configuration.player_tree_protective_number
         player_plant_cost = {}
         for player in board.players.values():
-            if len(player.trees) <= player_tree_count_threshold:  # 种树价格不受市场价格影响
+            if player.tree_count <= player_tree_count_threshold:  # 种树价格不受市场价格影响
                 player_plant_cost[player.id] = plant_cost
             else:
                 player_plant_cost[player.id] = plant_market_price
 
         # 计算玩家指令(转化中心招募指令,种树员+捕碳员移动指令)、更新树龄
         disappeared_tree_flag = {}
+        recruited_worker_ids = set()
         for player in board.players.values():
             # 处理玩家的转化中心发出的指令
             for recrtCenter in player.recrtCenters:
                 # 招募捕碳员指令
                 if recrtCenter.next_action == RecrtCenterAction.RECCOLLECTOR and \
-                        player.cash >= rec_collector_cost and len(player.workers) < configuration.worker_limit:
+                        player.cash >= rec_collector_cost and player.worker_count < configuration.worker_limit:
                     # and len(player.collectors) < configuration.collector_limit  #  暂时不控制捕碳员的数量
                     # Handle RECCOLLECTOR actions
                     player._cash = max(player._cash - rec_collector_cost, 0)
-                    board._add_worker(Collector(WorkerId(new_worker_id(player.id)),
-                                                recrtCenter.position, 0, player.id, board))
+                    worker_id = WorkerId(id_generator.new_worker_id(player.id))
+                    events.recruits[recrtCenter.id] = (worker_id, RecrtCenterAction.RECCOLLECTOR)
+                    recruited_worker_ids.add(worker_id)
+                    board._add_worker(Collector(worker_id, recrtCenter.position, 0, player.id, board))
                 # 招募种树员指令
                 if recrtCenter.next_action == RecrtCenterAction.RECPLANTER and \
-                        player.cash >= rec_planter_cost and len(player.workers) < configuration.worker_limit:
+                        player.cash >= rec_planter_cost and player.worker_count < configuration.worker_limit:
                     # and len(player.planters) < configuration.planter_limit  # 暂时不控制种树员的数量
                     # Handle RECPLANTER actions
                     player._cash = max(player._cash - rec_planter_cost, 0)
-                    board._add_worker(Planter(WorkerId(new_worker_id(player.id)),
-                                              recrtCenter.position, 0, player.id, board))
+                    worker_id = WorkerId(id_generator.new_worker_id(player.id))
+                    events.recruits[recrtCenter.id] = (worker_id, RecrtCenterAction.RECPLANTER)
+                    recruited_worker_ids.add(worker_id)
+                    board._add_worker(Planter(worker_id, recrtCenter.position, 0, player.id, board))
                 # Clear the recrtCenter's action so it doesn't repeat the same action automatically
                 recrtCenter.next_action = None
+            if profiler is not None:
+                profiler.lap("board.recruit")
 
             # 处理玩家的种树人和捕碳人发出的移动指令
             for worker in player.workers:
+                if worker.id not in recruited_worker_ids:  # 本步招募的工人没有动作
+                    events.worker_actions[worker.id] = worker.next_action
                 if worker.next_action in WorkerAction.moves():
                     worker.cell._worker_id = None
-                    worker._position = worker.position.translate(worker.next_action.to_point(), configuration.size)
+                    worker._position = geometry.move_points[worker.position][DirectionCodes[worker.next_action.name]]
                     worker._carbon = worker._carbon * (1 - board.configuration.move_cost)
 
                     # We don't set the new cell's worker_id here as it would be overwritten by another worker in the case of collision.
                     # Later we'll iterate through all workers and re-set the cell._worker_id as appropriate.
+            if profiler is not None:
+                profiler.lap("board.move")
 
             # 处理树龄
             for tree in player.trees:
                 if tree.age >= configuration.tree_lifespan:
                     disappeared_tree_flag[tree.position] = True
+                    events.withered.append(tree.id)
                     tree.cell._tree_id = None
                     tree.cell._carbon = configuration.co2_frm_withered
                     board._delete_tree(tree)
@@ -1026,6 +1223,8 @@ class Board:
 
             # Lets just check and make sure.
             assert player.cash >= 0
+            if profiler is not None:
+                profiler.lap("board.tree_aging")
 
         # 碰撞检测和更新
         def resolve_collision(workers: List[Worker]) -> Tuple[Optional[Worker], List[Worker]]:
@@ -1055,6 +1254,8 @@ class Board:
             winner, deleted = resolve_collision(collided_workers)
             if len(deleted) > 0:  # 若发生碰撞,标记为True
                 collisions_flag[position] = True
+                events.collisions[position] = [worker.id for worker in collided_workers]
+                events.destroyed.extend(worker.id for worker in deleted)
 
             is_winner_collector = False
             if winner is not None:
@@ -1075,6 +1276,9 @@ class Board:
                     worker.cell._carbon = min(worker.cell._carbon + worker.carbon, configuration.max_cell_carbon)
                 # 从地图中删除工人
                 board._delete_worker(worker)
+        if profiler is not None:
+            profiler.lap("board.collision")
+            profiler.count("collisions", len(collisions_flag))
 
         # Check for worker to recrtCenter collisions
         # for recrtCenter in list(board.recrtCenters.values()):
@@ -1090,14 +1294,18 @@ class Board:
                             worker._carbon <= configuration.smelt_cost:  # 对方人员无碳,则直接消失
                         # 从地图中删除工人
                         board._delete_worker(worker)
+                        events.destroyed.append(worker.id)
                     elif worker._carbon >= configuration.smelt_cost:  # 净化CO2
+                        events.deliveries[worker.id] = worker._carbon - configuration.smelt_cost
                         recrtCenter.player._cash += worker._carbon - configuration.smelt_cost
                         worker._carbon = 0
+        if profiler is not None:
+            profiler.lap("board.delivery")
 
         # 计算工人的停留指令(种树员种树/抢树,捕碳员捕碳)
         new_born_tree_ids = set()  # 本轮新种的树
         player_collect_rate = {player_id: max(configuration.initial_collect_rate -
-                                              len(player.collectors) * configuration.collect_decrease_rate, 0)
+                                              player.collector_count * configuration.collect_decrease_rate, 0)
                                for player_id, player in board.players.items()}
         for worker in board.workers.values():
             cell = worker.cell
@@ -1110,12 +1318,13 @@ class Board:
                     if worker.is_planter and worker.player.cash >= player_plant_cost[worker.player_id]:
                         # 此处 当前停留方是种树人 且当前停留方金额超过种树金额 (种树逻辑)
                         worker.player._cash = worker.player._cash - player_plant_cost[worker.player_id]
-                        new_tree = Tree(TreeId(new_tree_id(worker.player_id)),
+                        new_tree = Tree(TreeId(id_generator.new_tree_id(worker.player_id)),
                                         worker.position, 1, worker.player_id, board)
                         board._add_tree(new_tree)
                         board._add_tree_dict(new_tree, worker.id, 0)
                         cell._carbon = 0
                         new_born_tree_ids.add(new_tree.id)
+                        events.plantings[new_tree.id] = worker.id
                     elif worker.is_collector and delta_carbon > 0:
                         # 此处 co2数目大于0 且当前停留方是捕碳员 (捕碳逻辑)
                         cell._carbon = max(cell._carbon - delta_carbon, 0)
@@ -1128,17 +1337,20 @@ class Board:
                         # 此处 当前停留方不是树的归属方,且为种树员,且当前停留方金额超过抢树金额
                         worker.player._cash -= configuration.seize_cost
                         org_tree_id, org_tree_age = cell.tree_id, cell.tree.age
+                        events.seizures[org_tree_id] = (worker.id, cell.tree.player_id)
                         board._delete_tree(cell.tree)
                         new_tree = Tree(org_tree_id, cell.position, org_tree_age, worker.player_id, board)
                         board._add_tree(new_tree)
                         board._add_tree_dict(new_tree, worker.id, 0)
+        if profiler is not None:
+            profiler.lap("board.plant_seize_collect")
+            profiler.count("new_trees", len(new_born_tree_ids))
 
         # 树吸收CO2预处理
         quad_surround_tree_flag = {}  # 树的四连通区域标识, key: 坐标, value: 0-表示树不可吸收, >0-表示树可以吸收
         for tree in board.trees.values():
             cell = tree.cell
-            for surround_tree in tree.quad_surround():  # 4连通区域
-                surround_tree_position = cell.position.translate(surround_tree, configuration.size)
+            for surround_tree_position in geometry.quad_points[cell.position]:  # 4连通区域, 与quad_surround()的顺序一致
 
                 # 将所有树周围的格子都标记
                 if surround_tree_position not in quad_surround_tree_flag:
@@ -1172,8 +1384,7 @@ class Board:
                 tree_carbon += absorbed_co2  # 记入树
                 worker_carbon_reduction[worker_under_tree.id] += absorbed_co2  # 记入捕碳员
 
-            for surround_tree in tree.surround():  # 8连通区域
-                surround_tree_position = tree.cell.position.translate(surround_tree, configuration.size)
+            for surround_tree_position in geometry.octet_points[tree.position]:  # 8连通区域, 与surround()的顺序一致
                 surround_tree_cell = board.cells[surround_tree_position]
 
                 if surround_tree_cell.worker is not None and \
@@ -1191,6 +1402,7 @@ class Board:
                     board_carbon_reduction[surround_tree_position] += absorbed_co2  # 记入格子
 
             tree.player._cash += tree_carbon
+            events.absorptions[tree.id] = tree_carbon
             board._add_tree_dict(tree, board._trees_dict[tree.id][0], tree_carbon)
 
         # 树周围（网格） co2被净化
@@ -1201,11 +1413,15 @@ class Board:
                 current_value = surround_tree_cell.carbon - board_carbon_reduction[surround_tree_position]
                 surround_tree_cell._carbon = max(current_value, 0)
 
+        events.worker_absorptions = dict(worker_carbon_reduction)
+
         # 树周围（对方捕碳员）在途的CO2被净化
         for worker_id, absorbed_carbon in worker_carbon_reduction.items():
             if absorbed_carbon <= 0:
                 continue
             board.workers[worker_id]._carbon = max(board.workers[worker_id].carbon - absorbed_carbon, 0)
+        if profiler is not None:
+            profiler.lap("board.absorption")
 
         # 地图未受影响的格子CO2增长计算
         for cell in board.cells.values():
@@ -1221,6 +1437,8 @@ class Board:
                 # Lets just check and make sure.
 
             assert cell.carbon >= 0
+        if profiler is not None:
+            profiler.lap("board.regeneration")
 
         # Clear the worker's action so it doesn't repeat the same action automatically
         for worker in board.workers.values():
@@ -1235,6 +1453,10 @@ class Board:
             cell._carbon = round(cell._carbon, 3)
 
         board._step += 1
+        if profiler is not None:
+            profiler.lap("board.finalize")
+            profiler.count("workers", len(board.workers))
+            profiler.count("trees", len(board.trees))
 
         return board
 
@@ -1,45 +1,86 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
 
-import threading
+_prefixes = {}  # key: (player_id, kind), value: "player-{player_id}-{kind}"
 
-_rlock = threading.RLock()
+_id_pattern = re.compile(r"player-(\d+)-(\D+)(\d+)$")
 
-_id_dict = {}
 
-
-def id_gen(player_id, prefix=""):
+def format_id(player_id: int, kind: str, handle: int) -> str:
     """
-    Thread-safe ID generator for each player.
+    Returns the string id of an integer handle, e.g. format_id(0, "worker-", 3) == "player-0-worker-3".
     """
-    key = f"player-{player_id}-{prefix}"
-    global _rlock, _id_dict
-    with _rlock:
-        _id = _id_dict.get(key, 0)
-        _id_dict[key] = _id + 1
-    return f"{key}{_id}"
+    prefix = _prefixes.get((player_id, kind))
+    if prefix is None:
+        prefix = _prefixes[(player_id, kind)] = f"player-{player_id}-{kind}"
+    return prefix + str(handle)
 
 
-def new_tree_id(player_id):
+def parse_id(id_: str) -> Optional[Tuple[int, str, int]]:
     """
-    Worker ID generator for player.
+    Returns (player_id, kind, handle) of an id made by format_id, or None for any other id.
     """
-    return id_gen(player_id, "tree-")
+    match = _id_pattern.match(id_)
+    return (int(match.group(1)), match.group(2), int(match.group(3))) if match else None
 
 
-def new_worker_id(player_id):
+class IdGenerator:
     """
-    Worker ID generator for player.
+    ID generator of one game (an Environment and the boards it creates with next()), so several games can run in
+    the same process. Ids are allocated as integer handles per player and kind and formatted into string ids when
+    they are handed out. Not thread-safe: a generator belongs to a single game.
     """
-    return id_gen(player_id, "worker-")
+    __slots__ = ("_counters",)
 
+    def __init__(self, counters: Optional[Dict[Tuple[int, str], int]] = None):
+        self._counters = dict(counters) if counters else {}  # key: (player_id, kind), value: next handle
 
-def new_recrtCenter_id(player_id):
-    """
-    RecrtCenter ID generator for recrtCenter.
-    """
-    return id_gen(player_id, "recrtCenter-")
+    @classmethod
+    def from_ids(cls, ids: Iterable[str]) -> 'IdGenerator':
+        """
+        Returns a generator continuing after the largest handle of each player and kind in ids, e.g. the ids of an
+        observation. The ids of entities which are already gone are unknown and may be handed out again.
+        """
+        counters = {}
+        for id_ in ids:
+            parsed = parse_id(id_)
+            if parsed is not None:
+                player_id, kind, handle = parsed
+                counters[(player_id, kind)] = max(counters.get((player_id, kind), 0), handle + 1)
+        return cls(counters)
+
+    def copy(self) -> 'IdGenerator':
+        return IdGenerator(self._counters)
+
+    def allocate(self, player_id: int, kind: str) -> int:
+        """
+        Returns the next integer handle of a player and kind.
+        """
+        key = (player_id, kind)
+        handle = self._counters.get(key, 0)
+        self._counters[key] = handle + 1
+        return handle
+
+    def new_id(self, player_id: int, kind: str) -> str:
+        return format_id(player_id, kind, self.allocate(player_id, kind))
+
+    def new_tree_id(self, player_id: int) -> str:
+        """
+        Tree ID generator for player.
+        """
+        return self.new_id(player_id, "tree-")
+
+    def new_worker_id(self, player_id: int) -> str:
+        """
+        Worker ID generator for player.
+        """
+        return self.new_id(player_id, "worker-")
 
+    def new_recrtCenter_id(self, player_id: int) -> str:
+        """
+        RecrtCenter ID generator for player.
+        """
+        return self.new_id(player_id, "recrtCenter-")
 
-def reset():
-    global _rlock, _id_dict
-    with _rlock:
-        _id_dict.clear()
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IdGenerator) and self._counters == other._counters
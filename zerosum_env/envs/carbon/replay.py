@@ -0,0 +1,460 @@
+"""
+Binary replay files of carbon episodes, written step by step while the games are played.
+
+File layout (little endian):
+    header      magic b"CRBNRPL", format version (u8), flags (u8, bit 0: zlib compressed step records)
+    records     kind (u8), payload length (u32), payload
+    index       an INDEX record with the offsets of every episode / step record
+    trailer     offset of the INDEX record (u64), magic b"CRPLIDX"
+
+An EPISODE record holds the environment description (Environment.toJSON() without the steps) as JSON,
+followed by one STEP record per step and an END record with the final rewards / statuses.
+A step payload is a JSON meta block followed by the raw buffers of its arrays: the carbon grids and the entity
+tables of the players (recrtCenters, workers, trees) with integer id handles, everything else stays in the meta.
+Only a few cells change per step (most cells stay at maxCellCarbon), so every keyframe_interval-th step stores
+the full carbon grids and the steps in between only the changed cells: reading a step decodes at most
+keyframe_interval records. The entity tables are small and stored in full. Compressed step records in between
+keyframes use the payload of their keyframe as zlib dictionary, which removes most of the repeated meta data.
+Files of an interrupted writer have no index, ReplayReader then rebuilds it by scanning the record headers.
+"""
+import json
+import os
+import struct
+import zlib
+from typing import *
+
+import numpy as np
+
+from zerosum_env.utils import get_player, structify
+from .idgen import format_id, parse_id
+
+_MAGIC, _INDEX_MAGIC, _VERSION = b"CRBNRPL", b"CRPLIDX", 1
+_FILE_HEADER = struct.Struct("<7sBB")
+_RECORD_HEADER = struct.Struct("<BI")
+_TRAILER = struct.Struct("<Q7s")
+_META_LENGTH = struct.Struct("<I")
+_COMPRESSED = 1
+
+EPISODE, STEP, END, INDEX = 1, 2, 3, 4
+
+_entity_kinds = {"b": "recrtCenter-", "w": "worker-", "t": "tree-"}
+
+
+def _encode_ids(ids: List[str], kind: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Returns the (player, handle) arrays of ids made by IdGenerator, None if any other id is found."""
+    players, handles = np.zeros(len(ids), dtype=np.int8), np.zeros(len(ids), dtype=np.int32)
+    for i, id_ in enumerate(ids):
+        parsed = parse_id(id_) if id_ is not None else (-1, kind, -1)
+        if parsed is None or parsed[1] != kind:
+            return None
+        players[i], handles[i] = parsed[0], parsed[2]
+    return players, handles
+
+
+def _decode_ids(players: np.ndarray, handles: np.ndarray, kind: str) -> List[Optional[str]]:
+    return [format_id(player, kind, handle) if handle >= 0 else None
+            for player, handle in zip(players.tolist(), handles.tolist())]
+
+
+def _put_numbers(arrays: Dict[str, np.ndarray], name: str, values: List, dtype=np.float64) -> None:
+    """Stores a list of numbers, the ints among them (e.g. the carbon of unseen cells) are flagged by name_int."""
+    arrays[name] = np.asarray(values, dtype=dtype)
+    is_int = np.array([type(value) is int for value in values], dtype=bool)
+    if is_int.any():  # 导出的JSON与原来的一致: 0与0.0的写法不同
+        arrays[f"{name}_int"] = np.packbits(is_int)
+
+
+def _to_list(values: np.ndarray, is_int: Optional[np.ndarray]) -> List:
+    if is_int is None or not is_int.any():
+        return values.tolist()
+    return [int(value) if flag else value for value, flag in zip(values.tolist(), is_int.tolist())]
+
+
+def _get_numbers(arrays: Dict[str, np.ndarray], name: str) -> List:
+    is_int = arrays.get(f"{name}_int")
+    return _to_list(arrays[name], np.unpackbits(is_int, count=len(arrays[name])) if is_int is not None else None)
+
+
+def _put_grid(arrays: Dict[str, np.ndarray], name: str, values: List, dtype,
+              previous: Optional[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stores a carbon grid, in full or as the cells changed since the previous grid, returns (values, is_int).
+    """
+    grid = np.asarray(values, dtype=dtype), np.array([type(value) is int for value in values], dtype=bool)
+    if previous is None or len(previous[0]) != len(grid[0]):
+        _put_numbers(arrays, name, values, dtype)
+        return grid
+    changed = np.flatnonzero((grid[0] != previous[0]) | (grid[1] != previous[1]))
+    arrays[f"{name}_index"] = changed.astype(np.uint16)
+    arrays[f"{name}_value"] = grid[0][changed]
+    if grid[1][changed].any():
+        arrays[f"{name}_value_int"] = np.packbits(grid[1][changed])
+    return grid
+
+
+def _get_grid(arrays: Dict[str, np.ndarray], name: str,
+              previous: Optional[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    if name in arrays:
+        values = arrays[name].copy()
+        is_int = arrays.get(f"{name}_int")
+        return values, np.unpackbits(is_int, count=len(values)).astype(bool) if is_int is not None else \
+            np.zeros(len(values), dtype=bool)
+    values, is_int = previous[0].copy(), previous[1].copy()
+    changed = arrays[f"{name}_index"]
+    values[changed] = arrays[f"{name}_value"]
+    value_int = arrays.get(f"{name}_value_int")
+    is_int[changed] = np.unpackbits(value_int, count=len(changed)).astype(bool) if value_int is not None else False
+    return values, is_int
+
+
+def _encode_players(players: List, trees: Dict, meta: Dict, arrays: Dict[str, np.ndarray]) -> None:
+    """Entity tables of observation.players and observation.trees."""
+    bases, workers, player_trees = [], [], []
+    for player_id, (_, player_bases, player_workers, player_tree_dict) in enumerate(players):
+        bases.extend((player_id, id_, pos) for id_, pos in player_bases.items())
+        workers.extend((player_id, id_, pos, carbon, type_) for id_, (pos, carbon, type_) in player_workers.items())
+        player_trees.extend((player_id, id_, pos, age) for id_, (pos, age) in player_tree_dict.items())
+    tree_slots = {tree[1]: slot for slot, tree in enumerate(player_trees)}
+
+    worker_types = sorted({worker[4] for worker in workers})
+    meta["players"] = {"count": [[len(p[1]), len(p[2]), len(p[3])] for p in players], "worker_types": worker_types}
+    _put_numbers(arrays, "cash", [player[0] for player in players])
+    arrays["b_pos"] = np.array([base[2] for base in bases], dtype=np.int32)
+    arrays["w_pos"] = np.array([worker[2] for worker in workers], dtype=np.int32)
+    _put_numbers(arrays, "w_carbon", [worker[3] for worker in workers])
+    arrays["w_type"] = np.array([worker_types.index(worker[4]) for worker in workers], dtype=np.int8)
+    arrays["t_pos"] = np.array([tree[2] for tree in player_trees], dtype=np.int32)
+    arrays["t_age"] = np.array([tree[3] for tree in player_trees], dtype=np.int32)
+
+    if len(trees) == len(tree_slots) and all(tree_id in tree_slots for tree_id in trees):
+        arrays["t_order"] = np.array([tree_slots[tree_id] for tree_id in trees], dtype=np.int32)
+        _put_numbers(arrays, "t_absorption", [absorption for _, absorption in trees.values()])
+        tree_workers = [worker_id for worker_id, _ in trees.values()]
+    else:  # observation.trees与玩家的树不一致, 原样保存
+        meta["trees"], tree_workers = trees, []
+
+    ids = {"b": [base[1] for base in bases], "w": [worker[1] for worker in workers],
+           "t": [tree[1] for tree in player_trees], "tw": tree_workers}
+    for prefix, entity_ids in ids.items():
+        encoded = _encode_ids(entity_ids, _entity_kinds[prefix[-1]])
+        if encoded is None:
+            meta.setdefault("ids", {})[prefix] = entity_ids
+        else:
+            arrays[f"{prefix}_player"], arrays[f"{prefix}_handle"] = encoded
+
+
+def _decode_players(meta: Dict, arrays: Dict[str, np.ndarray]) -> Tuple[List, Dict]:
+    ids = {}
+    for prefix in ("b", "w", "t", "tw"):
+        if prefix in meta.get("ids", {}):
+            ids[prefix] = meta["ids"][prefix]
+        elif f"{prefix}_handle" in arrays:
+            ids[prefix] = _decode_ids(arrays[f"{prefix}_player"], arrays[f"{prefix}_handle"], _entity_kinds[prefix[-1]])
+
+    worker_types = meta["players"]["worker_types"]
+    b_pos, w_pos, w_carbon = arrays["b_pos"].tolist(), arrays["w_pos"].tolist(), _get_numbers(arrays, "w_carbon")
+    w_type, t_pos, t_age = arrays["w_type"].tolist(), arrays["t_pos"].tolist(), arrays["t_age"].tolist()
+    players, b, w, t = [], 0, 0, 0
+    for cash, (n_bases, n_workers, n_trees) in zip(_get_numbers(arrays, "cash"), meta["players"]["count"]):
+        players.append([
+            cash,
+            {ids["b"][i]: b_pos[i] for i in range(b, b + n_bases)},
+            {ids["w"][i]: [w_pos[i], w_carbon[i], worker_types[w_type[i]]] for i in range(w, w + n_workers)},
+            {ids["t"][i]: [t_pos[i], t_age[i]] for i in range(t, t + n_trees)},
+        ])
+        b, w, t = b + n_bases, w + n_workers, t + n_trees
+
+    if "trees" in meta:
+        return players, meta["trees"]
+    tree_ids = ids["t"]
+    trees = {tree_ids[slot]: [worker_id, absorption] for slot, worker_id, absorption in
+             zip(arrays["t_order"].tolist(), ids["tw"], _get_numbers(arrays, "t_absorption"))}
+    return players, trees
+
+
+def encode_step(states: List[Dict], carbon_dtype=np.float32, previous_grids: Optional[Dict] = None) -> \
+        Tuple[Dict, Dict[str, np.ndarray], Dict]:
+    """
+    Splits the agent states of a step (env.steps[t]) into a JSON meta dict and named numpy arrays.
+    The carbon grids are stored with carbon_dtype (np.float64 keeps the exact values), as the changes since
+    previous_grids (the grids returned for the previous step) if given.
+    :return: (meta, arrays, grids)
+    """
+    meta, arrays, grids = {"agents": [], "grids": []}, {}, {}
+    for index, state in enumerate(states):
+        observation = dict(state["observation"])
+        agent_meta = {key: value for key, value in state.items() if key != "observation"}
+        agent_meta["keys"], agent_meta["observation_keys"] = list(state), list(observation)  # 保持字典的顺序
+        for key in ("carbon", "full_carbon"):
+            if key in observation:
+                name = f"{key}_{index}"
+                previous = previous_grids.get(name) if previous_grids is not None else None
+                grids[name] = _put_grid(arrays, name, observation.pop(key), carbon_dtype, previous)
+                meta["grids"].append(name)
+        if "players" in observation:
+            _encode_players(observation.pop("players"), observation.pop("trees", {}), meta, arrays)
+        agent_meta["observation"] = observation
+        meta["agents"].append(agent_meta)
+    return meta, arrays, grids
+
+
+def decode_grids(meta: Dict, arrays: Dict[str, np.ndarray], previous_grids: Optional[Dict] = None) -> Dict:
+    """Carbon grids of a step, previous_grids are the grids of the previous step for the delta encoded ones."""
+    return {name: _get_grid(arrays, name, previous_grids.get(name) if previous_grids is not None else None)
+            for name in meta["grids"]}
+
+
+def decode_step(meta: Dict, arrays: Dict[str, np.ndarray], grids: Dict) -> List[Dict]:
+    """Inverse of encode_step, returns the agent states of the step given its grids (see decode_grids)."""
+    states = []
+    for index, agent_meta in enumerate(meta["agents"]):
+        values = dict(agent_meta["observation"])
+        for key in ("carbon", "full_carbon"):
+            if f"{key}_{index}" in grids:
+                values[key] = _to_list(*grids[f"{key}_{index}"])
+        if "players" in agent_meta["observation_keys"]:
+            values["players"], values["trees"] = _decode_players(meta, arrays)
+        observation = {key: values[key] for key in agent_meta["observation_keys"]}
+        states.append({key: observation if key == "observation" else agent_meta[key] for key in agent_meta["keys"]})
+    return states
+
+
+def _pack(meta: Dict, arrays: Dict[str, np.ndarray]) -> bytes:
+    meta = {**meta, "arrays": [[name, array.dtype.str, array.shape] for name, array in arrays.items()]}
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+    return b"".join([_META_LENGTH.pack(len(meta_bytes)), meta_bytes] +
+                    [np.ascontiguousarray(array).tobytes() for array in arrays.values()])
+
+
+def _unpack(payload: bytes) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    (meta_length,) = _META_LENGTH.unpack_from(payload)
+    offset = _META_LENGTH.size + meta_length
+    meta = json.loads(payload[_META_LENGTH.size:offset])
+    arrays = {}
+    for name, dtype, shape in meta.pop("arrays"):
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return meta, arrays
+
+
+class ReplayWriter:
+    """
+    Streams carbon episodes into a replay file, each step is written as soon as it is recorded, e.g.
+        with ReplayWriter("games.replay") as writer:
+            env.run(agents, on_step=writer.record)
+    Only the record offsets of the current file are kept in memory.
+    """
+    def __init__(self, path: str, carbon_dtype=np.float32, keyframe_interval: int = 50, compress: bool = True):
+        """
+        :param path: (str) replay file, overwritten
+        :param carbon_dtype: (numpy dtype optional) dtype of the carbon grids, np.float64 keeps the exact values
+        :param keyframe_interval: (int optional) the carbon grids are stored in full every keyframe_interval steps
+        :param compress: (bool optional) zlib compress the step records
+        """
+        self.path = path
+        self.carbon_dtype = np.dtype(carbon_dtype)
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+        self._file = open(path, "wb")
+        self._file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, _COMPRESSED if compress else 0))
+        self._index = []  # 每局: {"offset", "steps", "end"}
+        self._episode = None
+        self._last_step = None
+        self._grids = None  # 上一步的碳含量网格
+        self._keyframe = None  # 当前关键帧的数据, 作为之后step的压缩字典
+
+    def _write_record(self, kind: int, payload: bytes) -> int:
+        offset = self._file.tell()
+        self._file.write(_RECORD_HEADER.pack(kind, len(payload)))
+        self._file.write(payload)
+        return offset
+
+    def begin_episode(self, env) -> None:
+        """Starts a new episode with the description of env (Environment.toJSON() without the steps)."""
+        if self._episode is not None and self._last_step is not None:
+            self.end_episode()
+        episode = {"environment": self._describe(env), "keyframe_interval": self.keyframe_interval}
+        offset = self._write_record(EPISODE, json.dumps(episode).encode())
+        self._episode = {"offset": offset, "steps": [], "end": None}
+        self._index.append(self._episode)
+
+    @staticmethod
+    def _describe(env) -> Dict:
+        spec = env.specification
+        return {
+            "id": env.id,
+            "name": spec.name,
+            "title": spec.title,
+            "description": spec.description,
+            "version": spec.version,
+            "configuration": env.configuration,
+            "specification": {key: spec[key] for key in ("action", "agents", "configuration", "info",
+                                                         "observation", "reward")},
+            "schema_version": 1,
+            "info": env.info,
+        }
+
+    def write_step(self, states: List[Dict]) -> None:
+        """Appends the agent states of a step to the current episode."""
+        keyframe = len(self._episode["steps"]) % self.keyframe_interval == 0
+        meta, arrays, self._grids = encode_step(states, self.carbon_dtype, None if keyframe else self._grids)
+        payload = _pack(meta, arrays)
+        if self.compress:
+            if keyframe:
+                self._keyframe, payload = payload, zlib.compress(payload)
+            else:
+                compressor = zlib.compressobj(zdict=self._keyframe)
+                payload = compressor.compress(payload) + compressor.flush()
+        self._episode["steps"].append(self._write_record(STEP, payload))
+
+    def end_episode(self, states: Optional[List[Dict]] = None) -> None:
+        """Ends the current episode, the rewards / statuses come from the last agent states."""
+        states = states if states is not None else self._last_step
+        end = {"rewards": [state["reward"] for state in states], "statuses": [state["status"] for state in states]}
+        self._episode["end"] = self._write_record(END, json.dumps(end).encode())
+        self._episode, self._last_step = None, None
+        self._file.flush()
+
+    def record(self, env) -> None:
+        """
+        Writes the current step of env (env.steps[-1]), starting a new episode after a reset and ending it when
+        env is done. Works with any history option of the environment.
+        """
+        states = env.steps[-1]
+        if self._episode is None or states[0].observation.step == 0:
+            self.begin_episode(env)
+        self.write_step(states)
+        self._last_step = states
+        if env.done:
+            self.end_episode(states)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        if self._episode is not None and self._last_step is not None:
+            self.end_episode()
+        offset = self._write_record(INDEX, json.dumps(self._index).encode())
+        self._file.write(_TRAILER.pack(offset, _INDEX_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReplayReader:
+    """
+    Random access to the episodes of a replay file: reader.step(k, t) reads step t of episode k only.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        magic, version, flags = _FILE_HEADER.unpack(self._file.read(_FILE_HEADER.size))
+        if magic != _MAGIC or version > _VERSION:
+            raise ValueError(f"{path} is not a carbon replay file (version {_VERSION}).")
+        self.compressed = bool(flags & _COMPRESSED)
+        self._index = self._read_index()
+
+    def _read_index(self) -> List[Dict]:
+        file_size = self._file.seek(0, os.SEEK_END)
+        if file_size >= _FILE_HEADER.size + _TRAILER.size:
+            self._file.seek(file_size - _TRAILER.size)
+            offset, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+            if magic == _INDEX_MAGIC:
+                return json.loads(self._read_record(offset, INDEX))
+
+        # 文件未正常关闭: 扫描记录头重建索引, 忽略最后一条不完整的记录
+        index, offset = [], _FILE_HEADER.size
+        while offset + _RECORD_HEADER.size <= file_size:
+            self._file.seek(offset)
+            kind, length = _RECORD_HEADER.unpack(self._file.read(_RECORD_HEADER.size))
+            if offset + _RECORD_HEADER.size + length > file_size:
+                break
+            if kind == EPISODE:
+                index.append({"offset": offset, "steps": [], "end": None})
+            elif kind == STEP:
+                index[-1]["steps"].append(offset)
+            elif kind == END:
+                index[-1]["end"] = offset
+            offset += _RECORD_HEADER.size + length
+        return index
+
+    def _read_record(self, offset: int, expected_kind: int) -> bytes:
+        self._file.seek(offset)
+        kind, length = _RECORD_HEADER.unpack(self._file.read(_RECORD_HEADER.size))
+        assert kind == expected_kind, f"Corrupted replay file {self.path} at offset {offset}."
+        return self._file.read(length)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def n_steps(self, episode: int) -> int:
+        return len(self._index[episode]["steps"])
+
+    def _episode_record(self, episode: int) -> Dict:
+        return json.loads(self._read_record(self._index[episode]["offset"], EPISODE))
+
+    def description(self, episode: int) -> Dict:
+        """Environment description of an episode (Environment.toJSON() without the steps)."""
+        return self._episode_record(episode)["environment"]
+
+    def _read_steps(self, episode: int, start: int, stop: int) -> Iterator[Tuple[Dict, Dict, Dict]]:
+        """(meta, arrays, grids) of the steps [start, stop) of an episode, start must be a keyframe."""
+        offsets, keyframe_interval = self._index[episode]["steps"], self._episode_record(episode)["keyframe_interval"]
+        grids, keyframe = None, None
+        for step in range(start, stop):
+            payload = self._read_record(offsets[step], STEP)
+            if self.compressed:
+                if step % keyframe_interval == 0:
+                    payload = keyframe = zlib.decompress(payload)
+                else:
+                    decompressor = zlib.decompressobj(zdict=keyframe)
+                    payload = decompressor.decompress(payload) + decompressor.flush()
+            meta, arrays = _unpack(payload)
+            grids = decode_grids(meta, arrays, grids)
+            yield meta, arrays, grids
+
+    def step(self, episode: int, step: int) -> List[Dict]:
+        """Agent states of a step, the same as env.steps[step] of the recorded environment."""
+        keyframe_interval = self._episode_record(episode)["keyframe_interval"]
+        for meta, arrays, grids in self._read_steps(episode, step - step % keyframe_interval, step + 1):
+            pass  # 从关键帧开始恢复碳含量网格
+        return structify(decode_step(meta, arrays, grids))
+
+    def steps(self, episode: int) -> Iterator[List[Dict]]:
+        """Agent states of every step of an episode, in order."""
+        for meta, arrays, grids in self._read_steps(episode, 0, self.n_steps(episode)):
+            yield structify(decode_step(meta, arrays, grids))
+
+    def to_json(self, episode: int) -> Dict:
+        """Exports an episode in the format of Environment.toJSON(), e.g. for the HTML player."""
+        description, steps = self.description(episode), list(self.steps(episode))
+        end = self._index[episode]["end"]
+        if end is not None:
+            end = json.loads(self._read_record(end, END))
+        else:  # 未结束的对局
+            end = {"rewards": [state["reward"] for state in steps[-1]],
+                   "statuses": [state["status"] for state in steps[-1]]}
+        # 与Environment.toJSON()的字段顺序一致
+        head = {key: description.pop(key) for key in list(description) if key not in ("schema_version", "info")}
+        return {**head, "steps": steps, **end, **description}
+
+    def to_html(self, episode: int, **kwargs) -> str:
+        """Renders an episode with the HTML player, like env.render(mode="html")."""
+        from .carbon import html_renderer
+        window_kaggle = {"debug": False, "playing": False, "step": 0, "controls": True,
+                         "environment": self.to_json(episode), "logs": [], **kwargs}
+        return get_player(window_kaggle, html_renderer())
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
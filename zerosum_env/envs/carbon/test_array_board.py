@@ -0,0 +1,96 @@
+import copy
+import random
+
+from zerosum_env import make
+from zerosum_env.envs.carbon.array_board import ArrayBoard
+from zerosum_env.envs.carbon.helpers import Board
+
+
+def random_actions(observation, rng):
+    actions = []
+    for _, recrtCenters, workers, _ in observation["players"]:
+        player_actions = {}
+        for worker_id in workers:
+            action = rng.choice([None, None, "UP", "RIGHT", "DOWN", "LEFT"])
+            if action is not None:
+                player_actions[worker_id] = action
+        for recrtCenter_id in recrtCenters:
+            action = rng.choice([None, "RECCOLLECTOR", "RECPLANTER", "RECPLANTER"])
+            if action is not None:
+                player_actions[recrtCenter_id] = action
+        actions.append(player_actions)
+    return actions
+
+
+def initial_observation(env):
+    observation = copy.deepcopy(env.steps[-1][0].observation)
+    observation.carbon = observation.full_carbon
+    del observation["full_carbon"]
+    return observation
+
+
+def assert_same_observation(array_observation, observation):
+    # 除了数值相等, 字典的顺序也需要与 Board 保持一致
+    assert array_observation == observation
+    assert list(array_observation["trees"]) == list(observation["trees"])
+    for array_player, player in zip(array_observation["players"], observation["players"]):
+        assert list(array_player[2]) == list(player[2])
+        assert list(array_player[3]) == list(player[3])
+
+
+class TestArrayBoard:
+    def setup_class(self):
+        # 缩短树的寿命并提高初始资金, 覆盖种树、抢树、树枯萎等逻辑
+        self.configuration = {"treeLifespan": 12, "startingCarbon": 4000, "moveCost": 0.1}
+
+    def play(self, seed, n_games=1):
+        rng = random.Random(seed)
+        observations = []
+        for game in range(n_games):
+            env = make("carbon", configuration={**self.configuration, "randomSeed": seed + game})
+            env.reset(2)
+            observations.append(initial_observation(env))
+        return rng, env.configuration, observations
+
+    def test_same_as_board(self):
+        for seed in range(3):
+            rng, configuration, [observation] = self.play(seed)
+            for _ in range(100):
+                actions = random_actions(observation, rng)
+                next_observation = Board(observation, configuration, actions).next().observation
+
+                array_observation = ArrayBoard([observation], configuration, [actions]).next().observation
+                assert_same_observation(array_observation, next_observation)
+                observation = next_observation
+
+    def test_batched_games(self):
+        rng, configuration, observations = self.play(seed=7, n_games=4)
+        array_board = ArrayBoard(observations, configuration)
+        boards = [Board(observation, configuration) for observation in observations]
+        for _ in range(100):
+            actions = [random_actions(observation, rng) for observation in observations]
+            # 每局沿用自己的id生成器
+            boards = [Board(board.observation, configuration, game_actions, board.id_generator).next()
+                      for board, game_actions in zip(boards, actions)]
+            observations = [board.observation for board in boards]
+
+            array_board.set_next_actions(actions)
+            array_board = array_board.next()
+            for array_observation, observation in zip(array_board.observations(), observations):
+                assert_same_observation(array_observation, observation)
+
+    def test_select_and_advance(self):
+        rng, configuration, observations = self.play(seed=11, n_games=3)
+        array_board = ArrayBoard(observations, configuration)
+        selected = array_board.select([2, 0, 2])
+        assert selected.n_games == 3
+        assert selected.observations() == [observations[2], observations[0], observations[2]]
+
+        for _ in range(50):
+            actions = [random_actions(observation, rng) for observation in selected.observations()]
+            selected.set_next_actions(actions)
+            expected_observations = selected.next().observations()
+
+            selected.advance()
+            assert selected.observations() == expected_observations
+        assert array_board.observations() == observations  # 原来的对局不受影响
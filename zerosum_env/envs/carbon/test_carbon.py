@@ -0,0 +1,325 @@
+import copy
+import json
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from zerosum_env import core, evaluate, make, profiling, Evaluator
+from zerosum_env.errors import FailedPrecondition
+from zerosum_env.profiling import StepProfiler
+from zerosum_env.envs.carbon.helpers import Board, WorkerAction
+from zerosum_env.envs.carbon.test_array_board import initial_observation, random_actions
+
+
+def play(trusted, seed, n_steps=120, history="full"):
+    rng = random.Random(seed)
+    np.random.seed(seed)  # 碳的再生使用全局随机数
+    env = make("carbon", configuration={"randomSeed": seed, "treeLifespan": 12}, trusted=trusted,
+               history=history)
+    env.reset(2)
+    for _ in range(n_steps):
+        if env.done:
+            break
+        env.step(random_actions(env.steps[-1][0].observation, rng))
+    return env
+
+
+def deepcopy_shared_state(env, position):
+    # 原先基于deepcopy的实现, 作为对照
+    def update_props(shared_state, state, schema_props):
+        for k, prop in schema_props.items():
+            if prop.get("hidden", False):
+                if k in state:
+                    del state[k]
+            elif prop.get("shared", False):
+                state[k] = shared_state[k]
+            elif "properties" in prop:
+                update_props(shared_state[k], state[k], prop["properties"])
+        return state
+
+    return update_props(env.states[0], copy.deepcopy(env.states[position]),
+                        env._Environment__state_schema.properties)
+
+
+class TestCarbon:
+    def test_trusted_mode(self):
+        for seed in range(2):
+            env = play(trusted=False, seed=seed)
+            trusted_env = play(trusted=True, seed=seed)
+            assert json.dumps(trusted_env.toJSON()["steps"]) == json.dumps(env.toJSON()["steps"])
+
+    def test_trusted_mode_keeps_history(self):
+        # 仅浅拷贝state, 历史的state不能被之后的step修改
+        env = play(trusted=True, seed=0, n_steps=10)
+        steps = json.dumps(env.steps)
+        env.step(random_actions(env.steps[-1][0].observation, random.Random(0)))
+        assert json.dumps(env.steps[:-1]) == steps
+
+    def test_bounded_history(self):
+        env = play(trusted=False, seed=0)
+        for history, n_steps in (("none", 1), (5, 5)):
+            bounded_env = play(trusted=True, seed=0, history=history)
+            assert len(bounded_env.steps) == len(bounded_env.logs) == n_steps
+            assert json.dumps(bounded_env.steps) == json.dumps(env.steps[-n_steps:])
+
+    def test_shared_state(self):
+        env = play(trusted=False, seed=0, n_steps=0)
+        rng = random.Random(0)
+        for _ in range(30):
+            states = json.dumps(env.steps)
+            for position in range(2):
+                shared_state = env._Environment__get_shared_state(position)
+                assert shared_state == deepcopy_shared_state(env, position)
+                assert "full_carbon" not in shared_state.observation
+            assert json.dumps(env.steps) == states
+            env.step(random_actions(env.steps[-1][0].observation, rng))
+
+    def test_evaluator(self):
+        configuration = {"episodeSteps": 40}
+        with Evaluator("carbon", ["random", "random"], configuration, trusted=True) as evaluator:
+            rewards, jsons, _, _ = evaluator.evaluate(num_episodes=3, seed=5)
+            assert evaluator.evaluate(num_episodes=1, seed=5)[0] == rewards[:1]  # 同一环境可重复使用
+
+            # 按需渲染: Episode保留各局的steps, 下一局不会修改
+            episodes = evaluator.evaluate(num_episodes=3, seed=5, record="episodes")
+            assert [episode.rewards for episode in episodes] == rewards
+            assert [json.dumps(episode.toJSON()) for episode in episodes] == [json.dumps(j) for j in jsons]
+            assert "window.kaggle" in episodes[0].render(mode="html")
+            summaries = evaluator.evaluate(num_episodes=3, seed=5, record="rewards")
+            assert [summary.rewards for summary in summaries] == rewards
+            assert all(status == "DONE" for summary in summaries for status in summary.statuses)
+            with pytest.raises(FailedPrecondition):
+                summaries[0].toJSON()
+        parallel_rewards, parallel_jsons, _, _ = evaluate("carbon", ["random", "random"], configuration,
+                                                          num_episodes=3, n_workers=2)
+        assert len(parallel_rewards) == len(parallel_jsons) == 3
+
+        with Evaluator("carbon", ["random", "random"], configuration, n_workers=2, trusted=True) as evaluator:
+            assert evaluator.evaluate(num_episodes=3, seed=5)[0] == rewards
+            summaries = evaluator.evaluate(num_episodes=3, seed=5, record="rewards")
+            assert [summary.rewards for summary in summaries] == rewards
+
+    def test_new_map_per_episode(self):
+        def full_carbon(states):
+            return tuple(states[0].observation.full_carbon)
+
+        # 未指定种子: 每次重置都抽取新的种子
+        env = make("carbon", trusted=True)
+        maps = {full_carbon(env.reset(2)) for _ in range(3)}
+        assert len(maps) == 3
+        # 手动指定的种子不会被替换
+        env.configuration.randomSeed = 7
+        assert full_carbon(env.reset(2)) == full_carbon(env.reset(2)) and env.configuration.randomSeed == 7
+
+        # 指定了种子的多局评估: 第i局使用episode_seed(seed, i), 与训练环境的第i局相同
+        episodes = evaluate("carbon", ["random", "random"], {"randomSeed": 5, "episodeSteps": 3}, num_episodes=3,
+                            record="episodes")
+        assert [episode.configuration.randomSeed for episode in episodes] == [core.episode_seed(5, i)
+                                                                              for i in range(3)]
+        assert len({full_carbon(episode.steps[0]) for episode in episodes}) == 3
+
+    def test_initial_state_cache(self):
+        core.clear_initial_state_cache()
+        np.random.seed(0)
+        random_state = np.random.get_state()[1].copy()
+        env = make("carbon", configuration={"randomSeed": 3}, trusted=True)
+        assert (np.random.get_state()[1] == random_state).all()  # 初始地图不使用全局随机数
+        initial_state = json.dumps(env.steps[-1])
+
+        # 已缓存的初始状态被复制, 对局不会修改缓存
+        env.step(random_actions(env.steps[-1][0].observation, random.Random(0)))
+        assert json.dumps(env.reset(2)) == initial_state
+        env.steps[-1][0].observation.carbon[0] = -1
+        assert json.dumps(make("carbon", configuration={"randomSeed": 3}).steps[-1]) == initial_state
+
+        core.clear_initial_state_cache()
+        assert json.dumps(make("carbon", configuration={"randomSeed": 3}).steps[-1]) == initial_state
+        assert json.dumps(make("carbon", configuration={"randomSeed": 4}).steps[-1]) != initial_state
+
+        # 未指定种子的重置不会写入缓存 (抽取的种子不会再命中)
+        n_cached = len(core._initial_states)
+        env = make("carbon", trusted=True)
+        env.reset(2)
+        assert len(core._initial_states) == n_cached
+
+    def test_seeded_map(self):
+        # 地图由randomSeed创建的随机数生成器生成 (不再使用全局的np.random), 同一种子的地图与旧版本不同
+        carbon = np.array(make("carbon", configuration={"randomSeed": 0}, trusted=True).steps[-1][0]
+                          .observation.full_carbon)
+        assert carbon.sum() == 2001
+        assert np.flatnonzero(carbon)[:6].tolist() == [1, 2, 6, 7, 8, 12]
+        assert carbon[[1, 2, 6]].tolist() == [31, 28, 39]
+
+    def test_games_in_one_process(self):
+        # 每个环境有自己的id生成器: 重置另一个环境不会使本局的id重复
+        rng = random.Random(0)
+        configuration = {"randomSeed": 0, "recCollectorCost": 1, "recPlanterCost": 1}  # 频繁招募工人
+        env, other_env = make("carbon", configuration, trusted=True), make("carbon", configuration, trusted=True)
+        env.reset(2)
+        seen_ids, previous_ids = set(), set()
+        for step in range(80):
+            if env.done:
+                break
+            if step % 20 == 0 or other_env.done:
+                other_env.reset(2)
+            _, _, workers, trees = env.steps[-1][0].observation.players[0]
+            ids = set(workers) | set(trees)
+            assert not (ids - previous_ids) & seen_ids  # 新出现的工人/树的id从未被使用过
+            seen_ids |= ids
+            previous_ids = ids
+            env.step(random_actions(env.steps[-1][0].observation, rng))
+            other_env.step(random_actions(other_env.steps[-1][0].observation, rng))
+        assert len(seen_ids) > 10
+
+        # clone()复制id生成器: 复制的环境不会重新分配已消失的工人/树的id
+        clone = env.clone()
+        assert clone.interpreter_state.id_generator == env.interpreter_state.id_generator
+        assert clone.interpreter_state.id_generator is not env.interpreter_state.id_generator
+        for _ in range(40):  # 与原环境执行相同的动作, 分配相同的id
+            actions = random_actions(env.steps[-1][0].observation, rng)
+            env.step(actions)
+            clone.step(actions)
+            assert json.dumps(clone.steps[-1][0].observation) == json.dumps(env.steps[-1][0].observation)
+
+    def test_board_indexes(self):
+        def assert_indexes(board):
+            workers = board.workers.values()
+            assert list(board.collectors.values()) == [worker for worker in workers if worker.is_collector]
+            assert list(board.planters.values()) == [worker for worker in workers if worker.is_planter]
+            for player in board.players.values():
+                player_workers = [board.workers[worker_id] for worker_id in player.worker_ids]
+                assert player.workers == player_workers and player.worker_count == len(player_workers)
+                assert player.collectors == [worker for worker in player_workers if worker.is_collector]
+                assert player.planters == [worker for worker in player_workers if worker.is_planter]
+                assert player.trees == [board.trees[tree_id] for tree_id in player.tree_ids]
+            worker_tree_ids = {}
+            for tree_id, (worker_id, _) in board._trees_dict.items():
+                if worker_id is not None:
+                    worker_tree_ids.setdefault(worker_id, set()).add(tree_id)
+            assert board._worker_tree_ids == worker_tree_ids
+
+        env = play(trusted=True, seed=0, n_steps=0)
+        board = Board(initial_observation(env), env.configuration)
+        rng = random.Random(0)
+        for _ in range(150):
+            assert_indexes(board)
+            board = Board(board.observation, board.configuration, random_actions(board.observation, rng)).next()
+
+        # 修改返回的dict不影响board的索引
+        collectors, planters = board.collectors, board.planters
+        collectors.clear()
+        planters.clear()
+        assert_indexes(board)
+        assert len(board.collectors) + len(board.planters) == len(board.workers) > 0
+
+    def test_fork_and_restore(self):
+        def rebuild(board):  # 原先基于observation的deepcopy, 作为对照
+            return Board(board.observation, board.configuration,
+                         [player.next_actions for player in board.players.values()], board.id_generator.copy())
+
+        def assert_same_board(board, expected):
+            assert json.dumps(board.observation) == json.dumps(expected.observation)
+            assert [player.next_actions for player in board.players.values()] == \
+                [player.next_actions for player in expected.players.values()]
+            assert list(board.workers) == list(expected.workers) and list(board.trees) == list(expected.trees)
+            for position, cell in expected.cells.items():
+                assert (cell.worker_id, cell.tree_id, cell.recrtCenter_id) == \
+                    (board.cells[position].worker_id, board.cells[position].tree_id,
+                     board.cells[position].recrtCenter_id)
+
+        env = play(trusted=True, seed=1, n_steps=0)
+        board = Board(initial_observation(env), env.configuration)
+        rng = random.Random(1)
+        for _ in range(100):
+            # next()生成的Board未经observation重建, 实体的顺序与重建后的不同
+            board = Board(board.observation, board.configuration, random_actions(board.observation, rng)).next()
+            board = Board(board.observation, board.configuration, random_actions(board.observation, rng)).next()
+            for worker in board.workers.values():
+                worker.next_action = rng.choice([None, *WorkerAction.moves()])
+
+            fork = board.fork()
+            assert_same_board(fork, rebuild(board))
+            assert_same_board(fork.next(), rebuild(board).next())
+
+            snapshot = board.snapshot()
+            expected_next = json.dumps(board.next().observation)
+            for _ in range(2):
+                for worker in fork.workers.values():
+                    worker.next_action = None
+                fork = fork.next()
+                fork.restore(snapshot)
+                assert_same_board(fork, snapshot)
+                assert all(cell._board is fork for cell in fork.cells.values())
+                assert json.dumps(fork.next().observation) == expected_next
+
+    def test_step_events(self):
+        env = play(trusted=True, seed=1, n_steps=0)
+        board = Board(initial_observation(env), env.configuration)
+        assert board.events is None
+        rng = random.Random(1)
+        for _ in range(150):
+            previous = Board(board.observation, board.configuration, random_actions(board.observation, rng))
+            board = previous.next()
+            events = board.events
+            assert previous.fork().events is None and board.view(board.observation).events is events
+
+            assert set(events.worker_actions) == set(previous.workers)
+            for worker_id, action in events.worker_actions.items():
+                assert action == previous.workers[worker_id].next_action
+                if worker_id in board.workers:
+                    moved = previous.workers[worker_id].position if action is None else \
+                        (previous.workers[worker_id].position + action.to_point()) % env.configuration.size
+                    assert board.workers[worker_id].position == moved
+            for recrtCenter_id, (worker_id, action) in events.recruits.items():
+                assert action == previous.recrtCenters[recrtCenter_id].next_action
+                assert worker_id in board.workers or worker_id in events.destroyed
+            assert set(previous.workers) | {worker_id for worker_id, _ in events.recruits.values()} == \
+                set(board.workers) | set(events.destroyed)
+            for position, worker_ids in events.collisions.items():
+                assert len(worker_ids) > 1 and all(worker_id in events.destroyed or
+                                                   board.cells[position].worker_id == worker_id
+                                                   for worker_id in worker_ids)
+            assert all(board.trees[tree_id].player_id == board.workers[worker_id].player_id
+                       for tree_id, worker_id in {**events.plantings,
+                                                  **{k: v[0] for k, v in events.seizures.items()}}.items())
+            assert not set(events.withered) & set(board.trees)
+
+    def test_step_profiler(self):
+        class SummaryWriter:  # 记录写入的tag
+            def __init__(self):
+                self.tags = []
+
+            def add_scalar(self, tag, value, global_step):
+                self.tags.append(tag)
+
+            add_histogram = add_scalar
+
+        for trusted in (False, True):
+            env = play(trusted=trusted, seed=0, n_steps=0)
+            profiler = StepProfiler()
+            with profiler:
+                assert profiling.active() is profiler
+                Board(initial_observation(env), env.configuration).next()  # step之外的Board.next不记录
+                assert profiler.n_steps == 0 and not profiler.times
+                n_steps = len(play(trusted=trusted, seed=0, n_steps=30).steps) - 1
+            assert profiling.active() is None
+            play(trusted=trusted, seed=0, n_steps=5)
+            assert profiler.n_steps == n_steps == 30
+
+            report = profiler.report()
+            assert {"env.actions", "env.structify", "interpreter.board", "board.copy", "board.collision",
+                    "board.regeneration", "interpreter.visibility"} <= set(report["time_ms"])
+            assert all(phase["n"] == n_steps for phase in report["time_ms"].values())
+            assert abs(sum(phase["share"] for phase in report["time_ms"].values()) - 1) < 1e-6
+            assert {"collisions", "workers", "trees", "new_trees"} == set(report["counts"])
+
+            # worker进程的profiler通过pickle传回, 与主进程的合并
+            merged = StepProfiler().merge(pickle.loads(pickle.dumps(profiler))).merge(profiler)
+            assert merged.n_steps == 2 * n_steps
+            assert merged.report()["time_ms"]["board.copy"]["n"] == 2 * n_steps
+
+            writer = SummaryWriter()
+            profiler.write_tensorboard(writer, 0)
+            assert "profile/time_ms/board.copy" in writer.tags and "profile/count/workers" in writer.tags
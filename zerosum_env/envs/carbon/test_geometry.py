@@ -0,0 +1,53 @@
+from zerosum_env.helpers import Point
+from zerosum_env.envs.carbon.carbon import get_to_pos
+from zerosum_env.envs.carbon.geometry import ConnectedField4, ConnectedField8, Directions, get_geometry
+
+
+def reference_get_to_pos(size, pos, direction):
+    col, row = pos % size, pos // size
+    if direction == "UP":
+        return pos - size if pos >= size else size ** 2 - size + col
+    elif direction == "DOWN":
+        return col if pos + size >= size ** 2 else pos + size
+    elif direction == "RIGHT":
+        return pos + 1 if col < size - 1 else row * size
+    elif direction == "LEFT":
+        return pos - 1 if col > 0 else (row + 1) * size - 1
+
+
+def reference_distance(point_1, point_2, size):
+    dx, dy = abs(point_1.x - point_2.x), abs(point_1.y - point_2.y)
+    return min(dx, size - dx) + min(dy, size - dy)
+
+
+class TestGeometry:
+    def test_tables(self):
+        for size in (3, 15):
+            geometry = get_geometry(size)
+            xy_distances = geometry.xy_distances
+            assert get_geometry(size) is geometry
+            assert geometry.distances.shape == (size * size, size * size)
+            assert [point for point, _ in geometry.cells] == [Point(x, y) for x in range(size) for y in range(size)]
+
+            for index, point in enumerate(geometry.points):
+                assert point == Point.from_index(index, size) and geometry.indices[point] == index
+                assert geometry.quad_points[point] == [point.translate(offset, size) for offset in ConnectedField4]
+                assert geometry.octet_points[point] == [point.translate(offset, size) for offset in ConnectedField8]
+                assert geometry.quad[index].tolist() == [p.to_index(size) for p in geometry.quad_points[point]]
+                assert geometry.octet[index].tolist() == [p.to_index(size) for p in geometry.octet_points[point]]
+                assert geometry.move_points[point][0] == point and geometry.move_code(point, point) == 0
+
+                for code, (direction, offset) in enumerate(zip(Directions, ConnectedField4), start=1):
+                    target = point.translate(offset, size)
+                    assert geometry.translate(point, direction) == geometry.translate(point, offset) == target
+                    assert geometry.move[index, code] == get_to_pos(size, index, direction) \
+                        == reference_get_to_pos(size, index, direction)
+                    if size > 2:
+                        assert geometry.move_code(point, target) == code
+
+                for other in geometry.points:
+                    expected = reference_distance(point, other, size)
+                    assert geometry.distance(point, other) == expected
+                    assert geometry.distances[index, geometry.indices[other]] == expected
+                    assert geometry.distance_xy(point.x, point.y, other.x + size, other.y - size) == expected
+                    assert xy_distances[point.x, point.y, other.x, other.y] == expected
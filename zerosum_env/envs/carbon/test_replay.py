@@ -0,0 +1,90 @@
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from zerosum_env import evaluate, make
+from zerosum_env.core import episode_seed
+from zerosum_env.errors import InvalidArgument
+from zerosum_env.envs.carbon.replay import ReplayReader, ReplayWriter
+from zerosum_env.envs.carbon.test_array_board import random_actions
+
+
+def random_agent(seed):
+    rng = random.Random(seed)
+
+    def agent(observation, configuration):
+        return random_actions(observation, rng)[observation.player]
+    return agent
+
+
+class TestReplay:
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / "games.replay")
+        np.random.seed(0)
+        envs = [make("carbon", configuration={"randomSeed": seed, "episodeSteps": 60}, trusted=True)
+                for seed in range(2)]
+        with ReplayWriter(path, carbon_dtype=np.float64, keyframe_interval=8) as writer:
+            for seed, env in enumerate(envs):
+                env.run([random_agent(seed), random_agent(seed + 10)], on_step=writer.record)
+
+        with ReplayReader(path) as reader:
+            assert len(reader) == 2
+            for episode, env in enumerate(envs):
+                expected = env.toJSON()
+                assert reader.n_steps(episode) == len(env.steps)
+                # 随机读取单个step
+                assert json.dumps(reader.step(episode, 30)) == json.dumps(env.steps[30])
+                assert json.dumps(reader.to_json(episode)) == json.dumps(expected)
+            assert "window.kaggle" in reader.to_html(1)
+
+        # 未正常关闭的文件: 扫描记录重建索引, 丢弃不完整的记录
+        with open(path, "rb") as f:
+            data = f.read()
+        truncated_path = str(tmp_path / "truncated.replay")
+        with open(truncated_path, "wb") as f:
+            f.write(data[:len(data) // 4])
+        with ReplayReader(truncated_path) as reader:
+            assert len(reader) == 1 and 0 < reader.n_steps(0) < len(envs[0].steps)
+            assert json.dumps(reader.step(0, 10)) == json.dumps(envs[0].steps[10])
+
+    def test_streaming_without_history(self, tmp_path):
+        path = str(tmp_path / "game.replay")
+        np.random.seed(0)
+        full_env = make("carbon", configuration={"randomSeed": 1, "episodeSteps": 60}, trusted=True)
+        full_env.run([random_agent(0), random_agent(1)])
+
+        np.random.seed(0)
+        env = make("carbon", configuration={"randomSeed": 1, "episodeSteps": 60}, trusted=True, history="none")
+        with ReplayWriter(path) as writer:  # float32的碳含量
+            env.run([random_agent(0), random_agent(1)], on_step=writer.record)
+
+        with ReplayReader(path) as reader:
+            replay = reader.to_json(0)
+        expected = full_env.toJSON()
+        assert len(replay["steps"]) == len(expected["steps"]) and replay["rewards"] == expected["rewards"]
+        for step, expected_step in zip(replay["steps"], expected["steps"]):
+            carbon = step[0]["observation"].pop("full_carbon")
+            expected_carbon = expected_step[0]["observation"].pop("full_carbon")
+            assert np.allclose(carbon, expected_carbon, rtol=1e-6)
+            for state, expected_state in zip(step, expected_step):
+                state["observation"]["carbon"] = expected_state["observation"]["carbon"]
+            assert step == expected_step
+        assert os.path.getsize(path) < len(json.dumps(expected)) / 2.5
+
+    def test_evaluate_to_replay(self, tmp_path):
+        path = str(tmp_path / "evaluate.replay")
+        with ReplayWriter(path) as writer:
+            episodes = evaluate("carbon", [random_agent(0), random_agent(1)], {"randomSeed": 5, "episodeSteps": 20},
+                                num_episodes=2, record="rewards", replay_writer=writer)
+
+        with ReplayReader(path) as reader:
+            assert len(reader) == 2
+            for i, episode in enumerate(episodes):
+                assert reader.description(i)["configuration"]["randomSeed"] == episode_seed(5, i)
+                assert reader.n_steps(i) == 20
+                assert reader.to_json(i)["rewards"] == episode.rewards
+        with pytest.raises(InvalidArgument):
+            evaluate("carbon", ["random", "random"], num_episodes=2, n_workers=2, replay_writer=writer)
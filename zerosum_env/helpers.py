@@ -11,9 +11,12 @@ class Point(tuple):
     Note that this differs from arrays where the top left is (0, 0) and the bottom right is (size - 1, size - 1).
     Note that operators in this class do not constrain points to the board.
     You can generally constrain a point to the board by calling point % board.configuration.size.
+    Points are immutable, Point.from_index returns the same shared instance for every index of a board.
     """
+    __slots__ = ()
+
     def __new__(cls: Type['Point'], x: int, y: int):
-        return super(Point, cls).__new__(cls, tuple((x, y)))
+        return tuple.__new__(cls, (x, y))
 
     @property
     def x(self):
@@ -31,7 +34,7 @@ class Point(tuple):
 
     def translate(self, offset: 'Point', size: int):
         """Translates the current point by offset and wraps it around a board of width and height size"""
-        return (self + offset) % size
+        return Point((self[0] + offset[0]) % size, (self[1] + offset[1]) % size)
 
     def to_index(self, size: int):
         """
@@ -46,6 +49,11 @@ class Point(tuple):
         Converts an index in the observation.carbon list to a 2d position in the form (x, y).
         See position_to_index for the inverse.
         """
+        points = _index_points.get(size)
+        if points is None:
+            points = _index_points[size] = [Point(x, size - y - 1) for y in range(size) for x in range(size)]
+        if type(index) is int and 0 <= index < len(points):
+            return points[index]
         y, x = divmod(index, size)
         return Point(x, (size - y - 1))
 
@@ -53,7 +61,7 @@ class Point(tuple):
         return self.map(operator.abs)
 
     def __add__(self, other: Union[Tuple[int, int], 'Point']) -> 'Point':
-        return self.map2(other, operator.add)
+        return Point(self[0] + other[0], self[1] + other[1])
 
     def __eq__(self, other: Union[Tuple[int, int], 'Point']) -> bool:
         try:
@@ -64,11 +72,11 @@ class Point(tuple):
     def __floordiv__(self, denominator: int) -> 'Point':
         return self.map(lambda x: x // denominator)
 
-    def __hash__(self) -> int:
-        return hash((self.x, self.y))
+    # Same value as hash((x, y)), computed by tuple directly.
+    __hash__ = tuple.__hash__
 
     def __mod__(self, mod: int) -> 'Point':
-        return self.map(lambda x: x % mod)
+        return Point(self[0] % mod, self[1] % mod)
 
     def __mul__(self, factor: int) -> 'Point':
         return self.map(lambda x: x * factor)
@@ -80,7 +88,10 @@ class Point(tuple):
         return f"({self.x}, {self.y})"
 
     def __sub__(self, other: Union[Tuple[int, int], 'Point']) -> 'Point':
-        return self.map2(other, operator.sub)
+        return Point(self[0] - other[0], self[1] - other[1])
+
+
+_index_points = {}  # key: board size, value: Point of each index (Point.from_index)
 
 
 TItem = TypeVar('TItem')
@@ -0,0 +1,160 @@
+"""
+Phase-level profiling of environment steps.
+
+    profiler = StepProfiler()
+    with profiler:
+        env.run(agents)
+    print(profiler.report())
+
+While a profiler is active, Environment.step, the carbon interpreter and Board.next record the wall time of their
+phases and a few counts (collisions, workers, trees...) of every step. The phases of a step follow each other, so
+their times add up to the time of the step. When no profiler is active the instrumented code only reads a module
+global, a profiler is per process (see ParallelEnv.collect_profile for worker processes).
+"""
+import json
+from collections import defaultdict
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_active = None  # 当前进程中正在记录的profiler
+
+
+def active() -> Optional['StepProfiler']:
+    """
+    Returns the profiler recording in this process, None if profiling is off.
+    """
+    return _active
+
+
+def _summary(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    values = np.asarray(values, dtype=np.float64) * scale
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"n": len(values), "total": float(values.sum()), "mean": float(values.mean()), "std": float(values.std()),
+            "min": float(values.min()), "p50": float(p50), "p90": float(p90), "p99": float(p99),
+            "max": float(values.max())}
+
+
+class StepProfiler:
+    """
+    Records the wall time of every phase and the counts of every step while it is active (with profiler: ... or
+    start()/stop()). Times are kept per step in seconds, counts per step as numbers.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(list)  # key: phase, value: 每个step中该阶段的耗时
+        self.counts = defaultdict(list)  # key: 计数名, value: 每个step的计数
+        self.n_steps = 0
+        self._step_times = None  # 当前step各阶段的耗时, None表示不在step中
+        self._step_counts = None
+        self._last = 0.0  # 上一个阶段结束的时间
+        self._previous = None  # start()之前正在记录的profiler
+
+    def start(self) -> 'StepProfiler':
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def stop(self) -> None:
+        global _active
+        if _active is self:
+            _active, self._previous = self._previous, None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start_step(self) -> None:
+        self._step_times, self._step_counts = defaultdict(float), defaultdict(float)
+        self._last = perf_counter()
+
+    def end_step(self) -> None:
+        if self._step_times is None:
+            return
+        for phase, seconds in self._step_times.items():
+            self.times[phase].append(seconds)
+        for name, value in self._step_counts.items():
+            self.counts[name].append(value)
+        self.n_steps += 1
+        self._step_times = self._step_counts = None
+
+    def mark(self) -> None:
+        """
+        Starts the next phase now, the time since the end of the previous phase is not recorded.
+        """
+        self._last = perf_counter()
+
+    def lap(self, phase: str) -> None:
+        """
+        Ends a phase: adds the time since the end of the previous phase to it. Phases outside of a step (e.g. the
+        boards agents simulate between two steps) are ignored.
+        """
+        if self._step_times is not None:
+            now = perf_counter()
+            self._step_times[phase] += now - self._last
+            self._last = now
+
+    def count(self, name: str, value: float = 1) -> None:
+        if self._step_counts is not None:
+            self._step_counts[name] += value
+
+    def merge(self, other: 'StepProfiler') -> 'StepProfiler':
+        """
+        Adds the steps recorded by another profiler, e.g. the one of a worker process.
+        """
+        for phase, values in other.times.items():
+            self.times[phase].extend(values)
+        for name, values in other.counts.items():
+            self.counts[name].extend(values)
+        self.n_steps += other.n_steps
+        return self
+
+    def reset(self) -> None:
+        self.times.clear()
+        self.counts.clear()
+        self.n_steps = 0
+
+    def __getstate__(self):
+        return {"times": dict(self.times), "counts": dict(self.counts), "n_steps": self.n_steps}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.times.update(state["times"])
+        self.counts.update(state["counts"])
+        self.n_steps = state["n_steps"]
+
+    def report(self) -> Dict:
+        """
+        Returns the distribution over the steps of the time of every phase (milliseconds, share of the total step
+        time) and of every count.
+        """
+        phases = {phase: _summary(values, 1000) for phase, values in self.times.items() if values}
+        total = sum(phase["total"] for phase in phases.values())
+        for phase in phases.values():
+            phase["share"] = phase["total"] / total if total > 0 else 0.0
+        return {
+            "steps": self.n_steps,
+            "time_ms": dict(sorted(phases.items(), key=lambda item: -item[1]["total"])),
+            "counts": {name: _summary(values) for name, values in sorted(self.counts.items()) if values},
+        }
+
+    def save_json(self, path: str) -> None:
+        with open(path, "w") as json_file:
+            json.dump(self.report(), json_file, indent=2)
+
+    def write_tensorboard(self, writer, global_step: int, prefix: str = "profile") -> None:
+        """
+        Writes a histogram and the mean of every phase time (ms) and count to a tensorboard(X) SummaryWriter.
+        """
+        for phase, values in self.times.items():
+            if values:
+                values = np.asarray(values) * 1000
+                writer.add_histogram(f"{prefix}/time_ms/{phase}", values, global_step)
+                writer.add_scalar(f"{prefix}/mean_ms/{phase}", values.mean(), global_step)
+        for name, values in self.counts.items():
+            if values:
+                writer.add_histogram(f"{prefix}/count/{name}", np.asarray(values), global_step)
+                writer.add_scalar(f"{prefix}/mean_count/{name}", np.mean(values), global_step)